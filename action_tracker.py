@@ -0,0 +1,243 @@
+"""
+Hetzner Action Tracker
+Polls in-flight Hetzner server creation actions in batches and moves the
+server requests waiting on them forward, so provisioning never pins a web
+worker while a server boots. sync_worker.py runs the tracker on every poll;
+without it (BACKGROUND_SYNC off) the web app tracks each submitted request
+on a daemon thread instead.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import update
+
+from app import db
+from models import ServerRequest, Notification, HetznerServer
+from hetzner_service import HetznerService
+from godaddy_service import GoDaddyService
+
+logger = logging.getLogger(__name__)
+
+# deployment_progress bands: submitted -> 20, Hetzner action 20-80, DNS -> 90, done -> 100
+PROGRESS_SUBMITTED = 20
+PROGRESS_SERVER_READY = 80
+PROGRESS_DNS = 90
+
+# In-process tracking when no sync worker runs
+TRACK_POLL_INTERVAL = 5  # seconds between polls of a project's actions
+TRACK_MAX_DURATION = 1800  # seconds before a tracking thread gives up on a stuck action
+
+_tracked_projects = set()
+_tracked_projects_lock = threading.Lock()
+
+
+def track_server_actions(project_id=None):
+    """Poll every in-flight create_server action and advance its request
+
+    Requests are grouped by project so each project's actions are fetched with
+    one batched API call per ACTION_BATCH_SIZE ids.
+    """
+    query = ServerRequest.query.filter(
+        ServerRequest.status == 'deploying',
+        ServerRequest.hetzner_action_id.isnot(None)
+    )
+    if project_id:
+        query = query.filter(ServerRequest.project_id == project_id)
+
+    requests_by_project = defaultdict(list)
+    for server_request in query.all():
+        requests_by_project[server_request.project_id].append(server_request)
+
+    summary = {'tracked': 0, 'running': 0, 'completed': 0, 'failed': 0}
+
+    for request_project_id, server_requests in requests_by_project.items():
+        try:
+            hetzner_service = HetznerService(project_id=request_project_id)
+            actions = hetzner_service.get_actions([r.hetzner_action_id for r in server_requests])
+        except Exception as e:
+            logger.error(f"Error polling Hetzner actions for project {request_project_id}: {str(e)}")
+            continue
+
+        for server_request in server_requests:
+            action = actions.get(server_request.hetzner_action_id)
+            if not action:
+                continue
+
+            summary['tracked'] += 1
+            if action['status'] == 'running':
+                progress = action.get('progress') or 0
+                server_request.deployment_progress = max(
+                    server_request.deployment_progress or 0,
+                    PROGRESS_SUBMITTED + progress * (PROGRESS_SERVER_READY - PROGRESS_SUBMITTED) // 100
+                )
+                summary['running'] += 1
+            elif action['status'] == 'success':
+                if complete_server_provisioning(server_request, hetzner_service):
+                    summary['completed'] += 1
+            else:
+                error = action.get('error') or {}
+                if fail_server_provisioning(server_request, f"Server creation failed: {error.get('message', 'unknown error')}"):
+                    summary['failed'] += 1
+
+    db.session.commit()
+    return summary
+
+
+def _has_actions_in_flight(project_id):
+    return db.session.query(
+        ServerRequest.query.filter(
+            ServerRequest.status == 'deploying',
+            ServerRequest.hetzner_action_id.isnot(None),
+            ServerRequest.project_id == project_id
+        ).exists()
+    ).scalar()
+
+
+def track_in_background(project_id):
+    """Track the project's create actions on a daemon thread until none is in flight
+
+    At most one thread per project runs in this process; trackers in other
+    processes are harmless because every request is claimed before it is advanced.
+    """
+    with _tracked_projects_lock:
+        if project_id in _tracked_projects:
+            return
+        _tracked_projects.add(project_id)
+
+    flask_app = current_app._get_current_object()
+
+    def track():
+        deadline = time.monotonic() + TRACK_MAX_DURATION
+        try:
+            with flask_app.app_context():
+                while time.monotonic() < deadline:
+                    time.sleep(TRACK_POLL_INTERVAL)
+                    try:
+                        track_server_actions(project_id=project_id)
+                        if not _has_actions_in_flight(project_id):
+                            break
+                    except Exception as e:
+                        logger.error(f"Error tracking server actions for project {project_id}: {str(e)}")
+                        db.session.rollback()
+                db.session.remove()
+        finally:
+            with _tracked_projects_lock:
+                _tracked_projects.discard(project_id)
+
+    threading.Thread(target=track, name=f'action-tracker-{project_id}', daemon=True).start()
+
+
+def _claim_action(server_request):
+    """Clear the request's action id if it is still set; False if another tracker got there first"""
+    action_id = server_request.hetzner_action_id
+    if action_id is None:
+        return True
+
+    result = db.session.execute(
+        update(ServerRequest)
+        .where(ServerRequest.id == server_request.id, ServerRequest.hetzner_action_id == action_id)
+        .values(hetzner_action_id=None),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount != 1:
+        return False
+
+    # Make the claim durable before doing the slow part of the work
+    db.session.commit()
+    return True
+
+
+def complete_server_provisioning(server_request, hetzner_service=None):
+    """Finish a request whose server is up: refresh the server record, configure DNS and notify"""
+    if not _claim_action(server_request):
+        return False
+
+    try:
+        server_ip = server_request.server_ip
+
+        # Refresh the local server record now that the server has booted
+        if server_request.hetzner_server_id:
+            hetzner_service = hetzner_service or HetznerService(project_id=server_request.project_id)
+            refresh_result = hetzner_service.refresh_servers([server_request.hetzner_server_id])
+            if not refresh_result['success']:
+                logger.warning(f"Could not refresh server {server_request.hetzner_server_id}: {refresh_result['error']}")
+            local_server = HetznerServer.query.filter_by(hetzner_id=server_request.hetzner_server_id).first()
+            if local_server and local_server.public_ip:
+                server_ip = local_server.public_ip
+
+        server_request.server_ip = server_ip
+        server_request.deployment_progress = PROGRESS_SERVER_READY
+
+        # Configure DNS if base domain exists
+        if server_request.project.base_domain and server_request.subdomain:
+            logger.info(f"Configuring DNS for {server_request.subdomain}.{server_request.project.base_domain}")
+
+            godaddy_service = GoDaddyService()
+            dns_result = godaddy_service.add_dns_record(
+                domain=server_request.project.base_domain,
+                subdomain=server_request.subdomain,
+                ip_address=server_ip
+            )
+            server_request.deployment_progress = PROGRESS_DNS
+
+            if dns_result['success']:
+                logger.info(f"DNS record created successfully: {server_request.subdomain}.{server_request.project.base_domain} -> {server_ip}")
+                dns_message = f"DNS configured: {server_request.subdomain}.{server_request.project.base_domain}"
+            else:
+                logger.warning(f"DNS configuration failed: {dns_result['error']}")
+                dns_message = f"DNS configuration failed: {dns_result['error']}"
+        else:
+            dns_message = "DNS configuration skipped (no base domain configured)"
+            logger.info(dns_message)
+
+        # Mark as successfully deployed
+        server_request.status = 'deployed'
+        server_request.deployment_progress = 100
+        server_request.deployed_at = datetime.utcnow()
+        server_request.deployment_notes = f"Server provisioned successfully. IP: {server_ip}. {dns_message}"
+
+        # Create success notification
+        notification = Notification()
+        notification.user_id = server_request.user_id
+        notification.title = 'Server Deployed Successfully'
+        notification.message = f'Your server "{server_request.server_name}" has been deployed at {server_ip}'
+        if server_request.project.base_domain:
+            notification.message += f' and is accessible at {server_request.subdomain}.{server_request.project.base_domain}'
+        notification.type = 'success'
+        notification.request_id = server_request.id
+        db.session.add(notification)
+
+        db.session.commit()
+        logger.info(f"Server provisioning completed successfully for request: {server_request.request_id}")
+        return True
+
+    except Exception as e:
+        logger.error(f"Error completing provisioning for request {server_request.request_id}: {str(e)}")
+        fail_server_provisioning(server_request, f"Provisioning failed: {str(e)}")
+        return False
+
+
+def fail_server_provisioning(server_request, error_message):
+    """Mark a request as failed and notify the requester"""
+    if not _claim_action(server_request):
+        return False
+
+    server_request.status = 'failed'
+    server_request.deployment_notes = error_message
+
+    # Create failure notification
+    notification = Notification()
+    notification.user_id = server_request.user_id
+    notification.title = 'Server Deployment Failed'
+    notification.message = f'Server deployment for "{server_request.server_name}" failed: {error_message}'
+    notification.type = 'error'
+    notification.request_id = server_request.id
+    db.session.add(notification)
+
+    db.session.commit()
+    return True
@@ -35,6 +35,31 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 # Set maximum file upload size to 2GB to prevent memory/DoS issues
 app.config["MAX_CONTENT_LENGTH"] = 2 * 1024 * 1024 * 1024
 
+# Maximum number of projects synced in parallel by /sync-all-projects
+app.config["SYNC_MAX_WORKERS"] = int(os.environ.get("SYNC_MAX_WORKERS", 4))
+
+# When enabled, sync routes only queue a sync for sync_worker.py instead of
+# calling the Hetzner API inside the request
+app.config["BACKGROUND_SYNC"] = os.environ.get("BACKGROUND_SYNC", "false").lower() == "true"
+
+# Hetzner catalog cache (images, server types, locations): entries are fresh for
+# HETZNER_CATALOG_TTL seconds, then served stale while a refresh runs in the
+# background for up to HETZNER_CATALOG_MAX_STALE more seconds
+app.config["HETZNER_CATALOG_TTL"] = int(os.environ.get("HETZNER_CATALOG_TTL", 24 * 3600))
+app.config["HETZNER_CATALOG_MAX_STALE"] = int(os.environ.get("HETZNER_CATALOG_MAX_STALE", 7 * 24 * 3600))
+
+# Seconds between fleet metrics collections by sync_worker.py (0 disables collection)
+app.config["METRICS_COLLECT_INTERVAL"] = int(os.environ.get("METRICS_COLLECT_INTERVAL", 300))
+
+# When enabled, backup_worker.py moves downloaded server backups into the
+# deduplicating chunk store (chunk_store.py) instead of keeping full copies
+app.config["BACKUP_DEDUP"] = os.environ.get("BACKUP_DEDUP", "true").lower() == "true"
+
+# Queued backups and upload restores are run by backup_worker.py. Set this when
+# it runs as its own process (the backup-worker service); otherwise every web
+# worker process runs the worker loop on a background thread
+app.config["EXTERNAL_BACKUP_WORKER"] = os.environ.get("EXTERNAL_BACKUP_WORKER", "false").lower() == "true"
+
 # initialize extensions
 db.init_app(app)
 migrate.init_app(app, db)
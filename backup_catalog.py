@@ -0,0 +1,208 @@
+"""
+Backup Catalog
+Keeps an index of the backup files under static/backups (system .sql dumps
+in the root, server .bak files in servers/<server name>/) with size, mtime,
+checksum and server, so the backups page is a sorted, paginated query
+instead of a directory walk. The reconciler lists a directory only when its
+mtime changed since the last scan; backup jobs add their files directly,
+including files since moved into the chunk store, which stay catalogued.
+"""
+
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import BackupCatalogDirectory, BackupCatalogEntry, BackupManifest, DatabaseBackup, HetznerServer
+
+logger = logging.getLogger(__name__)
+
+BACKUP_ROOT = 'static/backups'
+SERVER_BACKUP_DIR = 'servers'
+SYSTEM_BACKUP_SUFFIX = '.sql'
+SERVER_BACKUP_SUFFIX = '.bak'
+CATALOG_PAGE_SIZE = 50
+
+
+def _database_name(filename):
+    """Database name from a file name such as ehaf_backup_2025-08-31_15-28.bak"""
+    return filename.split('_')[0] or 'main'
+
+
+def _scan_directory(root, relative_dir, kind, suffix, server_name, summary):
+    """Make the catalog entries of one directory match its files"""
+    files = {}
+    with os.scandir(os.path.join(root, relative_dir)) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffix) and entry.is_file():
+                stat = entry.stat()
+                files[os.path.join(relative_dir, entry.name)] = (entry.name, stat.st_size,
+                                                                  datetime.fromtimestamp(stat.st_mtime))
+
+    existing = {entry.path: entry for entry in
+                BackupCatalogEntry.query.filter_by(kind=kind, server_name=server_name).all()}
+
+    for path, entry in existing.items():
+        # Deduplicated backups have no file of their own
+        if path not in files and not entry.deduplicated:
+            db.session.delete(entry)
+            summary['removed'] += 1
+
+    new_paths = [path for path in files if path not in existing]
+    # Files written by backup jobs carry their job's database name and checksum
+    backups = {}
+    if new_paths:
+        backups = {backup.backup_path: backup for backup in DatabaseBackup.query.filter(
+            DatabaseBackup.backup_path.in_([os.path.join(root, path) for path in new_paths])).all()}
+    server = HetznerServer.query.filter_by(name=server_name).first() if server_name and new_paths else None
+
+    for path, (filename, size, mtime) in files.items():
+        entry = existing.get(path)
+        if entry is not None:
+            if (entry.size, entry.mtime) != (size, mtime):
+                entry.size, entry.mtime = size, mtime
+                entry.checksum = None  # the file was rewritten
+                summary['updated'] += 1
+            continue
+
+        backup = backups.get(os.path.join(root, path))
+        db.session.add(BackupCatalogEntry(
+            path=path,
+            kind=kind,
+            server_name=server_name,
+            server_id=server.id if server else None,
+            backup_id=backup.id if backup else None,
+            filename=filename,
+            database_name=backup.database_name if backup else _database_name(filename),
+            size=size,
+            mtime=mtime,
+            checksum=backup.checksum if backup and backup.backup_size == size else None
+        ))
+        summary['added'] += 1
+
+
+def reconcile_catalog(root=BACKUP_ROOT):
+    """Bring the catalog in line with the files under root
+
+    Costs one stat per known directory when nothing changed. Directories
+    whose mtime moved (files added, removed or renamed) are listed again.
+    A file rewritten in place keeps its directory's mtime and is only
+    picked up once something else in the directory changes.
+
+    Returns counts of directories scanned and entries added, updated and removed.
+    """
+    summary = {'scanned': 0, 'added': 0, 'updated': 0, 'removed': 0}
+    directories = {directory.path: directory for directory in BackupCatalogDirectory.query.all()}
+    now = datetime.utcnow()
+
+    def changed(relative_dir):
+        """Whether relative_dir moved on since its last scan (or no longer exists); records the new mtime"""
+        try:
+            mtime_ns = os.stat(os.path.join(root, relative_dir)).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+
+        directory = directories.get(relative_dir)
+        if directory is not None and directory.mtime_ns == mtime_ns:
+            return False
+        if mtime_ns is None:
+            if directory is not None:
+                db.session.delete(directory)
+            return True
+        if directory is None:
+            directory = directories[relative_dir] = BackupCatalogDirectory(path=relative_dir)
+            db.session.add(directory)
+        directory.mtime_ns = mtime_ns
+        directory.scanned_at = now
+        summary['scanned'] += 1
+        return True
+
+    try:
+        # System backups live directly in the root
+        if changed(''):
+            if os.path.isdir(root):
+                _scan_directory(root, '', 'system', SYSTEM_BACKUP_SUFFIX, None, summary)
+            else:
+                summary['removed'] += BackupCatalogEntry.query.filter_by(kind='system').delete()
+
+        # The list of server directories only needs reading when servers/ itself changed
+        server_dirs = {path for path in directories if path.startswith(SERVER_BACKUP_DIR + os.sep)}
+        if changed(SERVER_BACKUP_DIR):
+            servers_root = os.path.join(root, SERVER_BACKUP_DIR)
+            listed = set()
+            if os.path.isdir(servers_root):
+                with os.scandir(servers_root) as entries:
+                    listed = {os.path.join(SERVER_BACKUP_DIR, entry.name) for entry in entries if entry.is_dir()}
+            server_dirs |= listed
+
+        for relative_dir in sorted(server_dirs):
+            if not changed(relative_dir):
+                continue
+            server_name = os.path.basename(relative_dir)
+            if os.path.isdir(os.path.join(root, relative_dir)):
+                _scan_directory(root, relative_dir, 'server', SERVER_BACKUP_SUFFIX, server_name, summary)
+            else:
+                summary['removed'] += BackupCatalogEntry.query.filter_by(
+                    kind='server', server_name=server_name, deduplicated=False).delete()
+
+        db.session.commit()
+    except IntegrityError:
+        # Another request reconciled the same directories at the same time
+        db.session.rollback()
+        logger.info("Backup catalog was reconciled concurrently; keeping the other result")
+    return summary
+
+
+def catalog_backup(backup, root=BACKUP_ROOT):
+    """Add or refresh the catalog entry for a completed DatabaseBackup's local file
+
+    A file moved into the chunk store is catalogued from its manifest.
+    """
+    if not backup.backup_path:
+        return None
+    path = os.path.relpath(backup.backup_path, root)
+    if path.startswith(os.pardir):
+        return None  # not under the catalogued tree
+
+    if os.path.isfile(backup.backup_path):
+        stat = os.stat(backup.backup_path)
+        size, mtime, deduplicated = stat.st_size, datetime.fromtimestamp(stat.st_mtime), False
+    else:
+        manifest = BackupManifest.query.filter_by(backup_id=backup.id).first()
+        if manifest is None:
+            return None
+        size, mtime, deduplicated = manifest.size, manifest.mtime, True
+    server_name = os.path.basename(os.path.dirname(path)) if path.startswith(SERVER_BACKUP_DIR + os.sep) else None
+
+    entry = BackupCatalogEntry.query.filter_by(path=path).first()
+    if entry is None:
+        entry = BackupCatalogEntry(path=path, kind='server' if server_name else 'system', server_name=server_name,
+                                   filename=os.path.basename(path))
+        db.session.add(entry)
+    entry.server_id = backup.server_id
+    entry.backup_id = backup.id
+    entry.database_name = backup.database_name
+    entry.size = size
+    entry.mtime = mtime
+    entry.checksum = backup.checksum
+    entry.deduplicated = deduplicated
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+    return entry
+
+
+def query_catalog(kind, server_names=None, page=1, per_page=CATALOG_PAGE_SIZE):
+    """A page of catalog entries of one kind, newest first
+
+    server_names limits server backups to those directories (None means all).
+    """
+    query = db.select(BackupCatalogEntry).filter_by(kind=kind)
+    if server_names is not None:
+        query = query.where(BackupCatalogEntry.server_name.in_(server_names))
+    query = query.order_by(BackupCatalogEntry.mtime.desc(), BackupCatalogEntry.id.desc())
+    return db.paginate(query, page=page, per_page=per_page, error_out=False)
@@ -0,0 +1,333 @@
+"""
+Background Database Backups
+Runs the DatabaseBackup jobs queued by /server/<id>/backup outside the web
+workers, in phases: dump (remote backup script), locate (find the new .bak
+file), transfer (resumable download), verify (checksum against the
+server) and store (move the file into the deduplicating chunk store, unless
+BACKUP_DEDUP is off). Each phase is recorded on the row with a progress percentage and a
+worker heartbeat, so a job orphaned by a worker restart is resumed from its
+last phase or failed cleanly. backup_worker.py runs the jobs.
+"""
+
+import hashlib
+import logging
+import os
+import shlex
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import and_, or_, select, update
+
+from app import app, db
+from models import DatabaseBackup
+from ssh_service import SSHService
+from command_log import CommandLog
+from backup_catalog import BACKUP_ROOT, SERVER_BACKUP_DIR, catalog_backup
+from chunk_store import store_backup
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = '/home/dynamic/nova-hr-docker/mssql/backup/'
+BACKUP_COMMAND = ("cd /home/dynamic/nova-hr-docker && docker compose exec backup ./usr/src/app/backup-db.sh "
+                  f"&& echo 'BACKUP_COMPLETED' && ls -la {BACKUP_DIR} | tail -1")
+
+BACKUP_DUMP_TIMEOUT = 1800  # seconds the remote backup script may run
+BACKUP_HEARTBEAT_INTERVAL = 15  # seconds between heartbeats of a running job
+BACKUP_STALE_AFTER = 120  # seconds without a heartbeat before a running job counts as orphaned
+BACKUP_MAX_ATTEMPTS = 3  # runs of one job, including resumes after its worker died
+PROGRESS_WRITE_INTERVAL = 2.0  # seconds between transfer progress updates
+
+# progress bands: dump 5-40, locate 40-45, transfer 45-90, verify 90-93, store 93-100
+PHASE_PROGRESS = {'queued': 0, 'dump': 5, 'locate': 40, 'transfer': 45, 'verify': 90, 'store': 93, 'done': 100}
+PHASES = ('dump', 'locate', 'transfer', 'verify', 'store')
+
+
+class BackupFailed(Exception):
+    """A backup phase failed; the message is shown on the backup"""
+
+
+class BackupInterrupted(Exception):
+    """The job's worker is stopping, or another worker has taken the job over"""
+
+
+def worker_identity():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def queue_backup(server, database_name, backup_type, user_id):
+    """Create a queued backup job for the backup worker"""
+    backup = DatabaseBackup()
+    backup.server_id = server.id
+    backup.database_name = database_name
+    backup.backup_type = backup_type
+    backup.started_at = datetime.utcnow()
+    backup.initiated_by = user_id
+    backup.status = 'queued'
+    backup.phase = 'queued'
+    backup.progress = 0
+
+    db.session.add(backup)
+    db.session.commit()
+    return backup
+
+
+def claim_backup_job(worker_id):
+    """Take the oldest queued job for worker_id; returns its id or None
+
+    The claim is a conditional UPDATE, so several workers can poll the same
+    queue without running a job twice.
+    """
+    candidates = db.session.execute(
+        select(DatabaseBackup.id)
+        .where(DatabaseBackup.status == 'queued')
+        .order_by(DatabaseBackup.started_at, DatabaseBackup.id)
+        .limit(10)
+    ).scalars().all()
+
+    for backup_id in candidates:
+        claimed = db.session.execute(
+            update(DatabaseBackup)
+            .where(DatabaseBackup.id == backup_id, DatabaseBackup.status == 'queued')
+            .values(status='running', worker_id=worker_id, heartbeat_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return backup_id
+    return None
+
+
+def recover_backup_jobs(stale_after=BACKUP_STALE_AFTER):
+    """Requeue or fail running jobs whose worker stopped sending heartbeats
+
+    A job is resumed from the phase it was in until it has been attempted
+    BACKUP_MAX_ATTEMPTS times. Rows left running by the old in-request
+    backups have no phase and are failed.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+    orphaned = DatabaseBackup.query.filter(
+        DatabaseBackup.status == 'running',
+        or_(DatabaseBackup.heartbeat_at < cutoff,
+            and_(DatabaseBackup.heartbeat_at.is_(None), DatabaseBackup.started_at < cutoff))
+    ).all()
+
+    summary = {'requeued': 0, 'failed': 0}
+    for backup in orphaned:
+        attempts = (backup.retry_count or 0) + 1
+        if backup.phase in PHASES and attempts < BACKUP_MAX_ATTEMPTS:
+            logger.warning(f"Backup {backup.id}: worker {backup.worker_id} stopped during {backup.phase}; "
+                           f"requeued (attempt {attempts + 1}/{BACKUP_MAX_ATTEMPTS})")
+            backup.status = 'queued'
+            backup.retry_count = attempts
+            backup.worker_id = None
+            summary['requeued'] += 1
+        else:
+            logger.warning(f"Backup {backup.id}: worker {backup.worker_id} stopped during {backup.phase}; failed")
+            backup.status = 'failed'
+            backup.completed_at = datetime.utcnow()
+            backup.error_message = f"Backup worker stopped during the {backup.phase or 'backup'} phase"
+            summary['failed'] += 1
+
+    if orphaned:
+        db.session.commit()
+    return summary
+
+
+class BackupJob:
+    """One claimed backup job, run phase by phase from wherever it stopped last"""
+
+    def __init__(self, backup_id, worker_id, stop_event=None):
+        self.backup_id = backup_id
+        self.worker_id = worker_id
+        self.stop_event = stop_event or threading.Event()
+        self.lost = threading.Event()  # another worker requeued or took over the job
+        self.finished = threading.Event()
+        self.last_progress_write = 0
+        self.ssh_service = SSHService()
+
+    def run(self):
+        """Run the job to completion, failure or interruption; call inside an app context"""
+        heartbeat = threading.Thread(target=self._heartbeat, name=f'backup-heartbeat-{self.backup_id}', daemon=True)
+        heartbeat.start()
+        backup = db.session.get(DatabaseBackup, self.backup_id)
+
+        try:
+            self._run_phases(backup)
+            if self._update(status='completed', completed_at=datetime.utcnow(), phase='done',
+                            progress=PHASE_PROGRESS['done']):
+                catalog_backup(backup)
+                logger.info(f"Backup {backup.id} of {backup.server.name} completed ({backup.backup_size:,} bytes)")
+        except BackupInterrupted:
+            db.session.rollback()
+            if not self.lost.is_set():
+                # Stopped on purpose; the next worker resumes from this phase
+                self._update(status='queued', worker_id=None)
+                logger.info(f"Backup {self.backup_id} interrupted during {backup.phase}; requeued")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Backup {self.backup_id} failed during {backup.phase}: {str(e)}")
+            self._fail(str(e))
+        finally:
+            self.finished.set()
+            heartbeat.join()
+
+    def _run_phases(self, backup):
+        server = backup.server
+        if not server.project or not server.project.ssh_private_key:
+            raise BackupFailed('No SSH private key configured for this project. '
+                               'Please configure SSH access in project settings.')
+
+        # Each phase runs if the job has not got past it yet
+        phase = backup.phase if backup.phase in PHASES else 'dump'
+
+        if phase == 'dump':
+            self._set_phase(backup, 'dump')
+            output_log = CommandLog(DatabaseBackup, backup.id, 'backup_log', 'error_log')
+            success, exit_code = self.ssh_service.execute_command_streaming(
+                server=server,
+                command=BACKUP_COMMAND,
+                output_log=output_log,
+                timeout=BACKUP_DUMP_TIMEOUT
+            )
+            self._check_stopped()
+            if not success:
+                raise BackupFailed(f"Backup script failed on {server.name} (exit code {exit_code})")
+            phase = 'locate'
+
+        if phase == 'locate':
+            self._set_phase(backup, 'locate')
+            latest_backup = self.ssh_service.get_latest_backup_file(server, BACKUP_DIR)
+            if not latest_backup:
+                raise BackupFailed('No backup file found after backup command execution')
+            # Remember where the file lives on the server so it can be relayed to other servers
+            backup.remote_path = latest_backup
+            db.session.commit()
+            phase = 'transfer'
+
+        if phase == 'transfer':
+            self._set_phase(backup, 'transfer')
+            local_dir = Path(BACKUP_ROOT) / SERVER_BACKUP_DIR / server.name
+            local_dir.mkdir(parents=True, exist_ok=True)
+            local_path = local_dir / Path(backup.remote_path).name
+
+            # .bak files compress well; compress on the server when it has zstd/pigz/gzip.
+            # The .part file of an interrupted attempt is picked up again.
+            result = self.ssh_service.download_file_resumable(
+                server=server,
+                remote_path=backup.remote_path,
+                local_path=str(local_path),
+                compression='auto',
+                progress=self._transfer_progress
+            )
+            if not result['success']:
+                raise BackupFailed(f"Backup created on server but failed to download to management system: "
+                                   f"{result['error']}")
+            backup.backup_path = str(local_path)
+            backup.bytes_transferred = result['bytes']
+            backup.checksum = result['sha256'] if result['verified'] else None
+            db.session.commit()
+            phase = 'verify'
+
+        if phase == 'verify':
+            self._set_phase(backup, 'verify')
+            self._verify(backup, server)
+
+        # A store that already started is finished even if BACKUP_DEDUP was turned off since
+        if app.config['BACKUP_DEDUP'] or backup.phase == 'store':
+            self._set_phase(backup, 'store')
+            size = backup.backup_size
+            store_backup(backup, progress=lambda stored: self._store_progress(stored, size))
+
+    def _verify(self, backup, server):
+        """Check the local file against the server's copy, unless the transfer already did"""
+        local_path = Path(backup.backup_path or '')
+        if not backup.backup_path or not local_path.exists():
+            raise BackupFailed('Downloaded backup file is missing on the management system')
+
+        if backup.checksum is None:
+            success, output, error_output = self.ssh_service.execute_command(
+                server, f"sha256sum -- {shlex.quote(backup.remote_path)}", timeout=600)
+            if not success or not output.strip():
+                raise BackupFailed(f"Could not checksum {backup.remote_path} on {server.name}: {error_output.strip()}")
+            remote_checksum = output.split()[0]
+
+            hasher = hashlib.sha256()
+            with open(local_path, 'rb') as backup_file:
+                for block in iter(lambda: backup_file.read(1024 * 1024), b''):
+                    self._check_stopped()
+                    hasher.update(block)
+            if hasher.hexdigest() != remote_checksum:
+                raise BackupFailed(f"Checksum mismatch (server {remote_checksum}, local {hasher.hexdigest()})")
+            backup.checksum = remote_checksum
+
+        backup.backup_size = local_path.stat().st_size
+        db.session.commit()
+
+    def _set_phase(self, backup, phase):
+        self._check_stopped()
+        backup.phase = phase
+        backup.progress = PHASE_PROGRESS[phase]
+        db.session.commit()
+
+    def _transfer_progress(self, state):
+        """download_file_resumable callback: record progress every PROGRESS_WRITE_INTERVAL seconds"""
+        self._check_stopped()
+        now = time.monotonic()
+        if now - self.last_progress_write < PROGRESS_WRITE_INTERVAL or not state.remote_size:
+            return
+        self.last_progress_write = now
+
+        band = PHASE_PROGRESS['verify'] - PHASE_PROGRESS['transfer']
+        self._update(progress=PHASE_PROGRESS['transfer'] + band * state.offset // state.remote_size,
+                     bytes_transferred=state.offset)
+
+    def _store_progress(self, stored, size):
+        """store_backup callback: record progress every PROGRESS_WRITE_INTERVAL seconds"""
+        self._check_stopped()
+        now = time.monotonic()
+        if now - self.last_progress_write < PROGRESS_WRITE_INTERVAL or not size:
+            return
+        self.last_progress_write = now
+
+        band = PHASE_PROGRESS['done'] - PHASE_PROGRESS['store']
+        self._update(progress=PHASE_PROGRESS['store'] + band * min(stored, size) // size)
+
+    def _check_stopped(self):
+        if self.stop_event.is_set() or self.lost.is_set():
+            raise BackupInterrupted()
+
+    def _update(self, **values):
+        """Update the row only while this worker still owns it; returns whether it did"""
+        updated = db.session.execute(
+            update(DatabaseBackup)
+            .where(DatabaseBackup.id == self.backup_id, DatabaseBackup.worker_id == self.worker_id,
+                   DatabaseBackup.status == 'running')
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        return bool(updated)
+
+    def _fail(self, message):
+        if not self._update(status='failed', completed_at=datetime.utcnow(), error_message=message):
+            return
+        # The logs page shows error_log
+        output_log = CommandLog(DatabaseBackup, self.backup_id, 'backup_log', 'error_log')
+        output_log.write('stderr', f"{message}\n")
+        output_log.flush()
+
+    def _heartbeat(self):
+        """Keep heartbeat_at fresh from a thread of its own; notices when the job was taken away"""
+        with app.app_context():
+            while not self.finished.wait(BACKUP_HEARTBEAT_INTERVAL):
+                try:
+                    if not self._update(heartbeat_at=datetime.utcnow()):
+                        logger.warning(f"Backup {self.backup_id} is no longer owned by {self.worker_id}; stopping")
+                        self.lost.set()
+                        return
+                except Exception as e:
+                    logger.warning(f"Heartbeat for backup {self.backup_id} failed: {str(e)}")
+                    db.session.rollback()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Background Database Backup Worker
+=================================
+
+Runs the database backups queued by /server/<id>/backup (see backup_jobs.py)
+on a pool of threads, so a long dump or a multi-gigabyte download never
+holds a web worker. Each poll first recovers jobs whose worker stopped
+sending heartbeats: they are requeued and resumed from their last phase, or
+failed once they have used up BACKUP_MAX_ATTEMPTS.
+
+It also runs the restores of finalized chunked uploads (chunked_upload.py)
+on the same threads. A restore whose worker stopped is released back to
+its uploader instead of being retried.
+
+Every CHUNK_GC_INTERVAL seconds it also deletes the chunks of the backup
+chunk store that no backup uses any more.
+
+Deployments without a separate worker (EXTERNAL_BACKUP_WORKER off, as with
+the plain Dockerfile or Replit) run the same loop on a daemon thread of each
+web worker process instead; see start_in_background.
+
+On SIGTERM/SIGINT the worker stops claiming jobs. Jobs that are
+downloading are requeued at once and resume from their .part file on the
+next worker; a running remote dump or restore is waited for, and if the
+worker is killed first the job is recovered after BACKUP_STALE_AFTER
+seconds.
+
+Usage:
+    python backup_worker.py                 # run until stopped
+    python backup_worker.py --once          # run the queued jobs and exit
+    python backup_worker.py --workers 4     # run up to 4 backups at a time
+
+Requirements:
+    - Same environment as the web app (DATABASE_URL, SESSION_SECRET)
+    - Access to the static/backups directory the web app serves backups from,
+      and to the uploads directory the web app receives chunked uploads in
+    - Several workers may share a database; jobs are claimed atomically
+"""
+
+import argparse
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, db
+from backup_jobs import BackupJob, claim_backup_job, recover_backup_jobs, worker_identity
+from chunk_store import collect_garbage
+from chunked_upload import UploadRestoreJob, claim_restore_job, recover_restore_jobs
+
+logger = logging.getLogger('backup_worker')
+
+CHUNK_GC_INTERVAL = 3600  # seconds between chunk store garbage collections
+
+stop_event = threading.Event()
+
+
+def run_job(backup_id, worker_id):
+    with app.app_context():
+        try:
+            BackupJob(backup_id, worker_id, stop_event).run()
+        finally:
+            db.session.remove()
+
+
+def run_restore(session_id, worker_id):
+    with app.app_context():
+        try:
+            UploadRestoreJob(session_id, worker_id).run()
+        finally:
+            db.session.remove()
+
+
+def recover_jobs():
+    """Requeue or fail jobs orphaned by a worker that died"""
+    try:
+        summary = recover_backup_jobs()
+        if summary['requeued'] or summary['failed']:
+            logger.info(f"Recovered orphaned backups: {summary['requeued']} requeued, {summary['failed']} failed")
+        released = recover_restore_jobs()
+        if released:
+            logger.info(f"Released {released} orphaned upload restore(s)")
+    except Exception as e:
+        logger.error(f"Backup recovery failed: {str(e)}")
+        db.session.rollback()
+
+
+def collect_chunks():
+    """Delete chunks no backup refers to any more"""
+    try:
+        summary = collect_garbage()
+        if summary['chunks']:
+            logger.info(f"Chunk store: removed {summary['chunks']} unused chunks ({summary['bytes']:,} bytes)")
+    except Exception as e:
+        logger.error(f"Chunk store garbage collection failed: {str(e)}")
+        db.session.rollback()
+
+
+def claim_jobs(worker_id, slots, claim=claim_backup_job):
+    """Claim up to slots queued jobs with claim; returns their ids"""
+    claimed = []
+    while len(claimed) < slots and not stop_event.is_set():
+        job_id = claim(worker_id)
+        if job_id is None:
+            break
+        claimed.append(job_id)
+    return claimed
+
+
+def run_once(worker_id, workers):
+    """Run every queued job and wait for them to finish"""
+    with app.app_context():
+        recover_jobs()
+        backup_ids = claim_jobs(worker_id, float('inf'))
+        session_ids = claim_jobs(worker_id, float('inf'), claim_restore_job)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backup') as executor:
+        for backup_id in backup_ids:
+            executor.submit(run_job, backup_id, worker_id)
+        for session_id in session_ids:
+            executor.submit(run_restore, session_id, worker_id)
+
+    with app.app_context():
+        collect_chunks()
+    return backup_ids
+
+
+def run_forever(worker_id, workers, poll_seconds):
+    """Claim and run jobs until SIGTERM/SIGINT"""
+    logger.info(f"Backup worker {worker_id} started ({workers} threads, poll every {poll_seconds}s)")
+
+    running = set()
+    last_gc = None
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backup') as executor:
+        while not stop_event.is_set():
+            running = {future for future in running if not future.done()}
+            with app.app_context():
+                try:
+                    recover_jobs()
+                    for backup_id in claim_jobs(worker_id, workers - len(running)):
+                        logger.info(f"Starting backup {backup_id}")
+                        running.add(executor.submit(run_job, backup_id, worker_id))
+                    for session_id in claim_jobs(worker_id, workers - len(running), claim_restore_job):
+                        logger.info(f"Starting upload restore {session_id}")
+                        running.add(executor.submit(run_restore, session_id, worker_id))
+                except Exception as e:
+                    logger.error(f"Backup worker iteration failed: {str(e)}")
+                    db.session.rollback()
+
+                if last_gc is None or time.monotonic() - last_gc >= CHUNK_GC_INTERVAL:
+                    collect_chunks()
+                    last_gc = time.monotonic()
+            stop_event.wait(poll_seconds)
+
+        if running:
+            logger.info(f"Waiting for {len(running)} backup job(s) to stop")
+
+    logger.info("Backup worker stopped")
+
+
+_background_thread = None
+
+
+def start_in_background(workers=1, poll_seconds=5):
+    """Run the worker loop on a daemon thread of the current process, once
+
+    Jobs are claimed atomically, so every web worker process may run one.
+    Jobs of a process that goes away are recovered like those of a stopped worker.
+    """
+    global _background_thread
+    
+    if _background_thread is None:
+        _background_thread = threading.Thread(target=run_forever, args=(worker_identity(), workers, poll_seconds),
+                                              name='backup-worker', daemon=True)
+        _background_thread.start()
+    return _background_thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Background database backup worker')
+    parser.add_argument('--once', action='store_true',
+                       help='Run the queued backups and upload restores and exit')
+    parser.add_argument('--workers', type=int, default=2,
+                       help='Backups run at the same time (default: 2)')
+    parser.add_argument('--poll', type=int, default=5,
+                       help='Seconds between checks for queued backups (default: 5)')
+
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+
+    worker_id = worker_identity()
+    if args.once:
+        run_once(worker_id, args.workers)
+        return
+
+    run_forever(worker_id, args.workers, args.poll)
+
+
+if __name__ == '__main__':
+    main()
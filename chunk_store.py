@@ -0,0 +1,264 @@
+"""
+Backup Chunk Store
+Deduplicating storage for server .bak files. A file is split into
+content-defined chunks, so the backups of one database share every chunk
+whose data did not change, even when data moved within the file. Each
+unique chunk is kept once, zlib-compressed when it compresses, under its
+SHA-256; a
+BackupManifest lists the chunks of one DatabaseBackup in file order and the
+file is rebuilt from them as a stream for downloads and restores.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from sqlalchemy import delete, or_, select
+
+from app import db
+from models import BackupCatalogEntry, BackupManifest, DatabaseBackup
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROOT = 'static/backups/chunks'
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+CHUNK_READ_SIZE = 4 * 1024 * 1024  # bytes read from a file being stored at a time
+CHUNK_COMPRESS_LEVEL = 1  # zlib level; backups are stored on the worker's critical path
+CHUNK_SAMPLE_SIZE = 4096  # bytes of a chunk test-compressed to decide whether compressing it pays
+CHUNK_GC_GRACE = 24 * 3600  # seconds an unreferenced chunk is kept, for manifests still being written
+
+# Manifest entry: chunk SHA-256 and chunk length
+MANIFEST_ENTRY = struct.Struct('>32sI')
+
+# First byte of a chunk file
+CHUNK_RAW = b'\x00'
+CHUNK_ZLIB = b'\x01'
+
+# Chunk boundaries: every byte maps to one bit through a fixed table, and a chunk
+# ends where the bits of the last 16 bytes spell BOUNDARY_PATTERN (on average every
+# 64KB of varied data). Changing either moves every boundary and stops new backups
+# from sharing chunks with the stored ones.
+_BOUNDARY_BITS = bytes(hashlib.sha256(bytes([value])).digest()[0] & 1 for value in range(256))
+BOUNDARY_PATTERN = bytes(int(bit) for bit in '1011000110101110')
+
+
+def _boundary(bits, start, end):
+    """End of the chunk starting at start; bits covers the data up to end"""
+    limit = min(start + CHUNK_MAX_SIZE, end)
+    found = bits.find(BOUNDARY_PATTERN, start + CHUNK_MIN_SIZE - len(BOUNDARY_PATTERN), limit)
+    return found + len(BOUNDARY_PATTERN) if found != -1 else limit
+
+
+def split_chunks(stream):
+    """Yield the content-defined chunks of a binary stream"""
+    pending = b''
+    eof = False
+    while not eof:
+        data = stream.read(CHUNK_READ_SIZE)
+        eof = not data
+        pending += data
+        bits = pending.translate(_BOUNDARY_BITS)
+
+        start = 0
+        # Without a full CHUNK_MAX_SIZE window the boundary may still lie in data not read yet
+        while len(pending) - start >= CHUNK_MAX_SIZE or (eof and start < len(pending)):
+            end = _boundary(bits, start, len(pending))
+            yield pending[start:end]
+            start = end
+        pending = pending[start:]
+
+
+def _chunk_path(digest, root):
+    name = digest.hex()
+    return os.path.join(root, name[:2], name)
+
+
+def _encode_chunk(chunk):
+    """Format byte and contents of a chunk file"""
+    # Compressed backups do not compress again, and trying costs more than the rest of the store
+    sample = chunk[:CHUNK_SAMPLE_SIZE]
+    if len(zlib.compress(sample, CHUNK_COMPRESS_LEVEL)) < len(sample) * 0.9:
+        return CHUNK_ZLIB, zlib.compress(chunk, CHUNK_COMPRESS_LEVEL)
+    return CHUNK_RAW, chunk
+
+
+def _read_chunk(path):
+    with open(path, 'rb') as chunk_file:
+        data = chunk_file.read()
+    return zlib.decompress(data[1:]) if data[:1] == CHUNK_ZLIB else data[1:]
+
+
+def _write_chunk(digest, chunk, root):
+    """Store one chunk unless it is already there; returns the bytes written"""
+    path = _chunk_path(digest, root)
+    if os.path.exists(path):
+        # Tell collect_garbage the chunk is in use again before its manifest exists
+        os.utime(path)
+        return 0
+
+    chunk_format, data = _encode_chunk(chunk)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as chunk_file:
+        chunk_file.write(chunk_format)
+        chunk_file.write(data)
+    os.replace(temp_path, path)
+    return len(data) + 1
+
+
+def store_file(path, root=CHUNK_ROOT, progress=None):
+    """Split a file into the store
+
+    progress, if given, is called with the bytes stored so far after every
+    read block; an exception it raises stops the store.
+
+    Returns the packed manifest entries, the file's SHA-256 and counts of
+    bytes, chunks, new chunks and new bytes on disk.
+    """
+    entries = []
+    file_hash = hashlib.sha256()
+    stats = {'size': 0, 'chunks': 0, 'new_chunks': 0, 'stored_bytes': 0}
+    reported = 0
+
+    with open(path, 'rb') as source:
+        for chunk in split_chunks(source):
+            file_hash.update(chunk)
+            digest = hashlib.sha256(chunk).digest()
+            entries.append(MANIFEST_ENTRY.pack(digest, len(chunk)))
+
+            written = _write_chunk(digest, chunk, root)
+            stats['size'] += len(chunk)
+            stats['chunks'] += 1
+            if written:
+                stats['new_chunks'] += 1
+                stats['stored_bytes'] += written
+
+            if progress and stats['size'] - reported >= CHUNK_READ_SIZE:
+                reported = stats['size']
+                progress(reported)
+
+    return b''.join(entries), file_hash.hexdigest(), stats
+
+
+def store_backup(backup, root=CHUNK_ROOT, progress=None):
+    """Move a DatabaseBackup's downloaded file into the store
+
+    The manifest is committed before the full copy is removed, so a store
+    interrupted at any point can simply be run again. Returns the manifest.
+    """
+    manifest = BackupManifest.query.filter_by(backup_id=backup.id).first()
+    if manifest is None:
+        stat = os.stat(backup.backup_path)
+        chunks, checksum, stats = store_file(backup.backup_path, root, progress)
+        if backup.checksum and checksum != backup.checksum:
+            raise IOError(f"{backup.backup_path} changed while it was stored (SHA-256 {checksum}, "
+                          f"expected {backup.checksum})")
+
+        manifest = BackupManifest(
+            backup_id=backup.id,
+            size=stats['size'],
+            checksum=checksum,
+            mtime=datetime.fromtimestamp(stat.st_mtime),
+            chunk_count=stats['chunks'],
+            stored_bytes=stats['stored_bytes'],
+            chunks=chunks
+        )
+        db.session.add(manifest)
+        db.session.commit()
+        logger.info(f"Stored backup {backup.id}: {stats['size']:,} bytes in {stats['chunks']} chunks, "
+                    f"{stats['new_chunks']} new ({stats['stored_bytes']:,} bytes on disk)")
+
+    if backup.backup_path and os.path.exists(backup.backup_path):
+        os.remove(backup.backup_path)
+    return manifest
+
+
+def iter_manifest(manifest, root=CHUNK_ROOT):
+    """Yield the contents of a stored file chunk by chunk"""
+    for digest, length in MANIFEST_ENTRY.iter_unpack(manifest.chunks):
+        chunk = _read_chunk(_chunk_path(digest, root))
+        if len(chunk) != length or hashlib.sha256(chunk).digest() != digest:
+            raise IOError(f"Chunk {digest.hex()} of backup {manifest.backup_id} is corrupt")
+        yield chunk
+
+
+class ManifestReader(io.RawIOBase):
+    """Read-only file object over a stored file, for APIs that take one (sftp.putfo)"""
+
+    def __init__(self, manifest, root=CHUNK_ROOT):
+        super().__init__()
+        self.chunks = iter_manifest(manifest, root)
+        self.current = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.current:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.current = memoryview(chunk)
+        size = min(len(buffer), len(self.current))
+        buffer[:size] = self.current[:size]
+        self.current = self.current[size:]
+        return size
+
+
+def collect_garbage(root=CHUNK_ROOT, grace=CHUNK_GC_GRACE):
+    """Delete the chunks no manifest refers to
+
+    Chunks used within the last grace seconds are kept, since a backup being
+    stored may rely on them before its manifest is committed.
+
+    Returns counts of orphaned manifests, chunks removed and bytes freed.
+    """
+    # Manifests of backups deleted without going through delete_backup (e.g. with their user)
+    backup_ids = select(DatabaseBackup.id)
+    orphaned = db.session.execute(
+        delete(BackupManifest)
+        .where(BackupManifest.backup_id.not_in(backup_ids))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.execute(
+        delete(BackupCatalogEntry)
+        .where(BackupCatalogEntry.deduplicated.is_(True),
+               or_(BackupCatalogEntry.backup_id.is_(None), BackupCatalogEntry.backup_id.not_in(backup_ids)))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    referenced = set()
+    for chunks in db.session.execute(select(BackupManifest.chunks)).scalars():
+        referenced.update(digest for digest, _ in MANIFEST_ENTRY.iter_unpack(chunks))
+
+    summary = {'manifests': orphaned, 'chunks': 0, 'bytes': 0}
+    if not os.path.isdir(root):
+        return summary
+
+    cutoff = time.time() - grace
+    with os.scandir(root) as prefixes:
+        directories = [prefix.path for prefix in prefixes if prefix.is_dir()]
+    for directory in directories:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # .tmp files are left behind by workers that died mid-write
+                if not entry.name.endswith('.tmp') and bytes.fromhex(entry.name) in referenced:
+                    continue
+                try:
+                    stat = entry.stat()
+                    if stat.st_mtime >= cutoff:
+                        continue
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue  # removed by another worker's collection
+                summary['chunks'] += 1
+                summary['bytes'] += stat.st_size
+    return summary
@@ -0,0 +1,408 @@
+"""
+Chunked Backup Uploads
+Resumable upload protocol for large .bak files from the browser. An upload
+is created with the file's size; the browser then PUTs fixed-size chunks at
+their offsets, several at a time, each with its SHA-256, asks which chunks
+arrived after a disconnect, and finalizes once all are in. Each request
+stays far below the proxy's body limit and timeout. Each chunk is received
+into a file of its own and copied to its offset in a preallocated staging
+file once it is complete and verified, so the file is assembled on disk as
+it arrives, never held in memory, and a bad re-send cannot spoil a chunk
+that already arrived.
+
+Finalizing only queues the restore: backup_worker.py claims it, re-checks
+every chunk, streams the file to the target server and runs the restore
+script, while the page polls the upload's status. A restore that fails, or
+whose worker dies, puts the upload back to uploading with a message, so it
+can be finalized again without uploading anything.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import UploadChunk, UploadSession
+from upload_restore import record_uploaded_backup, restore_uploaded_backup, uploaded_backup_path
+from upload_stream import BACKUP_UPLOAD_MAX_SIZE, UPLOAD_READ_SIZE, UploadRejected
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_STAGING_DIR = 'uploads/chunked'
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # bytes per chunk request
+UPLOAD_SESSION_TTL = 24 * 3600  # seconds an upload is kept after its last chunk or restore
+RESTORE_HEARTBEAT_INTERVAL = 15  # seconds between heartbeats of a running restore
+RESTORE_STALE_AFTER = 120  # seconds without a heartbeat before a running restore counts as orphaned
+
+
+def staging_path(upload):
+    return os.path.join(UPLOAD_STAGING_DIR, f"{upload.upload_id}.part")
+
+
+def chunk_count(upload):
+    return -(-upload.size // upload.chunk_size)
+
+
+def create_upload(user_id, target_server_id, filename, size, keep_copy=True, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Start an upload session and preallocate its staging file"""
+    if size <= 0:
+        raise UploadRejected('The file is empty')
+    if size > BACKUP_UPLOAD_MAX_SIZE:
+        raise UploadRejected(f'File size exceeds the {BACKUP_UPLOAD_MAX_SIZE // (1024 * 1024 * 1024)}GB limit')
+
+    expire_uploads()
+
+    upload = UploadSession(user_id=user_id, target_server_id=target_server_id, filename=filename, size=size,
+                           chunk_size=chunk_size, keep_copy=keep_copy, status='uploading')
+    db.session.add(upload)
+    db.session.commit()
+
+    os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+    with open(staging_path(upload), 'wb') as staging_file:
+        staging_file.truncate(size)  # sparse; chunks fill it in any order
+    return upload
+
+
+def write_chunk(upload, offset, stream, checksum=None):
+    """Receive the chunk at offset from a request body stream into the staging file
+
+    The chunk must start on a chunk boundary and be complete (chunk_size
+    bytes, less for the last one). With checksum, the data must hash to it.
+    It is only copied into the staging file once it passed these checks, in
+    the same transaction that records it and checks the upload still
+    accepts chunks. Sending a chunk again replaces it. Returns the chunk's
+    SHA-256.
+    """
+    if upload.status != 'uploading':
+        raise UploadRejected('This upload is no longer accepting chunks')
+    if offset < 0 or offset >= upload.size or offset % upload.chunk_size:
+        raise UploadRejected(f'Chunk offset must be a multiple of {upload.chunk_size} below {upload.size}')
+    expected = min(upload.chunk_size, upload.size - offset)
+
+    hasher = hashlib.sha256()
+    written = 0
+    chunk_path = f"{staging_path(upload)}.{offset}.{uuid.uuid4().hex}"
+    try:
+        with open(chunk_path, 'wb') as chunk_file:
+            for block in iter(lambda: stream.read(UPLOAD_READ_SIZE), b''):
+                if written + len(block) > expected:
+                    raise UploadRejected(f'Chunk at {offset} is larger than {expected} bytes')
+                chunk_file.write(block)
+                hasher.update(block)
+                written += len(block)
+
+        if written != expected:
+            raise UploadRejected(f'Chunk at {offset} has {written} of {expected} bytes')
+        digest = hasher.hexdigest()
+        if checksum and checksum.lower() != digest:
+            raise UploadRejected(f'Checksum mismatch for chunk at {offset} (sent {checksum}, received {digest})')
+
+        # Locks the session row until the commit, so a finalize waits for this chunk to be in place
+        now = datetime.utcnow()
+        accepting = db.session.execute(
+            update(UploadSession)
+            .where(UploadSession.id == upload.id, UploadSession.status == 'uploading')
+            .values(updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not accepting:
+            db.session.rollback()
+            raise UploadRejected('This upload is no longer accepting chunks')
+
+        try:
+            _copy_chunk(chunk_path, staging_path(upload), offset)
+        except FileNotFoundError:
+            # Discarded by a cancel or expiry that committed first
+            db.session.rollback()
+            raise UploadRejected('This upload is no longer accepting chunks')
+
+        chunk = UploadChunk.query.filter_by(session_id=upload.id, byte_offset=offset).first()
+        if chunk is None:
+            chunk = UploadChunk(session_id=upload.id, byte_offset=offset)
+            db.session.add(chunk)
+        chunk.size = written
+        chunk.checksum = digest
+        chunk.received_at = now
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # The same chunk arrived twice at once; both copies passed the checks
+            db.session.rollback()
+        return digest
+    finally:
+        if os.path.exists(chunk_path):
+            os.remove(chunk_path)
+
+
+def _copy_chunk(chunk_path, path, offset):
+    # Concurrent chunks write to their own ranges of the same file
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        with open(chunk_path, 'rb') as chunk_file:
+            for block in iter(lambda: chunk_file.read(UPLOAD_READ_SIZE), b''):
+                os.pwrite(fd, block, offset)
+                offset += len(block)
+    finally:
+        os.close(fd)
+
+
+def verify_upload(upload):
+    """Re-hash every chunk of the staging file against the checksum recorded for it
+
+    Chunks that do not match are forgotten, so the browser sends them again.
+    Returns their offsets.
+    """
+    mismatched = []
+    with open(staging_path(upload), 'rb') as staged_file:
+        for chunk in UploadChunk.query.filter_by(session_id=upload.id).order_by(UploadChunk.byte_offset):
+            staged_file.seek(chunk.byte_offset)
+            hasher = hashlib.sha256()
+            remaining = chunk.size
+            while remaining:
+                block = staged_file.read(min(UPLOAD_READ_SIZE, remaining))
+                if not block:
+                    break
+                hasher.update(block)
+                remaining -= len(block)
+            if remaining or hasher.hexdigest() != chunk.checksum:
+                mismatched.append(chunk.byte_offset)
+
+    if mismatched:
+        logger.warning(f"Upload {upload.upload_id}: {len(mismatched)} chunk(s) do not match their checksums")
+        UploadChunk.query.filter(UploadChunk.session_id == upload.id,
+                                 UploadChunk.byte_offset.in_(mismatched)).delete(synchronize_session=False)
+        db.session.commit()
+    return mismatched
+
+
+def upload_status(upload):
+    """Progress of an upload, including the offsets of the chunks already received
+
+    message is the outcome of the last restore: the error of one that failed
+    (status is back to uploading), or the result of a completed one.
+    """
+    received = [offset for (offset,) in db.session.query(UploadChunk.byte_offset)
+                .filter_by(session_id=upload.id).order_by(UploadChunk.byte_offset)]
+    received_bytes = db.session.query(db.func.coalesce(db.func.sum(UploadChunk.size), 0)).filter_by(
+        session_id=upload.id).scalar()
+    return {
+        'upload_id': upload.upload_id,
+        'filename': upload.filename,
+        'size': upload.size,
+        'chunk_size': upload.chunk_size,
+        'chunk_count': chunk_count(upload),
+        'received': received,
+        'received_bytes': received_bytes,
+        'complete': len(received) == chunk_count(upload),
+        'status': upload.status,
+        'message': upload.message,
+        'backup_id': upload.backup_id
+    }
+
+
+def queue_restore(upload):
+    """Queue a fully received upload for restore by the backup worker; raises UploadRejected otherwise
+
+    The queueing is a conditional UPDATE, so a finalize sent twice restores once.
+    """
+    missing = chunk_count(upload) - UploadChunk.query.filter_by(session_id=upload.id).count()
+    if missing:
+        raise UploadRejected(f'{missing} chunk(s) of {upload.filename} have not been uploaded yet')
+
+    queued = db.session.execute(
+        update(UploadSession)
+        .where(UploadSession.id == upload.id, UploadSession.status == 'uploading')
+        .values(status='queued', message=None, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    if not queued:
+        raise UploadRejected('This upload is already being restored')
+    db.session.refresh(upload)
+
+
+def release_upload(upload, message):
+    """Let an upload be finalized again, e.g. after its restore failed"""
+    upload.status = 'uploading'
+    upload.message = message
+    upload.worker_id = None
+    upload.updated_at = datetime.utcnow()
+    db.session.commit()
+
+
+def discard_upload(upload, statuses=('uploading',)):
+    """Delete an upload session and its staging file; raises UploadRejected unless its status is one of statuses
+
+    The status check is a conditional UPDATE that locks the session row, so a
+    discard cannot race a finalize, and waits for a chunk being written to
+    commit. The staging file is only removed once the session is gone.
+    """
+    discarding = db.session.execute(
+        update(UploadSession)
+        .where(UploadSession.id == upload.id, UploadSession.status.in_(statuses))
+        .values(status='discarding')
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not discarding:
+        db.session.rollback()
+        raise UploadRejected('This upload is being restored')
+
+    path = staging_path(upload)
+    UploadChunk.query.filter_by(session_id=upload.id).delete()
+    db.session.delete(upload)
+    db.session.commit()
+
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def expire_uploads(ttl=UPLOAD_SESSION_TTL):
+    """Discard uploads untouched for ttl seconds: abandoned, never restored or long finished
+
+    Running restores are left to recover_restore_jobs.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=ttl)
+    statuses = ('uploading', 'queued', 'completed')
+    expired = UploadSession.query.filter(UploadSession.updated_at < cutoff,
+                                         UploadSession.status.in_(statuses)).all()
+    discarded = 0
+    for upload in expired:
+        logger.info(f"Discarding abandoned upload {upload.upload_id} of {upload.filename}")
+        try:
+            discard_upload(upload, statuses)
+            discarded += 1
+        except UploadRejected:
+            # Claimed for restore since it was listed
+            continue
+    return discarded
+
+
+def claim_restore_job(worker_id):
+    """Take the oldest queued upload restore for worker_id; returns its session id or None
+
+    The claim is a conditional UPDATE, so several workers can poll the same
+    queue without running a restore twice.
+    """
+    candidates = db.session.execute(
+        select(UploadSession.id)
+        .where(UploadSession.status == 'queued')
+        .order_by(UploadSession.updated_at, UploadSession.id)
+        .limit(10)
+    ).scalars().all()
+
+    for session_id in candidates:
+        now = datetime.utcnow()
+        claimed = db.session.execute(
+            update(UploadSession)
+            .where(UploadSession.id == session_id, UploadSession.status == 'queued')
+            .values(status='restoring', worker_id=worker_id, heartbeat_at=now, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return session_id
+    return None
+
+
+def recover_restore_jobs(stale_after=RESTORE_STALE_AFTER):
+    """Release restores whose worker stopped sending heartbeats
+
+    They are not retried on their own, since the database on the target may
+    have been left half restored; the user finalizes the upload again.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+    orphaned = UploadSession.query.filter(
+        UploadSession.status == 'restoring',
+        or_(UploadSession.heartbeat_at < cutoff,
+            and_(UploadSession.heartbeat_at.is_(None), UploadSession.updated_at < cutoff))
+    ).all()
+
+    for upload in orphaned:
+        logger.warning(f"Upload {upload.upload_id}: worker {upload.worker_id} stopped during the restore; released")
+        release_upload(upload, 'The restore was interrupted because its worker stopped. Finalize the upload again to retry.')
+    return len(orphaned)
+
+
+class UploadRestoreJob:
+    """One claimed upload restore: verify the chunks, stream the file to the server and restore it"""
+
+    def __init__(self, session_id, worker_id):
+        self.session_id = session_id
+        self.worker_id = worker_id
+        self.finished = threading.Event()
+
+    def run(self):
+        """Run the restore to completion or failure; call inside an app context"""
+        heartbeat = threading.Thread(target=self._heartbeat, name=f'restore-heartbeat-{self.session_id}', daemon=True)
+        heartbeat.start()
+        upload = db.session.get(UploadSession, self.session_id)
+
+        try:
+            self._restore(upload)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Restore of upload {upload.upload_id} failed: {str(e)}")
+            release_upload(upload, f'Error processing upload: {str(e)}')
+        finally:
+            self.finished.set()
+            heartbeat.join()
+
+    def _restore(self, upload):
+        target_server = upload.target_server
+
+        # A chunk that no longer matches what was received must not be restored into the database
+        mismatched = verify_upload(upload)
+        if mismatched:
+            release_upload(upload, f'{len(mismatched)} chunk(s) of {upload.filename} were damaged; '
+                                   f'upload the file again to resend them')
+            return
+
+        logger.info(f"Restoring upload {upload.upload_id} ({upload.filename}) to {target_server.name}")
+        with open(staging_path(upload), 'rb') as staged_file:
+            result = restore_uploaded_backup(target_server, iter(lambda: staged_file.read(UPLOAD_READ_SIZE), b''))
+
+        if not result['success']:
+            # Keep the chunks, so the restore can be retried without uploading again
+            logger.error(f"Restore of upload {upload.upload_id} failed: {result['message']}")
+            release_upload(upload, result['message'])
+            return
+
+        local_backup_path = uploaded_backup_path(upload.filename) if upload.keep_copy else None
+        if local_backup_path:
+            os.replace(staging_path(upload), local_backup_path)
+        else:
+            os.remove(staging_path(upload))
+        UploadChunk.query.filter_by(session_id=upload.id).delete()
+        db.session.commit()
+
+        backup = record_uploaded_backup(target_server, upload.filename, local_backup_path, result, upload.user_id)
+        upload.status = 'completed'
+        upload.message = result['message']
+        upload.backup_id = backup.id if backup else None
+        upload.worker_id = None
+        upload.updated_at = datetime.utcnow()
+        db.session.commit()
+        logger.info(f"Restored upload {upload.upload_id} ({upload.filename}) to {target_server.name}")
+
+    def _heartbeat(self):
+        """Keep heartbeat_at fresh from a thread of its own"""
+        with app.app_context():
+            while not self.finished.wait(RESTORE_HEARTBEAT_INTERVAL):
+                try:
+                    db.session.execute(
+                        update(UploadSession)
+                        .where(UploadSession.id == self.session_id, UploadSession.worker_id == self.worker_id,
+                               UploadSession.status == 'restoring')
+                        .values(heartbeat_at=datetime.utcnow())
+                        .execution_options(synchronize_session=False)
+                    )
+                    db.session.commit()
+                except Exception as e:
+                    logger.warning(f"Heartbeat for upload restore {self.session_id} failed: {str(e)}")
+                    db.session.rollback()
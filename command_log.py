@@ -0,0 +1,87 @@
+"""
+Streamed command output persistence
+Appends remote command output to a record's log columns in batches while the
+command runs, so long deploy and backup jobs can be followed live without
+holding their whole output in memory
+"""
+
+import logging
+import time
+
+from sqlalchemy import Text, bindparam, func, select, update
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+LOG_FLUSH_INTERVAL = 2.0  # seconds between writes of buffered output
+LOG_BUFFER_SIZE = 1024 * 1024  # characters buffered before an early write; each append rewrites the column value
+LOG_TAIL_SIZE = 16 * 1024  # characters of each stream kept for error messages
+
+
+class CommandLog:
+    """Buffers stdout/stderr chunks and appends them to two Text columns of one row
+
+    Each flush is a single UPDATE appending in SQL and a commit, so readers
+    polling the row see the output grow.
+    """
+
+    def __init__(self, model, record_id, stdout_column, stderr_column,
+                 flush_interval=LOG_FLUSH_INTERVAL, buffer_size=LOG_BUFFER_SIZE):
+        self.model = model
+        self.record_id = record_id
+        self.columns = {'stdout': getattr(model, stdout_column), 'stderr': getattr(model, stderr_column)}
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.pending = {'stdout': [], 'stderr': []}
+        self.pending_size = 0
+        self.tails = {'stdout': '', 'stderr': ''}
+        self.last_flush = time.monotonic()
+
+    def write(self, stream, text):
+        if not text:
+            return
+        self.pending[stream].append(text)
+        self.pending_size += len(text)
+        self.tails[stream] = (self.tails[stream] + text)[-LOG_TAIL_SIZE:]
+
+        if self.pending_size >= self.buffer_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        values, params = {}, {}
+        for stream, chunks in self.pending.items():
+            if chunks:
+                column = self.columns[stream]
+                # Output goes in as execute parameters: a value baked into the statement
+                # would be kept alive by SQLAlchemy's compiled statement cache
+                values[column.key] = func.coalesce(column, '') + bindparam(f'{stream}_chunk', type_=Text)
+                params[f'{stream}_chunk'] = ''.join(chunks)
+                chunks.clear()
+        self.pending_size = 0
+
+        if not values:
+            return
+        try:
+            # synchronize_session=False keeps the ORM from rebuilding the whole log in Python
+            db.session.execute(update(self.model).where(self.model.id == self.record_id).values(**values)
+                               .execution_options(synchronize_session=False), params)
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"Failed to append command output to {self.model.__name__} {self.record_id}: {str(e)}")
+            db.session.rollback()
+
+    def tail(self, stream):
+        """The last LOG_TAIL_SIZE characters written to stream"""
+        return self.tails[stream]
+
+
+def read_log_tail(model, record_id, column_name, offset=0):
+    """Text of a log column from a character offset on, without loading what came before"""
+    column = getattr(model, column_name)
+    length, text = db.session.execute(
+        select(func.coalesce(func.length(column), 0), func.substr(column, offset + 1))
+        .where(model.id == record_id)
+    ).one()
+    return text or '', length
@@ -0,0 +1,279 @@
+"""
+Rate-limit-aware Hetzner Cloud client
+Paces API calls per token with a token bucket shared across threads and
+retries throttled or failed requests with jittered backoff
+"""
+
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from http import HTTPStatus
+
+import requests
+from requests.adapters import HTTPAdapter
+from hcloud import Client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_ENDPOINT = 'https://api.hetzner.cloud/v1'
+
+# Hetzner Cloud allows 3600 requests per hour per project token; the bucket
+# refills continuously, so the sustained rate is one request per second
+DEFAULT_RATE_LIMIT = 3600
+RATE_LIMIT_WINDOW = 3600  # seconds for an empty bucket to refill completely
+
+MAX_RETRIES = 5
+HTTP_POOL_SIZE = 16  # keep-alive connections per client, enough for the bulk worker pools
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_CAP = 60.0  # seconds
+
+# Errors that mean the request was rejected without being carried out, so
+# retrying is safe for every method (the error codes of hcloud's own retry
+# policy plus the resource lock of a running action)
+RETRY_ERROR_CODES = {
+    'rate_limit_exceeded',
+    'conflict',
+    'locked',
+}
+RETRY_STATUS_CODES = {
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.LOCKED,
+}
+# Server errors (any 5xx) may or may not have carried the request out, so
+# they are only retried for methods that are safe to repeat
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+
+def backoff_delay(retries):
+    """Exponential backoff truncated to BACKOFF_CAP with full jitter"""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** retries)))
+
+
+class RateLimiter:
+    """Token bucket and call counters for one API token
+
+    The bucket refills at the documented rate and is re-synchronised with the
+    RateLimit-Limit/RateLimit-Remaining headers of every response, so it also
+    accounts for calls made by other processes using the same token.
+    """
+
+    def __init__(self, capacity=DEFAULT_RATE_LIMIT):
+        self.lock = threading.Lock()
+        self.capacity = capacity
+        self.refill_rate = capacity / RATE_LIMIT_WINDOW
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.reset_at = None  # unix timestamp from RateLimit-Reset
+        self.stats = {
+            'requests': 0,
+            'throttled': 0,  # calls that had to wait for a token
+            'throttle_seconds': 0.0,
+            'retried': 0,
+            'rate_limited': 0,  # 429 responses received
+            'server_errors': 0  # 5xx responses received
+        }
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def acquire(self):
+        """Take one token, sleeping until one is available"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.stats['requests'] += 1
+                    if waited:
+                        self.stats['throttled'] += 1
+                        self.stats['throttle_seconds'] += waited
+                    return waited
+                delay = (1 - self.tokens) / self.refill_rate
+            time.sleep(delay)
+            waited += delay
+
+    def update_from_response(self, response):
+        """Re-sync the bucket with the rate limit headers of a response"""
+        headers = response.headers
+        limit = headers.get('RateLimit-Limit')
+        remaining = headers.get('RateLimit-Remaining')
+        reset = headers.get('RateLimit-Reset')
+
+        with self.lock:
+            if response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+                self.stats['rate_limited'] += 1
+            elif response.status_code >= 500:
+                self.stats['server_errors'] += 1
+
+            try:
+                if limit is not None and int(limit) > 0 and int(limit) != self.capacity:
+                    self.capacity = int(limit)
+                    self.refill_rate = self.capacity / RATE_LIMIT_WINDOW
+                if remaining is not None:
+                    self.tokens = min(float(remaining), self.capacity)
+                    self.updated = time.monotonic()
+                elif response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+                    self.tokens = 0.0
+                    self.updated = time.monotonic()
+                if reset is not None:
+                    self.reset_at = int(reset)
+            except ValueError:
+                logger.debug(f"Ignoring malformed rate limit headers: {limit}/{remaining}/{reset}")
+
+    def retry_delay(self, response, retries):
+        """Delay before retrying a response: honours Retry-After and the bucket refill time"""
+        delay = backoff_delay(retries)
+
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+
+        if response is not None and response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+            with self.lock:
+                delay = max(delay, (1 - min(self.tokens, 1)) / self.refill_rate)
+
+        with self.lock:
+            self.stats['retried'] += 1
+        return min(delay, BACKOFF_CAP)
+
+    def snapshot(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            return dict(self.stats,
+                        limit=self.capacity,
+                        remaining=int(self.tokens),
+                        reset_at=self.reset_at,
+                        throttle_seconds=round(self.stats['throttle_seconds'], 3))
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def _token_key(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def get_rate_limiter(token):
+    """Process-wide rate limiter for an API token"""
+    key = _token_key(token)
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            limiter = _rate_limiters[key] = RateLimiter()
+        return limiter
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(token):
+    """Process-wide RateLimitedClient for an API token
+
+    Clients are shared across requests and threads so their HTTP sessions keep
+    connections to the API alive instead of doing a TLS handshake per request.
+    """
+    key = _token_key(token)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # HETZNER_API_ENDPOINT points the app at test_scripts/fake_hetzner_api.py for benchmarks
+            api_endpoint = os.environ.get('HETZNER_API_ENDPOINT', DEFAULT_API_ENDPOINT)
+            client = _clients[key] = RateLimitedClient(token=token, api_endpoint=api_endpoint)
+        return client
+
+
+def drop_client(token):
+    """Forget the shared client of a token that is no longer used
+
+    The client is not closed, since other threads may still be using it;
+    its connections go away once the last reference does.
+    """
+    with _clients_lock:
+        _clients.pop(_token_key(token), None)
+
+
+def rate_limit_stats():
+    """Counters for every token used by this process, keyed by a short token hash"""
+    with _rate_limiters_lock:
+        limiters = list(_rate_limiters.items())
+    return {key[:12]: limiter.snapshot() for key, limiter in limiters}
+
+
+class RateLimitedClient(Client):
+    """hcloud Client that paces requests through the token's shared RateLimiter
+
+    Overrides Client.request (hcloud 2.5.x) to take a token before every
+    attempt and to retry rate limited, locked and conflicting requests with
+    jittered backoff instead of failing on the first rate limit hit. Gateway
+    errors and timeouts leave the outcome of a request unknown, so they are
+    only retried for idempotent methods; a POST (create server, power action)
+    is never sent twice.
+    """
+
+    _retry_max_retries = MAX_RETRIES
+
+    def __init__(self, token, **kwargs):
+        super().__init__(token=token, **kwargs)
+        self.rate_limiter = get_rate_limiter(token)
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        self._requests_session.mount('https://', adapter)
+        self._requests_session.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self._requests_timeout)
+
+        url = self._api_endpoint + url
+        headers = self._get_headers()
+
+        retries = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = self._requests_session.request(
+                    method=method,
+                    url=url,
+                    headers=headers,
+                    **kwargs,
+                )
+            except requests.exceptions.Timeout:
+                if retries < self._retry_max_retries and method.upper() in IDEMPOTENT_METHODS:
+                    time.sleep(self.rate_limiter.retry_delay(None, retries))
+                    retries += 1
+                    continue
+                raise
+
+            self.rate_limiter.update_from_response(response)
+
+            if retries < self._retry_max_retries and self._should_retry(method, response):
+                delay = self.rate_limiter.retry_delay(response, retries)
+                logger.warning(f"Hetzner API {method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                retries += 1
+                continue
+
+            return self._read_response(response)
+
+    @staticmethod
+    def _should_retry(method, response):
+        if response.status_code in RETRY_STATUS_CODES:
+            return True
+        if response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR and method.upper() in IDEMPOTENT_METHODS:
+            return True
+        if response.status_code >= 400:
+            try:
+                code = response.json()['error']['code']
+            except (ValueError, KeyError, TypeError):
+                return False
+            return code in RETRY_ERROR_CODES
+        return False
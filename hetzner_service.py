@@ -1,94 +1,173 @@
 import os
+import json
+import time
+import hashlib
 import logging
-from datetime import datetime
-from hcloud import Client
+import threading
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, event, insert, inspect as sa_inspect, or_, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from hcloud.images import Image
 from hcloud.server_types import ServerType
 from hcloud.locations import Location
-from models import HetznerServer
+from hcloud import APIException
+from hcloud.servers import Server
+from models import HetznerServer, HetznerProject, HetznerCatalogCache
+from hetzner_client import get_client, drop_client
 from app import db
 
+# Columns refreshed on existing rows by a sync. Their values form the per-server
+# fingerprint used to skip rows that have not changed in Hetzner Cloud.
+SYNC_UPDATE_FIELDS = ('name', 'status', 'public_ip', 'ipv6', 'reverse_dns')
+
+# Servers per API page during a sync (the Hetzner maximum)
+SYNC_PAGE_SIZE = 50
+
+# Label set on every server provisioned through this app, for partial syncs
+MANAGED_LABEL_SELECTOR = 'managed-by=dynamic-servers'
+
+# Number of action ids polled per GET /actions request
+ACTION_BATCH_SIZE = 25
+
+# Power operations: ServersClient method and the local status once the action succeeds
+POWER_ACTIONS = {
+    'start': ('power_on', 'running'),
+    'stop': ('power_off', 'stopped'),
+    'reboot': ('reboot', 'running'),
+}
+POWER_ACTION_MAX_WORKERS = 8  # concurrent power action requests per project token
+POWER_ACTION_TIMEOUT = 90  # seconds to wait for power actions, well inside gunicorn's 120s worker timeout
+POWER_ACTION_POLL_INTERVAL = 2  # seconds between action polls
+
+# Metric types offered by the Hetzner server metrics API
+METRIC_TYPES = ('cpu', 'disk', 'network')
+
+_query_counters = threading.local()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = getattr(_query_counters, 'active', None)
+    if counter is not None and conn.engine is counter.engine:
+        counter.count += 1
+
+class QueryCounter:
+    """Counts SQL statements issued on an engine by the current thread
+    
+    One listener is registered for all engines at import time; adding and
+    removing listeners per sync would race statements running on the same
+    engine in other threads.
+    """
+    
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self._outer = None
+    
+    def __enter__(self):
+        self._outer = getattr(_query_counters, 'active', None)
+        _query_counters.active = self
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        _query_counters.active = self._outer
+        return False
+
 class HetznerService:
     def __init__(self, project_id=None, api_token=None):
         self.project_id = project_id
-        self.project = None
         
-        # Get API token from project or environment
+        # Get API token from project or environment; clients are shared per token
         if api_token:
             self.api_token = api_token
         elif project_id:
-            from models import HetznerProject
-            self.project = HetznerProject.query.get(project_id)
-            if self.project and self.project.is_active:
-                # If project token is 'USE_ENV_TOKEN', use environment variable
-                if self.project.hetzner_api_token == 'USE_ENV_TOKEN':
-                    self.api_token = os.environ.get('HETZNER_API_TOKEN')
-                else:
-                    self.api_token = self.project.hetzner_api_token
-            else:
-                raise ValueError(f"Project {project_id} not found or inactive")
+            self.api_token = get_project_token(project_id)
         else:
             self.api_token = os.environ.get('HETZNER_API_TOKEN')
             
         if not self.api_token:
             raise ValueError("No API token available - check project configuration or HETZNER_API_TOKEN environment variable")
         
-        self.client = Client(token=self.api_token)
+        self.client = get_client(self.api_token)
         self.logger = logging.getLogger(__name__)
     
-    def sync_servers_from_hetzner(self):
-        """Sync servers from Hetzner Cloud API to local database"""
+    def sync_servers_from_hetzner(self, label_selector=None):
+        """Sync servers from Hetzner Cloud API to local database
+
+        The listing is walked one API page (SYNC_PAGE_SIZE servers) at a time.
+        Each page is diffed by fingerprint against the local rows holding its
+        servers and written as bulk statements in its own transaction, so
+        memory stays flat in big accounts and rows show up while the sync is
+        still running. Listed ids are kept in a packed sorted array for the
+        final deletion pass.
+        
+        With a label_selector (e.g. MANAGED_LABEL_SELECTOR) only matching
+        servers are listed. Such a partial listing cannot tell a deleted
+        server from an unlabelled one, so it never marks rows as deleted;
+        the next full sync does.
+        """
+        timings = dict.fromkeys(('fetch', 'load', 'diff', 'write', 'delete'), 0.0)
+        partial = bool(label_selector)
+        seen_ids = array('q')
+        synced_count = updated_count = deleted_count = pages = 0
         try:
-            # Get all servers from Hetzner
-            hetzner_servers = self.client.servers.get_all()
-            self.logger.info(f"Found {len(hetzner_servers)} servers in Hetzner Cloud")
-            
-            synced_count = 0
-            updated_count = 0
-            deleted_count = 0
-            
-            # Get list of Hetzner server IDs for comparison
-            hetzner_server_ids = {server.id for server in hetzner_servers}
-            
-            for hetzner_server in hetzner_servers:
-                # Check if server exists in our database
-                local_server = HetznerServer.query.filter_by(hetzner_id=hetzner_server.id).first()
+            with QueryCounter(db.engine) as query_counter:
+                for hetzner_servers in self._iter_server_pages(label_selector, timings):
+                    pages += 1
+                    remote_servers = {server.id: self._server_values_from_hetzner(server) for server in hetzner_servers}
+                    seen_ids.extend(remote_servers)
+                    
+                    # Load the local rows holding this page's servers in one query
+                    phase_start = time.perf_counter()
+                    local_servers = self._load_local_servers(remote_servers.keys())
+                    timings['load'] += time.perf_counter() - phase_start
+                    
+                    # Diff remote state against local rows
+                    phase_start = time.perf_counter()
+                    now = datetime.utcnow()
+                    inserts, updates = self._diff_servers(remote_servers, local_servers, now)
+                    timings['diff'] += time.perf_counter() - phase_start
+                    
+                    # Write the page in its own transaction
+                    phase_start = time.perf_counter()
+                    self._apply_server_changes(inserts, updates, [], now)
+                    db.session.commit()
+                    timings['write'] += time.perf_counter() - phase_start
+                    
+                    synced_count += len(inserts)
+                    updated_count += len(updates)
                 
-                if local_server:
-                    # Update existing server
-                    updated = self._update_server_from_hetzner(local_server, hetzner_server)
-                    if updated:
-                        updated_count += 1
-                else:
-                    # Create new server record
-                    self._create_server_from_hetzner(hetzner_server)
-                    synced_count += 1
-            
-            # Handle servers that exist in database but not in Hetzner Cloud anymore
-            if self.project_id:
-                # Only check servers for this specific project
-                local_servers = HetznerServer.query.filter_by(project_id=self.project_id).all()
-            else:
-                # Check all servers if no specific project
-                local_servers = HetznerServer.query.all()
-            
-            for local_server in local_servers:
-                if local_server.hetzner_id and local_server.hetzner_id not in hetzner_server_ids:
-                    # Server no longer exists in Hetzner Cloud
-                    self.logger.info(f"Server {local_server.name} (ID: {local_server.hetzner_id}) no longer exists in Hetzner Cloud - marking as deleted")
-                    local_server.status = 'deleted'
-                    local_server.last_synced = datetime.utcnow()
-                    deleted_count += 1
+                # A server can show up on two pages if the listing shifts mid-walk
+                seen_ids = array('q', sorted(seen_ids))
+                total = sum(1 for i in range(len(seen_ids)) if i == 0 or seen_ids[i] != seen_ids[i - 1])
+                
+                if not partial:
+                    phase_start = time.perf_counter()
+                    deleted_ids = self._find_deleted_servers(seen_ids)
+                    self._apply_server_changes([], [], deleted_ids, datetime.utcnow())
+                    db.session.commit()
+                    deleted_count = len(deleted_ids)
+                    timings['delete'] += time.perf_counter() - phase_start
             
-            db.session.commit()
-            self.logger.info(f"Sync completed: {synced_count} new servers, {updated_count} updated, {deleted_count} marked as deleted")
+            timings = {phase: round(seconds, 3) for phase, seconds in timings.items()}
+            self.logger.info(f"Sync completed: {synced_count} new servers, {updated_count} updated, {deleted_count} marked as deleted "
+                             f"({total} servers in {pages} pages, {query_counter.count} queries, timings: {timings})")
             
             return {
                 'success': True,
                 'synced': synced_count,
                 'updated': updated_count,
                 'deleted': deleted_count,
-                'total': len(hetzner_servers)
+                'unchanged': total - synced_count - updated_count,
+                'total': total,
+                'pages': pages,
+                'partial': partial,
+                'queries': query_counter.count,
+                'timings': timings
             }
             
         except Exception as e:
@@ -99,8 +178,136 @@ class HetznerService:
                 'error': str(e)
             }
     
-    def create_server(self, name: str, server_type: str, image: str = 'ubuntu-22.04', location: str = 'nbg1', labels: dict = None):
-        """Create a new server in Hetzner Cloud"""
+    def _iter_server_pages(self, label_selector=None, timings=None):
+        """Yield the account's servers one API page at a time"""
+        page = 1
+        while page:
+            phase_start = time.perf_counter()
+            result = self.client.servers.get_list(label_selector=label_selector, page=page, per_page=SYNC_PAGE_SIZE)
+            if timings is not None:
+                timings['fetch'] += time.perf_counter() - phase_start
+            
+            yield result.servers
+            
+            pagination = result.meta.pagination if result.meta else None
+            page = pagination.next_page if pagination else None
+    
+    def _load_local_servers(self, hetzner_ids):
+        """Load the local rows holding the given servers, keyed by hetzner_id"""
+        columns = [HetznerServer.id, HetznerServer.hetzner_id, HetznerServer.project_id]
+        columns += [getattr(HetznerServer, field) for field in SYNC_UPDATE_FIELDS]
+        query = select(*columns).where(HetznerServer.hetzner_id.in_(list(hetzner_ids)))
+        
+        return {row['hetzner_id']: dict(row) for row in db.session.execute(query).mappings()}
+    
+    def _diff_servers(self, remote_servers, local_servers, now):
+        """Split remote state into insert rows and update rows"""
+        inserts = []
+        updates = []
+        
+        for hetzner_id, values in remote_servers.items():
+            local_server = local_servers.get(hetzner_id)
+            if local_server is None:
+                row = dict(values, hetzner_id=hetzner_id, last_synced=now)
+                if self.project_id:
+                    row['project_id'] = self.project_id
+                inserts.append(row)
+            elif self._fingerprint(local_server) != self._fingerprint(values):
+                row = {field: values[field] for field in SYNC_UPDATE_FIELDS}
+                row.update(id=local_server['id'], last_synced=now)
+                updates.append(row)
+        
+        return inserts, updates
+    
+    def _find_deleted_servers(self, seen_ids):
+        """Ids of local rows whose server was not listed (seen_ids is a sorted array)"""
+        query = select(HetznerServer.id, HetznerServer.hetzner_id, HetznerServer.name).where(
+            HetznerServer.hetzner_id.isnot(None),
+            HetznerServer.status != 'deleted'
+        )
+        if self.project_id:
+            query = query.where(HetznerServer.project_id == self.project_id)
+        
+        # Servers that exist in database but not in Hetzner Cloud anymore
+        deleted_ids = []
+        for row in db.session.execute(query.execution_options(yield_per=SYNC_PAGE_SIZE * 20)):
+            position = bisect_left(seen_ids, row.hetzner_id)
+            if position < len(seen_ids) and seen_ids[position] == row.hetzner_id:
+                continue
+            self.logger.info(f"Server {row.name} (ID: {row.hetzner_id}) no longer exists in Hetzner Cloud - marking as deleted")
+            deleted_ids.append(row.id)
+        
+        return deleted_ids
+    
+    def _apply_server_changes(self, inserts, updates, deleted_ids, now):
+        """Write a sync diff as bulk statements in the current transaction"""
+        if inserts:
+            db.session.execute(insert(HetznerServer), inserts)
+        if updates:
+            db.session.execute(update(HetznerServer), updates)
+        if deleted_ids:
+            db.session.execute(
+                update(HetznerServer)
+                .where(HetznerServer.id.in_(deleted_ids))
+                .values(status='deleted', last_synced=now),
+                execution_options={'synchronize_session': False}
+            )
+    
+    @staticmethod
+    def _fingerprint(values):
+        """Fingerprint of the synced fields of a server, local or remote"""
+        return tuple(values[field] for field in SYNC_UPDATE_FIELDS)
+    
+    def refresh_servers(self, hetzner_ids):
+        """Refresh specific servers with one get_by_id each instead of listing the account
+        
+        Meant for the rows touched by a power action or a provision. Servers
+        Hetzner no longer knows are marked as deleted.
+        """
+        try:
+            remote_servers = {}
+            missing_ids = []
+            for hetzner_id in dict.fromkeys(hetzner_ids):
+                try:
+                    remote_servers[hetzner_id] = self._server_values_from_hetzner(self.client.servers.get_by_id(hetzner_id))
+                except APIException as e:
+                    if e.code != 'not_found':
+                        raise
+                    missing_ids.append(hetzner_id)
+            
+            local_servers = self._load_local_servers(list(remote_servers) + missing_ids)
+            now = datetime.utcnow()
+            inserts, updates = self._diff_servers(remote_servers, local_servers, now)
+            deleted_ids = [local_servers[hetzner_id]['id'] for hetzner_id in missing_ids
+                           if hetzner_id in local_servers and local_servers[hetzner_id]['status'] != 'deleted']
+            
+            self._apply_server_changes(inserts, updates, deleted_ids, now)
+            db.session.commit()
+            
+            return {
+                'success': True,
+                'synced': len(inserts),
+                'updated': len(updates),
+                'deleted': len(deleted_ids),
+                'unchanged': len(remote_servers) - len(inserts) - len(updates),
+                'total': len(remote_servers)
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Error refreshing servers {list(hetzner_ids)}: {str(e)}")
+            db.session.rollback()
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    def submit_server_creation(self, name: str, server_type: str, image: str = 'ubuntu-22.04', location: str = 'nbg1', labels: dict = None):
+        """Submit a new server to Hetzner Cloud without waiting for it to boot
+        
+        Returns the create_server action id at once. The local record is
+        created with the initial status and the public IP Hetzner assigned;
+        action_tracker.track_server_actions follows the action from there.
+        """
         try:
             self.logger.info(f"Creating server: {name} ({server_type}) in {location}")
             
@@ -124,13 +331,7 @@ class HetznerService:
             )
             
             hetzner_server = response.server
-            self.logger.info(f"Server created successfully: {hetzner_server.name} (ID: {hetzner_server.id})")
-            
-            # Wait for server to be ready and get IP
-            self.client.servers.wait_until_ready(hetzner_server)
-            
-            # Refresh server data to get IP address
-            hetzner_server = self.client.servers.get_by_id(hetzner_server.id)
+            self.logger.info(f"Server creation submitted: {hetzner_server.name} (ID: {hetzner_server.id}, action {response.action.id})")
             
             # Create local database entry
             local_server = self._create_server_from_hetzner(hetzner_server)
@@ -140,8 +341,11 @@ class HetznerService:
                 'success': True,
                 'server': local_server,
                 'hetzner_server': hetzner_server,
-                'ip_address': hetzner_server.public_net.ipv4.ip if hetzner_server.public_net.ipv4 else None,
-                'message': f'Server {name} created successfully'
+                'hetzner_id': hetzner_server.id,
+                'action': response.action,
+                'action_id': response.action.id,
+                'ip_address': hetzner_server.public_net.ipv4.ip if hetzner_server.public_net and hetzner_server.public_net.ipv4 else None,
+                'message': f'Server {name} creation submitted'
             }
             
         except Exception as e:
@@ -152,6 +356,50 @@ class HetznerService:
                 'error': str(e)
             }
     
+    def create_server(self, name: str, server_type: str, image: str = 'ubuntu-22.04', location: str = 'nbg1', labels: dict = None):
+        """Create a new server in Hetzner Cloud and block until it is ready"""
+        result = self.submit_server_creation(name, server_type, image=image, location=location, labels=labels)
+        if not result['success']:
+            return result
+        
+        try:
+            # Wait for the create action to finish and refresh server data
+            result['action'].wait_until_finished()
+            hetzner_server = self.client.servers.get_by_id(result['hetzner_id'])
+            self._update_server_from_hetzner(result['server'], hetzner_server)
+            db.session.commit()
+            
+            result.update(
+                hetzner_server=hetzner_server,
+                ip_address=hetzner_server.public_net.ipv4.ip if hetzner_server.public_net.ipv4 else None,
+                message=f'Server {name} created successfully'
+            )
+            return result
+            
+        except Exception as e:
+            self.logger.error(f"Error waiting for server {name}: {str(e)}")
+            db.session.rollback()
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    def get_actions(self, action_ids):
+        """Fetch the state of many actions, one API call per batch of ACTION_BATCH_SIZE
+        
+        Returns the raw action dicts (status, progress, error) keyed by id.
+        """
+        action_ids = list(action_ids)
+        actions = {}
+        
+        for start in range(0, len(action_ids), ACTION_BATCH_SIZE):
+            batch = action_ids[start:start + ACTION_BATCH_SIZE]
+            response = self.client.request(method='GET', url='/actions', params={'id': batch, 'per_page': ACTION_BATCH_SIZE})
+            for action in response.get('actions', []):
+                actions[action['id']] = action
+        
+        return actions
+    
     def delete_server(self, server_id: int):
         """Delete a server from Hetzner Cloud"""
         try:
@@ -184,34 +432,34 @@ class HetznerService:
                 'error': str(e)
             }
     
+    def _server_values_from_hetzner(self, hetzner_server):
+        """Map Hetzner API server data to HetznerServer column values"""
+        return {
+            'name': hetzner_server.name,
+            'status': hetzner_server.status,
+            'server_type': hetzner_server.server_type.name,
+            'image': hetzner_server.image.name if hetzner_server.image else "unknown",
+            
+            # Network information
+            'public_ip': hetzner_server.public_net.ipv4.ip if hetzner_server.public_net.ipv4 else None,
+            'ipv6': hetzner_server.public_net.ipv6.ip if hetzner_server.public_net.ipv6 else None,
+            'reverse_dns': self._get_reverse_dns(hetzner_server),
+            'private_ip': hetzner_server.private_net[0].ip if hetzner_server.private_net else None,
+            
+            # Location and datacenter
+            'datacenter': hetzner_server.datacenter.name if hetzner_server.datacenter else None,
+            'location': hetzner_server.datacenter.location.name if hetzner_server.datacenter and hetzner_server.datacenter.location else None,
+            
+            # Specifications
+            'cpu_cores': hetzner_server.server_type.cores,
+            'memory_gb': hetzner_server.server_type.memory,
+            'disk_gb': hetzner_server.server_type.disk
+        }
+    
     def _create_server_from_hetzner(self, hetzner_server):
         """Create a new HetznerServer record from Hetzner API data"""
-        server = HetznerServer()
+        server = HetznerServer(**self._server_values_from_hetzner(hetzner_server))
         server.hetzner_id = hetzner_server.id
-        server.name = hetzner_server.name
-        server.status = hetzner_server.status
-        server.server_type = hetzner_server.server_type.name
-        server.image = hetzner_server.image.name if hetzner_server.image else "unknown"
-        
-        # Network information
-        server.public_ip = hetzner_server.public_net.ipv4.ip if hetzner_server.public_net.ipv4 else None
-        server.ipv6 = hetzner_server.public_net.ipv6.ip if hetzner_server.public_net.ipv6 else None
-        
-        # Get reverse DNS
-        server.reverse_dns = self._get_reverse_dns(hetzner_server)
-        
-        # Private networks
-        if hetzner_server.private_net:
-            server.private_ip = hetzner_server.private_net[0].ip if hetzner_server.private_net else None
-        
-        # Location and datacenter
-        server.datacenter = hetzner_server.datacenter.name if hetzner_server.datacenter else None
-        server.location = hetzner_server.datacenter.location.name if hetzner_server.datacenter and hetzner_server.datacenter.location else None
-        
-        # Specifications
-        server.cpu_cores = hetzner_server.server_type.cores
-        server.memory_gb = hetzner_server.server_type.memory
-        server.disk_gb = hetzner_server.server_type.disk
         
         # Assign to project if specified
         if self.project_id:
@@ -221,6 +469,7 @@ class HetznerService:
         
         db.session.add(server)
         self.logger.info(f"Created new server record: {server.name}")
+        return server
     
     def _update_server_from_hetzner(self, local_server, hetzner_server):
         """Update existing HetznerServer record with fresh data from Hetzner API"""
@@ -287,26 +536,28 @@ class HetznerService:
             self.logger.error(f"Error getting server info for ID {hetzner_id}: {str(e)}")
             return None
     
-    def get_server_metrics(self, hetzner_id):
-        """Get server metrics (CPU, memory, disk usage)"""
+    def get_server_metrics(self, hetzner_id, start=None, end=None, step=None, types=METRIC_TYPES):
+        """Get server metric time series (CPU, disk, network), today's by default
+        
+        Returns the time series keyed by name (cpu, disk.0.iops.read, ...),
+        each a list of (unix timestamp, value string) pairs, plus the step
+        Hetzner answered with.
+        """
         try:
-            server = self.client.servers.get_by_id(hetzner_id)
-            if not server:
-                return None
+            end = end or datetime.utcnow()
+            start = start or end.replace(hour=0, minute=0, second=0, microsecond=0)
             
-            # Get metrics from Hetzner (this is a simplified version)
-            # In a real implementation, you'd use the metrics API
-            metrics = self.client.servers.get_metrics(
-                server=server,
-                type=['cpu', 'memory', 'disk'],
-                start=datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0),
-                end=datetime.utcnow()
+            response = self.client.servers.get_metrics(
+                server=Server(id=hetzner_id),
+                type=list(types),
+                start=start.isoformat() + 'Z',
+                end=end.isoformat() + 'Z',
+                step=step
             )
             
             return {
-                'cpu': metrics.time_series.get('cpu', []),
-                'memory': metrics.time_series.get('memory', []),
-                'disk': metrics.time_series.get('disk', [])
+                'step': response.metrics.step,
+                'time_series': {name: series['values'] for name, series in response.metrics.time_series.items()}
             }
             
         except Exception as e:
@@ -315,37 +566,77 @@ class HetznerService:
     
     def start_server(self, hetzner_id):
         """Start a server"""
-        try:
-            server = self.client.servers.get_by_id(hetzner_id)
-            if server:
-                action = self.client.servers.power_on(server)
-                return {'success': True, 'action_id': action.id}
-            return {'success': False, 'error': 'Server not found'}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+        return self._power_action(hetzner_id, 'start')
     
     def stop_server(self, hetzner_id):
         """Stop a server"""
-        try:
-            server = self.client.servers.get_by_id(hetzner_id)
-            if server:
-                action = self.client.servers.power_off(server)
-                return {'success': True, 'action_id': action.id}
-            return {'success': False, 'error': 'Server not found'}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+        return self._power_action(hetzner_id, 'stop')
     
     def reboot_server(self, hetzner_id):
         """Reboot a server"""
+        return self._power_action(hetzner_id, 'reboot')
+    
+    def _power_action(self, hetzner_id, action):
+        """Issue a power action by server id, without fetching the server first"""
         try:
-            server = self.client.servers.get_by_id(hetzner_id)
-            if server:
-                action = self.client.servers.reboot(server)
-                return {'success': True, 'action_id': action.id}
-            return {'success': False, 'error': 'Server not found'}
+            method_name, _ = POWER_ACTIONS[action]
+            hetzner_action = getattr(self.client.servers, method_name)(Server(id=hetzner_id))
+            return {'success': True, 'action_id': hetzner_action.id}
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    def power_action_servers(self, action, hetzner_ids, max_workers=POWER_ACTION_MAX_WORKERS, timeout=POWER_ACTION_TIMEOUT):
+        """Run a power action on many servers of this project and wait for the outcome
+        
+        Actions are issued concurrently (paced by the token's rate limiter),
+        then confirmed by polling them in batches with get_actions. Returns
+        per-server results keyed by Hetzner id: success, action_id, and the
+        confirmed status or an error. Actions still running after timeout
+        seconds are returned with pending set; the next sync picks up their
+        final state.
+        """
+        hetzner_ids = list(dict.fromkeys(hetzner_ids))
+        results = {}
+        deadline = time.monotonic() + timeout
+        
+        if not hetzner_ids:
+            return results
+        
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(hetzner_ids)), thread_name_prefix='hetzner-power') as executor:
+            futures = {executor.submit(self._power_action, hetzner_id, action): hetzner_id for hetzner_id in hetzner_ids}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        
+        pending = {result['action_id']: hetzner_id for hetzner_id, result in results.items() if result['success']}
+        
+        while pending:
+            try:
+                actions = self.get_actions(pending)
+            except Exception as e:
+                self.logger.warning(f"Error polling power actions: {str(e)}")
+                actions = {}
+            
+            for action_id, hetzner_action in actions.items():
+                if action_id not in pending or hetzner_action['status'] == 'running':
+                    continue
+                result = results[pending.pop(action_id)]
+                if hetzner_action['status'] == 'success':
+                    result['status'] = POWER_ACTIONS[action][1]
+                else:
+                    error = hetzner_action.get('error') or {}
+                    result.update(success=False, error=error.get('message', f'{action} action failed'))
+            
+            if not pending:
+                break
+            if time.monotonic() >= deadline:
+                for hetzner_id in pending.values():
+                    results[hetzner_id].update(success=False, pending=True,
+                                               error=f'{action} action is still running')
+                break
+            time.sleep(POWER_ACTION_POLL_INTERVAL)
+        
+        return results
+    
     def get_server_current_status(self, hetzner_id):
         """Get the current status of a single server from Hetzner Cloud"""
         try:
@@ -358,60 +649,133 @@ class HetznerService:
     
     def get_available_images(self):
         """Get list of available images for server creation"""
-        try:
-            images = self.client.images.get_all()
-            return [
-                {
-                    'id': img.id,
-                    'name': img.name,
-                    'description': img.description,
-                    'os_flavor': img.os_flavor,
-                    'os_version': img.os_version,
-                    'type': img.type
-                }
-                for img in images if img.type == 'system'
-            ]
-        except Exception as e:
-            self.logger.error(f"Error getting available images: {str(e)}")
-            return []
+        return self._get_catalog('images', self._fetch_images)
     
     def get_available_server_types(self):
         """Get list of available server types"""
-        try:
-            server_types = self.client.server_types.get_all()
-            return [
-                {
-                    'id': st.id,
-                    'name': st.name,
-                    'description': st.description,
-                    'cores': st.cores,
-                    'memory': st.memory,
-                    'disk': st.disk,
-                    'prices': st.prices
-                }
-                for st in server_types
-            ]
-        except Exception as e:
-            self.logger.error(f"Error getting available server types: {str(e)}")
-            return []
+        return self._get_catalog('server_types', self._fetch_server_types)
     
     def get_available_locations(self):
         """Get list of available locations"""
+        return self._get_catalog('locations', self._fetch_locations)
+    
+    def refresh_catalogs(self):
+        """Re-fetch every catalog whose cache entry is missing or past its TTL
+        
+        Called by the background sync worker so web requests keep hitting
+        fresh entries.
+        """
+        token_hash = _token_hash(self.api_token)
+        ttl = current_app.config['HETZNER_CATALOG_TTL']
+        refreshed = []
+        
+        for catalog, fetch in (('images', self._fetch_images),
+                               ('server_types', self._fetch_server_types),
+                               ('locations', self._fetch_locations)):
+            entry = _read_catalog_entry(token_hash, catalog)
+            if entry and (datetime.utcnow() - entry['fetched_at']).total_seconds() < ttl:
+                continue
+            try:
+                _store_catalog_entry(token_hash, catalog, fetch())
+                refreshed.append(catalog)
+            except Exception as e:
+                self.logger.error(f"Error refreshing {catalog} catalog: {str(e)}")
+        
+        return refreshed
+    
+    def invalidate_catalog_cache(self, catalog=None):
+        """Drop cached catalog entries for this token (all catalogs by default)"""
+        invalidate_catalog_cache(self.api_token, catalog)
+    
+    def _fetch_images(self):
+        images = self.client.images.get_all()
+        return [
+            {
+                'id': img.id,
+                'name': img.name,
+                'description': img.description,
+                'os_flavor': img.os_flavor,
+                'os_version': img.os_version,
+                'type': img.type
+            }
+            for img in images if img.type == 'system'
+        ]
+    
+    def _fetch_server_types(self):
+        server_types = self.client.server_types.get_all()
+        return [
+            {
+                'id': st.id,
+                'name': st.name,
+                'description': st.description,
+                'cores': st.cores,
+                'memory': st.memory,
+                'disk': st.disk,
+                'prices': st.prices
+            }
+            for st in server_types
+        ]
+    
+    def _fetch_locations(self):
+        locations = self.client.locations.get_all()
+        return [
+            {
+                'id': loc.id,
+                'name': loc.name,
+                'description': loc.description,
+                'country': loc.country,
+                'city': loc.city
+            }
+            for loc in locations
+        ]
+    
+    def _get_catalog(self, catalog, fetch):
+        """Serve a catalog listing from the shared cache
+        
+        Fresh entries are returned as-is. Stale entries within the
+        HETZNER_CATALOG_MAX_STALE window are returned immediately while one
+        worker refreshes them in the background. Missing or expired entries
+        are fetched inline.
+        """
+        token_hash = _token_hash(self.api_token)
+        entry = _read_catalog_entry(token_hash, catalog)
+        
+        if entry:
+            age = (datetime.utcnow() - entry['fetched_at']).total_seconds()
+            ttl = current_app.config['HETZNER_CATALOG_TTL']
+            if age < ttl:
+                return json.loads(entry['payload'])
+            if age < ttl + current_app.config['HETZNER_CATALOG_MAX_STALE']:
+                if _claim_catalog_refresh(entry['id']):
+                    self._refresh_catalog_in_background(catalog, fetch.__name__)
+                return json.loads(entry['payload'])
+        
         try:
-            locations = self.client.locations.get_all()
-            return [
-                {
-                    'id': loc.id,
-                    'name': loc.name,
-                    'description': loc.description,
-                    'country': loc.country,
-                    'city': loc.city
-                }
-                for loc in locations
-            ]
+            items = fetch()
         except Exception as e:
-            self.logger.error(f"Error getting available locations: {str(e)}")
-            return []
+            self.logger.error(f"Error getting available {catalog.replace('_', ' ')}: {str(e)}")
+            return json.loads(entry['payload']) if entry else []
+        
+        _store_catalog_entry(token_hash, catalog, items)
+        return items
+    
+    def _refresh_catalog_in_background(self, catalog, fetch_name):
+        """Revalidate a stale catalog entry on a daemon thread"""
+        flask_app = current_app._get_current_object()
+        api_token = self.api_token
+        
+        def refresh():
+            with flask_app.app_context():
+                token_hash = _token_hash(api_token)
+                try:
+                    service = HetznerService(api_token=api_token)
+                    _store_catalog_entry(token_hash, catalog, getattr(service, fetch_name)())
+                    self.logger.info(f"Refreshed cached {catalog} catalog")
+                except Exception as e:
+                    self.logger.error(f"Background refresh of {catalog} catalog failed: {str(e)}")
+                    _release_catalog_refresh(token_hash, catalog)
+        
+        threading.Thread(target=refresh, name=f'catalog-refresh-{catalog}', daemon=True).start()
     
     def _get_reverse_dns(self, hetzner_server):
         """Get reverse DNS for server's public IP"""
@@ -442,4 +806,217 @@ class HetznerService:
         except Exception as e:
             self.logger.error(f"Error getting reverse DNS for {hetzner_server.name}: {str(e)}")
             self.logger.debug(f"DNS PTR structure: {type(hetzner_server.public_net.ipv4.dns_ptr)} - {hetzner_server.public_net.ipv4.dns_ptr}")
-            return None
\ No newline at end of file
+            return None
+
+# Catalog cache helpers. They run on their own connection so that reading or
+# refreshing the cache never commits the caller's pending session changes.
+
+CATALOG_REFRESH_TIMEOUT = 300  # seconds before an abandoned refresh claim can be retaken
+
+def _token_hash(api_token):
+    return hashlib.sha256(api_token.encode('utf-8')).hexdigest()
+
+def _read_catalog_entry(token_hash, catalog):
+    table = HetznerCatalogCache.__table__
+    with db.engine.connect() as conn:
+        row = conn.execute(
+            select(table).where(table.c.token_hash == token_hash, table.c.catalog == catalog)
+        ).mappings().first()
+    return dict(row) if row else None
+
+def _store_catalog_entry(token_hash, catalog, items):
+    table = HetznerCatalogCache.__table__
+    values = {
+        'payload': json.dumps(items, default=str),
+        'fetched_at': datetime.utcnow(),
+        'refreshing_since': None
+    }
+    try:
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                update(table).where(table.c.token_hash == token_hash, table.c.catalog == catalog).values(**values)
+            )
+            if result.rowcount == 0:
+                conn.execute(insert(table).values(token_hash=token_hash, catalog=catalog, **values))
+    except IntegrityError:
+        # Another worker inserted the same entry first
+        pass
+
+def _claim_catalog_refresh(entry_id):
+    """Atomically mark an entry as refreshing; False if another worker holds it"""
+    table = HetznerCatalogCache.__table__
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        result = conn.execute(
+            update(table)
+            .where(table.c.id == entry_id, or_(
+                table.c.refreshing_since.is_(None),
+                table.c.refreshing_since < now - timedelta(seconds=CATALOG_REFRESH_TIMEOUT)
+            ))
+            .values(refreshing_since=now)
+        )
+    return result.rowcount == 1
+
+def _release_catalog_refresh(token_hash, catalog):
+    table = HetznerCatalogCache.__table__
+    with db.engine.begin() as conn:
+        conn.execute(
+            update(table).where(table.c.token_hash == token_hash, table.c.catalog == catalog).values(refreshing_since=None)
+        )
+
+def invalidate_catalog_cache(api_token=None, catalog=None):
+    """Drop cached catalog entries for one token, or for all tokens if none is given"""
+    table = HetznerCatalogCache.__table__
+    query = delete(table)
+    if api_token:
+        query = query.where(table.c.token_hash == _token_hash(api_token))
+    if catalog:
+        query = query.where(table.c.catalog == catalog)
+    with db.engine.begin() as conn:
+        conn.execute(query)
+
+# Project token registry. Resolving a project's token costs a DB lookup, so the
+# result is remembered per project and revalidated every PROJECT_TOKEN_TTL
+# seconds. Changes made through this process are picked up at once.
+
+PROJECT_TOKEN_TTL = 60  # seconds other processes may keep using a replaced token
+
+_project_tokens = {}  # project_id -> (api_token, resolved_at)
+_project_tokens_lock = threading.Lock()
+
+def _resolve_project_token(project_id):
+    project = HetznerProject.query.get(project_id)
+    if not project or not project.is_active:
+        raise ValueError(f"Project {project_id} not found or inactive")
+    
+    # If project token is 'USE_ENV_TOKEN', use environment variable
+    if project.hetzner_api_token == 'USE_ENV_TOKEN':
+        return os.environ.get('HETZNER_API_TOKEN')
+    return project.hetzner_api_token
+
+def get_project_token(project_id):
+    """API token of an active project, from the registry while it is fresh"""
+    now = time.monotonic()
+    with _project_tokens_lock:
+        cached = _project_tokens.get(project_id)
+    if cached and now - cached[1] < PROJECT_TOKEN_TTL:
+        return cached[0]
+    
+    try:
+        api_token = _resolve_project_token(project_id)
+    except ValueError:
+        forget_project_token(project_id)
+        raise
+    
+    with _project_tokens_lock:
+        _project_tokens[project_id] = (api_token, now)
+    if cached and cached[0] and cached[0] != api_token:
+        drop_client(cached[0])
+    return api_token
+
+def forget_project_token(project_id):
+    """Drop a project's cached token and the client built for it"""
+    with _project_tokens_lock:
+        cached = _project_tokens.pop(project_id, None)
+    if cached and cached[0]:
+        drop_client(cached[0])
+
+@event.listens_for(HetznerProject, 'after_update')
+def _project_token_changed(mapper, connection, target):
+    state = sa_inspect(target)
+    if state.attrs.hetzner_api_token.history.has_changes() or state.attrs.is_active.history.has_changes():
+        forget_project_token(target.id)
+
+@event.listens_for(HetznerProject, 'after_delete')
+def _project_deleted(mapper, connection, target):
+    forget_project_token(target.id)
+
+def _sync_project_in_context(flask_app, project_id):
+    """Sync one project inside its own app context, and so its own DB session"""
+    with flask_app.app_context():
+        try:
+            return HetznerService(project_id=project_id).sync_servers_from_hetzner()
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+def sync_projects(project_ids, max_workers=None):
+    """Sync several projects concurrently with a bounded worker pool
+    
+    Each project has its own API token and rate limit, so wall-clock time
+    approaches that of the slowest project instead of the sum of all of them.
+    Returns the sync results keyed by project id.
+    """
+    flask_app = current_app._get_current_object()
+    max_workers = max_workers or flask_app.config.get('SYNC_MAX_WORKERS', 4)
+    results = {}
+    
+    if not project_ids:
+        return results
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(project_ids)), thread_name_prefix='hetzner-sync') as executor:
+        futures = {executor.submit(_sync_project_in_context, flask_app, project_id): project_id for project_id in project_ids}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    
+    return results
+
+def _power_action_in_context(flask_app, project_id, action, hetzner_ids):
+    """Run one project's power actions inside its own app context"""
+    with flask_app.app_context():
+        try:
+            return HetznerService(project_id=project_id).power_action_servers(action, hetzner_ids)
+        except Exception as e:
+            return {hetzner_id: {'success': False, 'error': str(e)} for hetzner_id in hetzner_ids}
+
+def power_action_servers(servers, action, max_workers=None):
+    """Start, stop or reboot many servers across projects
+    
+    Servers are grouped by project, since each project has its own token and
+    rate limit, and the projects are processed concurrently. Local statuses
+    are only updated once Hetzner confirms the action finished. Returns
+    per-server results keyed by local server id.
+    """
+    if action not in POWER_ACTIONS:
+        raise ValueError(f'Unknown power action: {action}')
+    
+    flask_app = current_app._get_current_object()
+    max_workers = max_workers or flask_app.config.get('SYNC_MAX_WORKERS', 4)
+    results = {}
+    servers_by_project = {}
+    
+    for server in servers:
+        if server.is_self_hosted or not server.hetzner_id:
+            results[server.id] = {'success': False, 'error': 'Power actions are not available for client-managed servers'}
+        elif not server.project_id:
+            results[server.id] = {'success': False, 'error': 'Server is not assigned to a project'}
+        else:
+            servers_by_project.setdefault(server.project_id, []).append(server)
+    
+    if servers_by_project:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(servers_by_project)), thread_name_prefix='hetzner-power') as executor:
+            futures = {
+                executor.submit(_power_action_in_context, flask_app, project_id, action,
+                                [server.hetzner_id for server in project_servers]): project_servers
+                for project_id, project_servers in servers_by_project.items()
+            }
+            for future in as_completed(futures):
+                project_results = future.result()
+                for server in futures[future]:
+                    results[server.id] = project_results.get(server.hetzner_id, {'success': False, 'error': 'Action did not run'})
+    
+    # Record confirmed states in one statement per status
+    now = datetime.utcnow()
+    confirmed = {}
+    for server_id, result in results.items():
+        if result['success']:
+            confirmed.setdefault(result['status'], []).append(server_id)
+    for status, server_ids in confirmed.items():
+        db.session.execute(
+            update(HetznerServer)
+            .where(HetznerServer.id.in_(server_ids))
+            .values(status=status, last_synced=now)
+        )
+    db.session.commit()
+    
+    return results
+
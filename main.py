@@ -1,5 +1,10 @@
 from app import app
 import routes  # noqa: F401
 
+if not app.config['EXTERNAL_BACKUP_WORKER']:
+    # Nothing else runs queued backups and upload restores
+    import backup_worker
+    backup_worker.start_in_background()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,328 @@
+"""
+Server Metrics Store
+Collects CPU, disk and network metrics for the whole fleet from the Hetzner
+metrics API and keeps them in compact fixed-step blocks at three resolution
+tiers, so charts are served from the database instead of the API. Each
+collection spends at most a share of a project's API budget, so large fleets
+are collected a slice at a time, least recently collected servers first.
+"""
+
+import logging
+import math
+import sys
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, or_, select
+
+from app import db
+from models import HetznerServer, ServerMetricBlock
+from hetzner_service import HetznerService
+from hetzner_client import get_rate_limiter, RATE_LIMIT_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# name, seconds between samples, seconds per block, seconds of retention
+METRIC_TIERS = (
+    ('raw', 60, 24 * 3600, 2 * 24 * 3600),
+    ('5m', 300, 7 * 24 * 3600, 30 * 24 * 3600),
+    ('1h', 3600, 30 * 24 * 3600, 400 * 24 * 3600),
+)
+RAW_TIER = METRIC_TIERS[0]
+
+# How far back a server without stored metrics is backfilled
+METRICS_BACKFILL = 3600  # seconds
+
+# Most points a range query returns per series before moving to a coarser tier
+DEFAULT_MAX_POINTS = 720
+
+# API budget of metrics collection per project token: at most this share of the
+# hourly rate limit, and nothing while less than the reserve share of the
+# bucket is left, so syncs and power actions are never starved
+METRICS_API_SHARE = 0.25
+METRICS_API_RESERVE = 0.5
+
+
+def _epoch(value):
+    """Unix timestamp (int) for a naive UTC datetime"""
+    return int((value - datetime(1970, 1, 1)).total_seconds())
+
+
+def _empty_samples(tier):
+    _, step, span, _ = tier
+    return array('f', [math.nan]) * (span // step)
+
+
+def _unpack(data):
+    samples = array('f')
+    samples.frombytes(data)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples
+
+
+def _pack(samples):
+    if sys.byteorder == 'big':
+        samples = array('f', samples)
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def store_metrics(server_id, time_series):
+    """Write raw samples for one server and recompute the rollups they touch
+
+    time_series maps series names to (unix timestamp, value) pairs as
+    returned by HetznerService.get_server_metrics. All affected blocks are
+    read with one query; the caller commits.
+    """
+    _, raw_step, raw_span, _ = RAW_TIER
+
+    # Group incoming samples by series and raw block
+    incoming = {}
+    for series, points in time_series.items():
+        for timestamp, value in points:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                continue
+            timestamp = int(timestamp)
+            block_start = timestamp - timestamp % raw_span
+            incoming.setdefault((series, block_start), []).append((timestamp, value))
+
+    if not incoming:
+        return 0
+
+    block_starts = {(name, block_start - block_start % span)
+                    for name, _, span, _ in METRIC_TIERS
+                    for _, block_start in incoming}
+    existing = ServerMetricBlock.query.filter(
+        ServerMetricBlock.server_id == server_id,
+        ServerMetricBlock.series.in_({series for series, _ in incoming}),
+        ServerMetricBlock.block_start.in_({block_start for _, block_start in block_starts})
+    ).all()
+    blocks = {(block.series, block.tier, block.block_start): block for block in existing}
+
+    now = datetime.utcnow()
+    written = 0
+
+    def load_block(series, tier, block_start):
+        block = blocks.get((series, tier[0], block_start))
+        if block is None:
+            block = ServerMetricBlock(server_id=server_id, series=series, tier=tier[0],
+                                      block_start=block_start, step=tier[1],
+                                      samples=_pack(_empty_samples(tier)))
+            db.session.add(block)
+            blocks[(series, tier[0], block_start)] = block
+        return block, _unpack(block.samples)
+
+    for (series, block_start), points in incoming.items():
+        raw_block, raw_samples = load_block(series, RAW_TIER, block_start)
+        touched = set()
+        for timestamp, value in points:
+            index = (timestamp - block_start) // raw_step
+            raw_samples[index] = value
+            touched.add(index)
+            written += 1
+        raw_block.samples = _pack(raw_samples)
+        raw_block.updated_at = now
+
+        # Rollup buckets divide the raw block span, so each bucket is a mean over raw samples
+        for tier in METRIC_TIERS[1:]:
+            name, step, span, _ = tier
+            per_bucket = step // raw_step
+            buckets = {index - index % per_bucket for index in touched}
+            rollup_start = block_start - block_start % span
+            rollup_block, rollup_samples = load_block(series, tier, rollup_start)
+            for first in buckets:
+                values = [v for v in raw_samples[first:first + per_bucket] if not math.isnan(v)]
+                if values:
+                    timestamp = block_start + first * raw_step
+                    rollup_samples[(timestamp - rollup_start) // step] = sum(values) / len(values)
+            rollup_block.samples = _pack(rollup_samples)
+            rollup_block.updated_at = now
+
+    return written
+
+
+def query_metrics(server_id, metric_type, start, end, max_points=DEFAULT_MAX_POINTS):
+    """Read a server's series for metric_type (cpu, disk or network) between two datetimes
+
+    Picks the finest tier that still retains the start of the range and
+    answers with at most max_points samples per series.
+    """
+    start_ts, end_ts = _epoch(start), _epoch(end)
+    now_ts = _epoch(datetime.utcnow())
+
+    tier = METRIC_TIERS[-1]
+    for candidate in METRIC_TIERS:
+        _, step, _, retention = candidate
+        if start_ts >= now_ts - retention and (end_ts - start_ts) / step <= max_points:
+            tier = candidate
+            break
+    name, step, span, _ = tier
+
+    blocks = ServerMetricBlock.query.filter(
+        ServerMetricBlock.server_id == server_id,
+        ServerMetricBlock.tier == name,
+        or_(ServerMetricBlock.series == metric_type, ServerMetricBlock.series.like(f'{metric_type}.%')),
+        ServerMetricBlock.block_start > start_ts - span,
+        ServerMetricBlock.block_start <= end_ts
+    ).order_by(ServerMetricBlock.block_start).all()
+
+    series = {}
+    for block in blocks:
+        points = series.setdefault(block.series, [])
+        for index, value in enumerate(_unpack(block.samples)):
+            timestamp = block.block_start + index * step
+            if start_ts <= timestamp <= end_ts and not math.isnan(value):
+                points.append([timestamp, value])
+
+    # Even the coarsest tier can hold more than max_points for a long range
+    if max_points > 0 and any(len(points) > max_points for points in series.values()):
+        step *= (end_ts - start_ts) // (step * max_points) + 1
+        series = {key: _downsample(points, start_ts, step) for key, points in series.items()}
+
+    series = {key: [[timestamp, round(value, 4)] for timestamp, value in points] for key, points in series.items()}
+    return {'tier': name, 'step': step, 'series': series}
+
+
+def _downsample(points, start_ts, step):
+    """Average time-ordered points into buckets of step seconds counted from start_ts"""
+    averaged = []
+    bucket, values = None, []
+    for timestamp, value in points:
+        current = start_ts + (timestamp - start_ts) // step * step
+        if current != bucket and values:
+            averaged.append([bucket, sum(values) / len(values)])
+            values = []
+        bucket = current
+        values.append(value)
+    if values:
+        averaged.append([bucket, sum(values) / len(values)])
+    return averaged
+
+
+def _last_raw_samples(server_ids):
+    """Time of the newest stored raw sample of each server
+
+    Collection resumes from here rather than from when a block was last
+    written, so samples the API had not published yet at the previous run
+    (or that a late run skipped) are still fetched.
+    """
+    _, step, _, _ = RAW_TIER
+    newest = (
+        select(ServerMetricBlock.server_id, func.max(ServerMetricBlock.block_start).label('block_start'))
+        .where(ServerMetricBlock.server_id.in_(server_ids), ServerMetricBlock.tier == RAW_TIER[0])
+        .group_by(ServerMetricBlock.server_id)
+        .subquery()
+    )
+    blocks = ServerMetricBlock.query.join(
+        newest,
+        (ServerMetricBlock.server_id == newest.c.server_id) & (ServerMetricBlock.block_start == newest.c.block_start)
+    ).filter(ServerMetricBlock.tier == RAW_TIER[0]).all()
+
+    last_samples = {}
+    for block in blocks:
+        samples = _unpack(block.samples)
+        index = next((i for i in range(len(samples) - 1, -1, -1) if not math.isnan(samples[i])), None)
+        if index is None:
+            continue
+        timestamp = datetime(1970, 1, 1) + timedelta(seconds=block.block_start + index * step)
+        if timestamp > last_samples.get(block.server_id, datetime.min):
+            last_samples[block.server_id] = timestamp
+    return last_samples
+
+
+def _metrics_budget(api_token, interval):
+    """API calls one collection may make with a token, collections being interval seconds apart"""
+    state = get_rate_limiter(api_token).snapshot()
+    per_collection = int(state['limit'] * METRICS_API_SHARE * interval / RATE_LIMIT_WINDOW)
+    spare = state['remaining'] - int(state['limit'] * METRICS_API_RESERVE)
+    return max(0, min(per_collection, spare))
+
+
+def _collect_project_metrics(flask_app, project_id, interval):
+    """Fetch and store metrics for the project's servers that fit in its API budget
+
+    Servers without metrics come first, then those collected longest ago;
+    the rest (counted as skipped) are collected by the next runs.
+    """
+    with flask_app.app_context():
+        summary = {'servers': 0, 'samples': 0, 'errors': 0, 'skipped': 0}
+        try:
+            hetzner_service = HetznerService(project_id=project_id)
+            servers = HetznerServer.query.filter(
+                HetznerServer.project_id == project_id,
+                HetznerServer.server_source == 'hetzner',
+                HetznerServer.hetzner_id.isnot(None),
+                HetznerServer.status != 'deleted'
+            ).all()
+
+            # Resume each server from its newest stored sample instead of refetching the backfill window
+            last_samples = _last_raw_samples([server.id for server in servers])
+
+            servers.sort(key=lambda server: last_samples.get(server.id, datetime.min))
+            budget = _metrics_budget(hetzner_service.api_token, interval)
+            summary['skipped'] = max(0, len(servers) - budget)
+            servers = servers[:budget]
+
+            end = datetime.utcnow()
+            oldest = end - timedelta(seconds=RAW_TIER[3])
+            for server in servers:
+                last_sample = last_samples.get(server.id)
+                if last_sample:
+                    start = max(oldest, last_sample - timedelta(seconds=2 * RAW_TIER[1]))
+                else:
+                    start = end - timedelta(seconds=METRICS_BACKFILL)
+
+                metrics = hetzner_service.get_server_metrics(server.hetzner_id, start=start, end=end, step=RAW_TIER[1])
+                if metrics is None:
+                    summary['errors'] += 1
+                    continue
+                summary['samples'] += store_metrics(server.id, metrics['time_series'])
+                summary['servers'] += 1
+
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"Error collecting metrics for project {project_id}: {str(e)}")
+            db.session.rollback()
+            summary['error'] = str(e)
+        return summary
+
+
+def collect_metrics(project_ids, max_workers=None, interval=None):
+    """Collect metrics for several projects concurrently, one API call per server
+
+    interval is the time in seconds until the next collection (default
+    METRICS_COLLECT_INTERVAL); it sizes each project's API budget.
+    """
+    flask_app = current_app._get_current_object()
+    max_workers = max_workers or flask_app.config.get('SYNC_MAX_WORKERS', 4)
+    interval = interval or flask_app.config.get('METRICS_COLLECT_INTERVAL') or 300
+    results = {}
+
+    if not project_ids:
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(project_ids)), thread_name_prefix='hetzner-metrics') as executor:
+        futures = {executor.submit(_collect_project_metrics, flask_app, project_id, interval): project_id for project_id in project_ids}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    return results
+
+
+def prune_metrics(now=None):
+    """Drop blocks that ended before their tier's retention window"""
+    now_ts = _epoch(now or datetime.utcnow())
+    deleted = 0
+    for name, _, span, retention in METRIC_TIERS:
+        result = db.session.execute(
+            delete(ServerMetricBlock)
+            .where(ServerMetricBlock.tier == name, ServerMetricBlock.block_start + span < now_ts - retention)
+        )
+        deleted += result.rowcount
+    db.session.commit()
+    return deleted
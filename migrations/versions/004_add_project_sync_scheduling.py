@@ -0,0 +1,45 @@
+"""Add background sync scheduling fields to HetznerProject
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+SYNC_COLUMNS = [
+    sa.Column('sync_interval_minutes', sa.Integer(), nullable=True, server_default='15'),
+    sa.Column('sync_requested_at', sa.DateTime(), nullable=True),
+    sa.Column('last_sync_attempt_at', sa.DateTime(), nullable=True),
+    sa.Column('last_synced_at', sa.DateTime(), nullable=True),
+    sa.Column('last_sync_status', sa.String(length=20), nullable=True),
+    sa.Column('last_sync_error', sa.Text(), nullable=True),
+]
+
+
+def upgrade():
+    """Add sync interval, request and watermark columns to hetzner_projects"""
+    for column in SYNC_COLUMNS:
+        try:
+            op.add_column('hetzner_projects', column)
+        except Exception:
+            # Column might already exist
+            pass
+
+
+def downgrade():
+    """Remove the sync scheduling columns"""
+    for column in reversed(SYNC_COLUMNS):
+        try:
+            op.drop_column('hetzner_projects', column.name)
+        except Exception:
+            pass
@@ -0,0 +1,43 @@
+"""Add hetzner_catalog_cache table
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Create the shared Hetzner catalog cache table"""
+    try:
+        op.create_table(
+            'hetzner_catalog_cache',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('token_hash', sa.String(length=64), nullable=False),
+            sa.Column('catalog', sa.String(length=20), nullable=False),
+            sa.Column('payload', sa.Text(), nullable=False),
+            sa.Column('fetched_at', sa.DateTime(), nullable=False),
+            sa.Column('refreshing_since', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('token_hash', 'catalog', name='unique_token_catalog')
+        )
+    except Exception:
+        # Table might already exist (created by db.create_all)
+        pass
+
+
+def downgrade():
+    """Drop the catalog cache table"""
+    try:
+        op.drop_table('hetzner_catalog_cache')
+    except Exception:
+        pass
@@ -0,0 +1,44 @@
+"""Add Hetzner server/action ids to ServerRequest for asynchronous provisioning
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Add hetzner_server_id and hetzner_action_id columns to server_request"""
+    try:
+        op.add_column('server_request', sa.Column('hetzner_server_id', sa.BigInteger(), nullable=True))
+    except Exception:
+        # Column might already exist
+        pass
+    
+    try:
+        op.add_column('server_request', sa.Column('hetzner_action_id', sa.BigInteger(), nullable=True))
+    except Exception:
+        # Column might already exist
+        pass
+
+
+def downgrade():
+    """Remove the action tracking columns"""
+    try:
+        op.drop_column('server_request', 'hetzner_action_id')
+    except Exception:
+        pass
+    
+    try:
+        op.drop_column('server_request', 'hetzner_server_id')
+    except Exception:
+        pass
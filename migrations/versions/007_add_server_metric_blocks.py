@@ -0,0 +1,46 @@
+"""Add server_metric_block table for the fleet metrics store
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Create the server metric block table"""
+    try:
+        op.create_table(
+            'server_metric_block',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('server_id', sa.Integer(), nullable=False),
+            sa.Column('series', sa.String(length=64), nullable=False),
+            sa.Column('tier', sa.String(length=8), nullable=False),
+            sa.Column('block_start', sa.BigInteger(), nullable=False),
+            sa.Column('step', sa.Integer(), nullable=False),
+            sa.Column('samples', sa.LargeBinary(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['server_id'], ['hetzner_server.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('server_id', 'series', 'tier', 'block_start', name='unique_server_metric_block')
+        )
+    except Exception:
+        # Table might already exist (created by db.create_all)
+        pass
+
+
+def downgrade():
+    """Drop the server metric block table"""
+    try:
+        op.drop_table('server_metric_block')
+    except Exception:
+        pass
@@ -0,0 +1,33 @@
+"""Add remote_path to DatabaseBackup for server-to-server restores
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Add remote_path column to database_backup"""
+    try:
+        op.add_column('database_backup', sa.Column('remote_path', sa.String(length=255), nullable=True))
+    except Exception:
+        # Column might already exist
+        pass
+
+
+def downgrade():
+    """Remove remote_path column from database_backup"""
+    try:
+        op.drop_column('database_backup', 'remote_path')
+    except Exception:
+        pass
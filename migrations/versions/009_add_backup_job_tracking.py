@@ -0,0 +1,54 @@
+"""Add background job tracking columns to DatabaseBackup
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    ('phase', sa.String(length=20)),
+    ('progress', sa.Integer()),
+    ('bytes_transferred', sa.BigInteger()),
+    ('checksum', sa.String(length=64)),
+    ('worker_id', sa.String(length=100)),
+    ('heartbeat_at', sa.DateTime()),
+]
+
+
+def upgrade():
+    """Add phase, progress and worker heartbeat columns to database_backup"""
+    for name, column_type in COLUMNS:
+        try:
+            op.add_column('database_backup', sa.Column(name, column_type, nullable=True))
+        except Exception:
+            # Column might already exist
+            pass
+    
+    try:
+        op.create_index('ix_database_backup_status', 'database_backup', ['status'])
+    except Exception:
+        pass
+
+
+def downgrade():
+    """Remove the job tracking columns"""
+    try:
+        op.drop_index('ix_database_backup_status', table_name='database_backup')
+    except Exception:
+        pass
+    
+    for name, _ in reversed(COLUMNS):
+        try:
+            op.drop_column('database_backup', name)
+        except Exception:
+            pass
@@ -0,0 +1,70 @@
+"""Add backup catalog tables for the backups page
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Create the backup catalog entry and directory tables"""
+    try:
+        op.create_table(
+            'backup_catalog_entry',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('path', sa.String(length=512), nullable=False),
+            sa.Column('kind', sa.String(length=10), nullable=False),
+            sa.Column('server_name', sa.String(length=255), nullable=True),
+            sa.Column('server_id', sa.Integer(), nullable=True),
+            sa.Column('backup_id', sa.Integer(), nullable=True),
+            sa.Column('filename', sa.String(length=255), nullable=False),
+            sa.Column('database_name', sa.String(length=100), nullable=True),
+            sa.Column('size', sa.BigInteger(), nullable=False),
+            sa.Column('mtime', sa.DateTime(), nullable=False),
+            sa.Column('checksum', sa.String(length=64), nullable=True),
+            sa.ForeignKeyConstraint(['server_id'], ['hetzner_server.id'], ondelete='SET NULL'),
+            sa.ForeignKeyConstraint(['backup_id'], ['database_backup.id'], ondelete='SET NULL'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('path')
+        )
+        op.create_index('ix_backup_catalog_kind_mtime', 'backup_catalog_entry', ['kind', 'mtime'])
+        op.create_index('ix_backup_catalog_server_mtime', 'backup_catalog_entry', ['server_name', 'mtime'])
+    except Exception:
+        # Table might already exist (created by db.create_all)
+        pass
+    
+    try:
+        op.create_table(
+            'backup_catalog_directory',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('path', sa.String(length=512), nullable=False),
+            sa.Column('mtime_ns', sa.BigInteger(), nullable=False),
+            sa.Column('scanned_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('path')
+        )
+    except Exception:
+        pass
+
+
+def downgrade():
+    """Drop the backup catalog tables"""
+    try:
+        op.drop_table('backup_catalog_directory')
+    except Exception:
+        pass
+    
+    try:
+        op.drop_table('backup_catalog_entry')
+    except Exception:
+        pass
@@ -0,0 +1,59 @@
+"""Add backup manifests for the deduplicating chunk store
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Create the backup manifest table and mark deduplicated catalog entries"""
+    try:
+        op.create_table(
+            'backup_manifest',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('backup_id', sa.Integer(), nullable=False),
+            sa.Column('size', sa.BigInteger(), nullable=False),
+            sa.Column('checksum', sa.String(length=64), nullable=False),
+            sa.Column('mtime', sa.DateTime(), nullable=False),
+            sa.Column('chunk_count', sa.Integer(), nullable=False),
+            sa.Column('stored_bytes', sa.BigInteger(), nullable=False),
+            sa.Column('chunks', sa.LargeBinary(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['backup_id'], ['database_backup.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('backup_id')
+        )
+    except Exception:
+        # Table might already exist (created by db.create_all)
+        pass
+    
+    try:
+        op.add_column('backup_catalog_entry', sa.Column('deduplicated', sa.Boolean(), nullable=False,
+                                                        server_default=sa.false()))
+    except Exception:
+        # Column might already exist
+        pass
+
+
+def downgrade():
+    """Drop the backup manifest table and the deduplicated flag"""
+    try:
+        op.drop_column('backup_catalog_entry', 'deduplicated')
+    except Exception:
+        pass
+    
+    try:
+        op.drop_table('backup_manifest')
+    except Exception:
+        pass
@@ -0,0 +1,71 @@
+"""Add upload sessions for chunked, resumable backup uploads
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '012'
+down_revision = '011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Create the upload session and chunk tables"""
+    try:
+        op.create_table(
+            'upload_session',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('upload_id', sa.String(length=36), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('target_server_id', sa.Integer(), nullable=False),
+            sa.Column('filename', sa.String(length=255), nullable=False),
+            sa.Column('size', sa.BigInteger(), nullable=False),
+            sa.Column('chunk_size', sa.Integer(), nullable=False),
+            sa.Column('keep_copy', sa.Boolean(), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['target_server_id'], ['hetzner_server.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('upload_id')
+        )
+    except Exception:
+        # Table might already exist (created by db.create_all)
+        pass
+    
+    try:
+        op.create_table(
+            'upload_chunk',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('session_id', sa.Integer(), nullable=False),
+            sa.Column('byte_offset', sa.BigInteger(), nullable=False),
+            sa.Column('size', sa.Integer(), nullable=False),
+            sa.Column('checksum', sa.String(length=64), nullable=False),
+            sa.Column('received_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['session_id'], ['upload_session.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('session_id', 'byte_offset', name='unique_upload_chunk')
+        )
+    except Exception:
+        pass
+
+
+def downgrade():
+    """Drop the chunked upload tables"""
+    try:
+        op.drop_table('upload_chunk')
+    except Exception:
+        pass
+    
+    try:
+        op.drop_table('upload_session')
+    except Exception:
+        pass
@@ -0,0 +1,43 @@
+"""Run chunked upload restores as background jobs
+
+Revision ID: 013
+Revises: 012
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '013'
+down_revision = '012'
+branch_labels = None
+depends_on = None
+
+
+RESTORE_COLUMNS = [
+    sa.Column('worker_id', sa.String(length=100), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+    sa.Column('message', sa.Text(), nullable=True),
+    sa.Column('backup_id', sa.Integer(), sa.ForeignKey('database_backup.id', ondelete='SET NULL'), nullable=True),
+]
+
+
+def upgrade():
+    """Add restore job columns to upload_session"""
+    for column in RESTORE_COLUMNS:
+        try:
+            op.add_column('upload_session', column)
+        except Exception:
+            # Column might already exist
+            pass
+
+
+def downgrade():
+    """Remove the restore job columns"""
+    for column in reversed(RESTORE_COLUMNS):
+        try:
+            op.drop_column('upload_session', column.name)
+        except Exception:
+            pass
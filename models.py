@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from app import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -234,6 +234,8 @@ class ServerRequest(db.Model):
     # Deployment details (populated after approval)
     server_ip = db.Column(db.String(15))
     deployment_progress = db.Column(db.Integer, default=0)  # 0-100
+    hetzner_server_id = db.Column(db.BigInteger)  # Hetzner server created for this request
+    hetzner_action_id = db.Column(db.BigInteger)  # In-flight create_server action, cleared once handled
     
     # Relationships
     reviewer = db.relationship('User', foreign_keys=[reviewed_by])
@@ -496,13 +498,22 @@ class DatabaseBackup(db.Model):
     # Backup metadata
     backup_size = db.Column(db.BigInteger)  # Size in bytes
     backup_path = db.Column(db.String(255))  # Storage location
+    remote_path = db.Column(db.String(255))  # Backup file on the source server, for server-to-server restores
     compression_used = db.Column(db.Boolean, default=True)
     encryption_used = db.Column(db.Boolean, default=True)
     
     # Execution details
     started_at = db.Column(db.DateTime, nullable=False)
     completed_at = db.Column(db.DateTime)
-    status = db.Column(db.String(20), default='running')  # running, completed, failed, cancelled
+    status = db.Column(db.String(20), default='running', index=True)  # queued, running, completed, failed, cancelled
+    
+    # Background job progress (see backup_jobs.py)
+    phase = db.Column(db.String(20))  # queued, dump, locate, transfer, verify, done
+    progress = db.Column(db.Integer, default=0)  # Percent
+    bytes_transferred = db.Column(db.BigInteger, default=0)
+    checksum = db.Column(db.String(64))  # SHA-256 of the downloaded file
+    worker_id = db.Column(db.String(100))  # Backup worker running the job
+    heartbeat_at = db.Column(db.DateTime)  # Last sign of life from that worker
     
     # User tracking
     initiated_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -533,6 +544,7 @@ class DatabaseBackup(db.Model):
     
     def get_status_badge_class(self):
         status_classes = {
+            'queued': 'bg-secondary',
             'running': 'bg-info',
             'completed': 'bg-success',
             'failed': 'bg-danger',
@@ -646,6 +658,14 @@ class HetznerProject(db.Model):
     ssh_connection_tested = db.Column(db.Boolean, default=False)
     ssh_last_test = db.Column(db.DateTime)
     
+    # Background sync scheduling (see sync_worker.py)
+    sync_interval_minutes = db.Column(db.Integer, default=15)
+    sync_requested_at = db.Column(db.DateTime)  # Set by the sync routes to queue a sync
+    last_sync_attempt_at = db.Column(db.DateTime)
+    last_synced_at = db.Column(db.DateTime)  # Watermark: start of the last successful sync
+    last_sync_status = db.Column(db.String(20))  # success, failed
+    last_sync_error = db.Column(db.Text)
+    
     # Relationships
     creator = db.relationship('User', foreign_keys=[created_by])
     servers = db.relationship('HetznerServer', backref='project', lazy=True)
@@ -686,9 +706,193 @@ class HetznerProject(db.Model):
     def can_add_server(self):
         return self.server_count < self.max_servers
     
+    @property
+    def sync_pending(self):
+        """True if a sync was requested and no attempt has started since"""
+        if not self.sync_requested_at:
+            return False
+        return not self.last_sync_attempt_at or self.sync_requested_at > self.last_sync_attempt_at
+    
+    def is_sync_due(self, now=None):
+        """Check if the background worker should sync this project now"""
+        if not self.is_active:
+            return False
+        if self.sync_pending or not self.last_sync_attempt_at:
+            return True
+        now = now or datetime.utcnow()
+        interval = timedelta(minutes=self.sync_interval_minutes or 15)
+        return now - self.last_sync_attempt_at >= interval
+    
+    def request_sync(self):
+        """Queue a sync for the background worker"""
+        self.sync_requested_at = datetime.utcnow()
+    
+    def record_sync_result(self, result, started_at):
+        """Record the outcome of a sync and advance the freshness watermark on success"""
+        self.last_sync_attempt_at = started_at
+        if result.get('success'):
+            self.last_synced_at = started_at
+            self.last_sync_status = 'success'
+            self.last_sync_error = None
+        else:
+            self.last_sync_status = 'failed'
+            self.last_sync_error = result.get('error')
+    
+    def sync_freshness(self):
+        """Summary of the last sync for JSON responses"""
+        return {
+            'project_id': self.id,
+            'project_name': self.name,
+            'last_synced_at': self.last_synced_at.strftime('%Y-%m-%d %H:%M:%S') if self.last_synced_at else None,
+            'age_seconds': int((datetime.utcnow() - self.last_synced_at).total_seconds()) if self.last_synced_at else None,
+            'last_sync_status': self.last_sync_status,
+            'last_sync_error': self.last_sync_error,
+            'sync_pending': self.sync_pending
+        }
+    
     def __repr__(self):
         return f'<HetznerProject {self.name}>'
 
+class HetznerCatalogCache(db.Model):
+    """Cached Hetzner catalog listings (images, server types, locations) shared by all workers"""
+    __tablename__ = 'hetzner_catalog_cache'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    token_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the API token
+    catalog = db.Column(db.String(20), nullable=False)  # images, server_types, locations
+    payload = db.Column(db.Text, nullable=False)  # JSON list as returned by HetznerService
+    fetched_at = db.Column(db.DateTime, nullable=False)
+    refreshing_since = db.Column(db.DateTime)  # Set while a worker revalidates a stale entry
+    
+    __table_args__ = (db.UniqueConstraint('token_hash', 'catalog', name='unique_token_catalog'),)
+    
+    def __repr__(self):
+        return f'<HetznerCatalogCache {self.catalog} {self.token_hash[:8]}>'
+
+class ServerMetricBlock(db.Model):
+    """One block of a server metric series at one resolution tier
+    
+    Samples are stored as a packed float32 array at fixed steps from
+    block_start (NaN marks a missing sample), so timestamps are implicit.
+    """
+    __tablename__ = 'server_metric_block'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    server_id = db.Column(db.Integer, db.ForeignKey('hetzner_server.id', ondelete='CASCADE'), nullable=False)
+    series = db.Column(db.String(64), nullable=False)  # cpu, disk.0.iops.read, network.0.bandwidth.in, ...
+    tier = db.Column(db.String(8), nullable=False)  # raw, 5m, 1h
+    block_start = db.Column(db.BigInteger, nullable=False)  # Unix timestamp aligned to the tier's block span
+    step = db.Column(db.Integer, nullable=False)  # Seconds between samples
+    samples = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (db.UniqueConstraint('server_id', 'series', 'tier', 'block_start', name='unique_server_metric_block'),)
+    
+    def __repr__(self):
+        return f'<ServerMetricBlock {self.server_id} {self.series} {self.tier} {self.block_start}>'
+
+class BackupCatalogEntry(db.Model):
+    """One backup file under static/backups, indexed so the backups page needs no filesystem walk"""
+    __tablename__ = 'backup_catalog_entry'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(512), nullable=False, unique=True)  # Relative to static/backups
+    kind = db.Column(db.String(10), nullable=False)  # system, server
+    server_name = db.Column(db.String(255))  # Backup directory of the server; None for system backups
+    server_id = db.Column(db.Integer, db.ForeignKey('hetzner_server.id', ondelete='SET NULL'))
+    backup_id = db.Column(db.Integer, db.ForeignKey('database_backup.id', ondelete='SET NULL'))
+    filename = db.Column(db.String(255), nullable=False)
+    database_name = db.Column(db.String(100))
+    size = db.Column(db.BigInteger, nullable=False)
+    mtime = db.Column(db.DateTime, nullable=False)
+    checksum = db.Column(db.String(64))  # SHA-256, when known from the backup job
+    deduplicated = db.Column(db.Boolean, default=False, nullable=False)  # Kept in the chunk store, not as a file
+    
+    __table_args__ = (
+        db.Index('ix_backup_catalog_kind_mtime', 'kind', 'mtime'),
+        db.Index('ix_backup_catalog_server_mtime', 'server_name', 'mtime'),
+    )
+    
+    def __repr__(self):
+        return f'<BackupCatalogEntry {self.path}>'
+
+class BackupCatalogDirectory(db.Model):
+    """Modification time of a scanned backup directory, so unchanged directories are not listed again"""
+    __tablename__ = 'backup_catalog_directory'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(512), nullable=False, unique=True)  # Relative to static/backups, '' for the root
+    mtime_ns = db.Column(db.BigInteger, nullable=False)
+    scanned_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<BackupCatalogDirectory {self.path!r}>'
+
+class BackupManifest(db.Model):
+    """Chunks of a DatabaseBackup kept in the deduplicating chunk store (see chunk_store.py)
+    
+    chunks packs one 36-byte entry per chunk in file order: the chunk's
+    SHA-256 followed by its length as a big-endian uint32.
+    """
+    __tablename__ = 'backup_manifest'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    backup_id = db.Column(db.Integer, db.ForeignKey('database_backup.id', ondelete='CASCADE'), nullable=False, unique=True)
+    size = db.Column(db.BigInteger, nullable=False)  # Bytes of the original file
+    checksum = db.Column(db.String(64), nullable=False)  # SHA-256 of the original file
+    mtime = db.Column(db.DateTime, nullable=False)  # Modification time of the original file
+    chunk_count = db.Column(db.Integer, nullable=False)
+    stored_bytes = db.Column(db.BigInteger, nullable=False)  # Bytes on disk of the chunks this backup added
+    chunks = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<BackupManifest {self.backup_id} {self.chunk_count} chunks>'
+
+class UploadSession(db.Model):
+    """A chunked, resumable browser upload of a backup file to restore (see chunked_upload.py)"""
+    __tablename__ = 'upload_session'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.String(36), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    target_server_id = db.Column(db.Integer, db.ForeignKey('hetzner_server.id', ondelete='CASCADE'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    keep_copy = db.Column(db.Boolean, default=True, nullable=False)  # Keep the file in uploads/backups after the restore
+    status = db.Column(db.String(20), default='uploading', nullable=False)  # uploading, queued, restoring, completed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # Last chunk received or status change
+    
+    # Restore job, run by backup_worker.py once the upload is finalized
+    worker_id = db.Column(db.String(100))  # Backup worker running the restore
+    heartbeat_at = db.Column(db.DateTime)  # Last sign of life from that worker
+    message = db.Column(db.Text)  # Outcome of the last restore attempt
+    backup_id = db.Column(db.Integer, db.ForeignKey('database_backup.id', ondelete='SET NULL'))  # Record of the restored upload
+    
+    user = db.relationship('User')
+    target_server = db.relationship('HetznerServer')
+    
+    def __repr__(self):
+        return f'<UploadSession {self.upload_id} {self.filename}>'
+
+class UploadChunk(db.Model):
+    """One received chunk of an UploadSession"""
+    __tablename__ = 'upload_chunk'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('upload_session.id', ondelete='CASCADE'), nullable=False)
+    byte_offset = db.Column(db.BigInteger, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    checksum = db.Column(db.String(64), nullable=False)  # SHA-256 of the chunk
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (db.UniqueConstraint('session_id', 'byte_offset', name='unique_upload_chunk'),)
+    
+    def __repr__(self):
+        return f'<UploadChunk {self.session_id} @{self.byte_offset}>'
+
 class UserProjectAccess(db.Model):
     """Manages user access to specific projects"""
     __tablename__ = 'user_project_access'
@@ -1,20 +1,33 @@
 import random
 import time
 import os
+import json
 import subprocess
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
-from flask import render_template, redirect, url_for, flash, request, jsonify, make_response, send_from_directory, abort
+from flask import render_template, redirect, url_for, flash, request, jsonify, make_response, send_from_directory, abort, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
+from flask_wtf.csrf import validate_csrf
+from wtforms.validators import ValidationError
 from urllib.parse import urlparse
+from sqlalchemy.orm import joinedload, load_only
 from app import app, db, csrf
-from models import User, UserRole, ServerRequest, Notification, HetznerServer, DeploymentScript, DeploymentExecution, ClientSubscription, DatabaseBackup, SystemUpdate, HetznerProject, UserProjectAccess, UserServerAccess
+from models import User, UserRole, ServerRequest, Notification, HetznerServer, DeploymentScript, DeploymentExecution, ClientSubscription, DatabaseBackup, SystemUpdate, HetznerProject, UserProjectAccess, UserServerAccess, BackupCatalogEntry, BackupManifest, UploadSession
 from forms import LoginForm, RegistrationForm, ServerRequestForm, EditProfileForm, AdminReviewForm, DeploymentScriptForm, ExecuteDeploymentForm, ServerManagementForm, SelfHostedServerForm, EditServerForm
-from hetzner_service import HetznerService
-from godaddy_service import GoDaddyService
+from hetzner_service import HetznerService, sync_projects, invalidate_catalog_cache, power_action_servers, METRIC_TYPES, MANAGED_LABEL_SELECTOR
+from hetzner_client import rate_limit_stats
+from action_tracker import track_server_actions, track_in_background, fail_server_provisioning, PROGRESS_SUBMITTED
+from metrics_store import query_metrics, DEFAULT_MAX_POINTS
 from ansible_service import AnsibleService
-from ssh_service import SSHService, get_default_deploy_script, get_default_backup_script
+from ssh_service import SSHService, get_default_deploy_script, get_default_backup_script, summarize_fan_out, FANOUT_MAX_WORKERS, FANOUT_TIMEOUT, FANOUT_DEADLINE
+from command_log import CommandLog, read_log_tail
+from backup_jobs import queue_backup
+from backup_catalog import reconcile_catalog, query_catalog
+from chunk_store import ManifestReader, iter_manifest
+from upload_stream import MultipartUpload, UploadRejected, BACKUP_UPLOAD_MAX_SIZE
+from chunked_upload import create_upload, write_chunk, upload_status, queue_restore, discard_upload
+from upload_restore import uploaded_backup_path, restore_uploaded_backup, record_uploaded_backup
 
 def convert_to_cairo_timezone(utc_datetime):
     """Convert UTC datetime to Cairo timezone"""
@@ -38,7 +51,8 @@ def convert_to_cairo_timezone(utc_datetime):
 
 def provision_server_and_dns(server_request: ServerRequest):
     """
-    Provision a Hetzner server and configure DNS record automatically
+    Submit a Hetzner server for a request; DNS is configured by
+    action_tracker once the server's create action has finished
     """
     try:
         app.logger.info(f"Starting server provisioning for request: {server_request.request_id}")
@@ -72,12 +86,8 @@ def provision_server_and_dns(server_request: ServerRequest):
             'subdomain': sanitize_label_value(server_request.subdomain)
         }
         
-        # Update progress
-        server_request.deployment_progress = 20
-        db.session.commit()
-        
-        # Create server in Hetzner Cloud
-        creation_result = hetzner_service.create_server(
+        # Submit the server to Hetzner Cloud; the boot is followed by action_tracker
+        creation_result = hetzner_service.submit_server_creation(
             name=server_request.server_name,
             server_type=server_request.server_type,
             image=server_request.operating_system,
@@ -91,84 +101,33 @@ def provision_server_and_dns(server_request: ServerRequest):
             db.session.commit()
             return creation_result
         
-        # Update progress and get IP address
-        server_ip = creation_result['ip_address']
-        server_request.server_ip = server_ip
-        server_request.deployment_progress = 60
+        # Record the action to track and the IP Hetzner already assigned
+        server_request.hetzner_server_id = creation_result['hetzner_id']
+        server_request.hetzner_action_id = creation_result['action_id']
+        server_request.server_ip = creation_result['ip_address']
+        server_request.deployment_progress = PROGRESS_SUBMITTED
         db.session.commit()
         
-        app.logger.info(f"Server created successfully with IP: {server_ip}")
-        
-        # Configure DNS if base domain exists
-        if server_request.project.base_domain and server_request.subdomain:
-            app.logger.info(f"Configuring DNS for {server_request.subdomain}.{server_request.project.base_domain}")
-            
-            godaddy_service = GoDaddyService()
-            dns_result = godaddy_service.add_dns_record(
-                domain=server_request.project.base_domain,
-                subdomain=server_request.subdomain,
-                ip_address=server_ip
-            )
-            
-            # Update progress
-            server_request.deployment_progress = 80
-            db.session.commit()
-            
-            if dns_result['success']:
-                app.logger.info(f"DNS record created successfully: {server_request.subdomain}.{server_request.project.base_domain} -> {server_ip}")
-                dns_message = f"DNS configured: {server_request.subdomain}.{server_request.project.base_domain}"
-            else:
-                app.logger.warning(f"DNS configuration failed: {dns_result['error']}")
-                dns_message = f"DNS configuration failed: {dns_result['error']}"
-        else:
-            dns_message = "DNS configuration skipped (no base domain configured)"
-            app.logger.info(dns_message)
-        
-        # Mark as successfully deployed
-        server_request.status = 'deployed'
-        server_request.deployment_progress = 100
-        server_request.deployed_at = datetime.utcnow()
-        server_request.deployment_notes = f"Server provisioned successfully. IP: {server_ip}. {dns_message}"
+        app.logger.info(f"Server creation submitted for request {server_request.request_id}: action {creation_result['action_id']}")
         
-        # Create success notification
-        notification = Notification()
-        notification.user_id = server_request.user_id
-        notification.title = 'Server Deployed Successfully'
-        notification.message = f'Your server "{server_request.server_name}" has been deployed at {server_ip}'
-        if server_request.project.base_domain:
-            notification.message += f' and is accessible at {server_request.subdomain}.{server_request.project.base_domain}'
-        notification.type = 'success'
-        notification.request_id = server_request.id
-        db.session.add(notification)
-        
-        db.session.commit()
-        
-        app.logger.info(f"Server provisioning completed successfully for request: {server_request.request_id}")
+        # Without sync_worker.py nothing else moves the request past 'deploying'
+        if not app.config['BACKGROUND_SYNC']:
+            track_in_background(server_request.project_id)
         
         return {
             'success': True,
-            'server_ip': server_ip,
+            'server_ip': creation_result['ip_address'],
+            'action_id': creation_result['action_id'],
             'full_domain': f"{server_request.subdomain}.{server_request.project.base_domain}" if server_request.project.base_domain else None,
-            'message': 'Server provisioned and DNS configured successfully'
+            'message': 'Server creation submitted, DNS will be configured once it is running'
         }
         
     except Exception as e:
         app.logger.error(f"Error in server provisioning: {e}")
+        db.session.rollback()
         
         # Mark as failed
-        server_request.status = 'failed'
-        server_request.deployment_notes = f"Provisioning failed: {str(e)}"
-        
-        # Create failure notification
-        notification = Notification()
-        notification.user_id = server_request.user_id
-        notification.title = 'Server Deployment Failed'
-        notification.message = f'Server deployment for "{server_request.server_name}" failed: {str(e)}'
-        notification.type = 'error'
-        notification.request_id = server_request.id
-        db.session.add(notification)
-        
-        db.session.commit()
+        fail_server_provisioning(server_request, f"Provisioning failed: {str(e)}")
         
         return {
             'success': False,
@@ -261,76 +220,55 @@ def list_all_backups():
         flash('Access denied. Admin or Technical privileges required.', 'danger')
         return redirect(url_for('index'))
     
-    # Get existing backup files from filesystem
-    system_backups = []
-    server_backups = []
+    # Pick up files added or removed since the last visit; unchanged directories cost one stat each
+    reconcile_catalog()
     
-    # Check for system backup files (admin only)
+    system_page = None
     if current_user.is_admin:
-        system_backup_dir = Path("static/backups")
-        if system_backup_dir.exists():
-            for backup_file in system_backup_dir.glob("*.sql"):
-                if backup_file.is_file():
-                    stat = backup_file.stat()
-                    system_backups.append({
-                        'id': None,  # Use filename instead
-                        'filename': backup_file.name,
-                        'server_name': 'System Database',
-                        'database_name': 'dynamic_servers',
-                        'backup_type': 'system',
-                        'size': stat.st_size,
-                        'status': 'completed',
-                        'created': datetime.fromtimestamp(stat.st_mtime),
-                        'initiated_by': 'System',
-                        'download_url': url_for('download_backup_file', filename=backup_file.name),
-                        'file_exists': True
-                    })
-    
-    # Check for server backup files organized by server name
-    server_backup_root = Path("static/backups/servers")
+        system_page = query_catalog('system', page=request.args.get('system_page', 1, type=int))
     
     # Get list of accessible servers for permission filtering
+    accessible_server_names = None
     if not current_user.is_admin:
-        accessible_servers = current_user.get_accessible_servers()
-        accessible_server_names = [s.name for s in accessible_servers]
-    
-    if server_backup_root.exists():
-        # Go through each server directory
-        for server_dir in server_backup_root.iterdir():
-            if server_dir.is_dir():
-                server_name = server_dir.name
-                
-                # Skip servers that user doesn't have access to
-                if not current_user.is_admin and server_name not in accessible_server_names:
-                    continue
-                # Find backup files in this server's directory (.bak files)
-                for backup_file in server_dir.glob("*.bak"):
-                    if backup_file.is_file():
-                        stat = backup_file.stat()
-                        # Parse database name from filename (e.g., ehaf_backup_2025-08-31_15-28.bak)
-                        filename_parts = backup_file.name.split('_')
-                        database_name = filename_parts[0] if filename_parts else 'main'
-                        server_backups.append({
-                            'id': None,  # Use server/filename path instead
-                            'filename': backup_file.name,
-                            'server_name': server_name,
-                            'database_name': database_name,
-                            'backup_type': 'server',
-                            'size': stat.st_size,
-                            'status': 'completed',
-                            'created': datetime.fromtimestamp(stat.st_mtime),
-                            'initiated_by': 'System',
-                            'download_url': url_for('download_server_backup_file', server_name=server_name, filename=backup_file.name),
-                            'file_exists': True
-                        })
-    
-    # Sort backups by creation date (newest first)
-    system_backups.sort(key=lambda x: x['created'], reverse=True)
-    server_backups.sort(key=lambda x: x['created'], reverse=True)
+        accessible_server_names = [s.name for s in current_user.get_accessible_servers()]
+    server_page = query_catalog('server', server_names=accessible_server_names,
+                                page=request.args.get('page', 1, type=int))
+    
+    system_backups = [{
+        'id': entry.backup_id,
+        'filename': entry.filename,
+        'server_name': 'System Database',
+        'database_name': 'dynamic_servers',
+        'backup_type': 'system',
+        'size': entry.size,
+        'status': 'completed',
+        'created': entry.mtime,
+        'initiated_by': 'System',
+        'checksum': entry.checksum,
+        'download_url': url_for('download_backup_file', filename=entry.filename),
+        'file_exists': True
+    } for entry in (system_page.items if system_page else [])]
+    
+    server_backups = [{
+        'id': entry.backup_id,
+        'filename': entry.filename,
+        'server_name': entry.server_name,
+        'database_name': entry.database_name,
+        'backup_type': 'server',
+        'size': entry.size,
+        'status': 'completed',
+        'created': entry.mtime,
+        'initiated_by': 'System',
+        'checksum': entry.checksum,
+        'download_url': url_for('download_server_backup_file', server_name=entry.server_name, filename=entry.filename),
+        'file_exists': True
+    } for entry in server_page.items]
     
     return render_template('admin/backup_management.html', 
                          system_backups=system_backups, 
-                         server_backups=server_backups)
+                         server_backups=server_backups,
+                         system_page=system_page,
+                         server_page=server_page)
 
 @app.route('/download/backup/<filename>')
 @login_required
@@ -410,10 +348,22 @@ def restore_backup(backup_id):
     if not current_user.has_server_access(target_server_id, 'write'):
         return jsonify({'success': False, 'message': 'Access denied. You do not have access to this server.'}), 403
     
+    # Relay streams the backup from its source server straight to the target instead of uploading
+    # the local copy; it is also used when there is no local copy. A backup moved into the chunk
+    # store is rebuilt while it is uploaded.
+    has_local_copy = bool(backup.backup_path) and Path(backup.backup_path).exists()
+    manifest = None if has_local_copy else BackupManifest.query.filter_by(backup_id=backup.id).first()
+    use_relay = bool(request.json.get('relay')) or not (has_local_copy or manifest)
+    
     try:
         # Check if backup file exists
-        if not backup.backup_path or not Path(backup.backup_path).exists():
+        if use_relay and not backup.remote_path:
             return jsonify({'success': False, 'message': 'Backup file not found'}), 404
+        if use_relay and not current_user.has_server_access(backup.server_id):
+            return jsonify({'success': False, 'message': 'Access denied. You do not have access to the server this backup was taken on.'}), 403
+        # The source directory rotates and restores write into it, so the file there must still be this backup
+        if use_relay and not backup.checksum:
+            return jsonify({'success': False, 'message': 'This backup has no recorded checksum, so the file on its source server cannot be verified for relay'}), 409
         
         # Initialize SSH service
         ssh_service = SSHService()
@@ -434,7 +384,7 @@ def restore_backup(backup_id):
             app.logger.info(f"Initiating test server restoration for backup {backup_id} to {target_server.name}")
             
             # Step 1: Upload backup file to test server and replace nova_hr.bak
-            backup_file_path = Path(backup.backup_path)
+            backup_file_path = Path(backup.backup_path) if has_local_copy else None
             temp_backup_path = f"/tmp/nova_hr_restore_{backup_id}.bak"
             # Overwrite the standard nova_hr.bak file that the restore script expects
             final_backup_path = "/home/dynamic/nova-hr-docker/mssql/backup/nova_hr.bak"
@@ -445,12 +395,24 @@ def restore_backup(backup_id):
                     if not client:
                         return jsonify({'success': False, 'message': 'Failed to establish SSH connection to test server'}), 500
                     
-                    sftp = client.open_sftp()
-                    
-                    # Upload to temporary location where we have write permissions
-                    app.logger.info(f"Uploading {backup_file_path} to temporary location {temp_backup_path}")
-                    sftp.put(str(backup_file_path), temp_backup_path)
-                    sftp.close()
+                    if use_relay:
+                        # Stream from the source server without staging the file here
+                        app.logger.info(f"Relaying {backup.server.name}:{backup.remote_path} to temporary location {temp_backup_path}")
+                        relay_result = ssh_service.relay_file(backup.server, backup.remote_path, target_server, temp_backup_path,
+                                                             expected_checksum=backup.checksum)
+                        if not relay_result['success']:
+                            return jsonify({'success': False, 'message': f"Failed to relay backup from {backup.server.name}: {relay_result['error']}"}), 500
+                    else:
+                        sftp = client.open_sftp()
+                        
+                        # Upload to temporary location where we have write permissions
+                        if manifest:
+                            app.logger.info(f"Uploading backup {backup_id} from the chunk store to temporary location {temp_backup_path}")
+                            sftp.putfo(ManifestReader(manifest), temp_backup_path, file_size=manifest.size)
+                        else:
+                            app.logger.info(f"Uploading {backup_file_path} to temporary location {temp_backup_path}")
+                            sftp.put(str(backup_file_path), temp_backup_path)
+                        sftp.close()
                     
                     app.logger.info(f"Successfully uploaded backup to temporary location on {target_server.name}")
                     
@@ -466,20 +428,12 @@ def restore_backup(backup_id):
                         f'rm -f {temp_backup_path}'  # Clean up temp file
                     ]
                     
-                    for cmd in setup_commands:
-                        app.logger.info(f"Executing: {cmd}")
-                        stdin, stdout, stderr = client.exec_command(cmd, timeout=60)
-                        stdout.channel.settimeout(30)  # 30 second timeout for setup commands
-                        
-                        try:
-                            exit_code = stdout.channel.recv_exit_status()
-                            error_output = stderr.read().decode('utf-8')
-                            
-                            if exit_code != 0:
-                                app.logger.error(f"Command failed: {cmd} - Error: {error_output}")
-                                return jsonify({'success': False, 'message': f'Failed to setup backup file: {error_output}'}), 500
-                        except Exception as e:
-                            return jsonify({'success': False, 'message': f'Setup command timed out: {str(e)}'}), 500
+                    # One remote script for all steps instead of a channel per command
+                    app.logger.info(f"Executing setup steps: {setup_commands}")
+                    setup = ssh_service.run_steps(target_server, setup_commands, timeout=300)
+                    if not setup['success']:
+                        app.logger.error(f"Setup failed: {setup['error']}")
+                        return jsonify({'success': False, 'message': f"Failed to setup backup file: {setup['error']}"}), 500
                     
                     app.logger.info(f"Successfully prepared backup file with correct permissions")
                     
@@ -560,7 +514,7 @@ def restore_backup(backup_id):
             app.logger.info(f"Standard restore requested for backup {backup_id} to {target_server.name}")
             
             # Step 1: Upload backup file to target server and replace nova_hr.bak
-            backup_file_path = Path(backup.backup_path)
+            backup_file_path = Path(backup.backup_path) if has_local_copy else None
             temp_backup_path = f"/tmp/restore_backup_{backup_id}.bak"
             # Overwrite the standard nova_hr.bak file that the restore script expects
             final_backup_path = "/home/dynamic/nova-hr-docker/mssql/backup/nova_hr.bak"
@@ -571,12 +525,24 @@ def restore_backup(backup_id):
                     if not client:
                         return jsonify({'success': False, 'message': 'Failed to establish SSH connection to server'}), 500
                     
-                    sftp = client.open_sftp()
-                    
-                    # Upload to temporary location where we have write permissions
-                    app.logger.info(f"Uploading {backup_file_path} to temporary location {temp_backup_path}")
-                    sftp.put(str(backup_file_path), temp_backup_path)
-                    sftp.close()
+                    if use_relay:
+                        # Stream from the source server without staging the file here
+                        app.logger.info(f"Relaying {backup.server.name}:{backup.remote_path} to temporary location {temp_backup_path}")
+                        relay_result = ssh_service.relay_file(backup.server, backup.remote_path, target_server, temp_backup_path,
+                                                             expected_checksum=backup.checksum)
+                        if not relay_result['success']:
+                            return jsonify({'success': False, 'message': f"Failed to relay backup from {backup.server.name}: {relay_result['error']}"}), 500
+                    else:
+                        sftp = client.open_sftp()
+                        
+                        # Upload to temporary location where we have write permissions
+                        if manifest:
+                            app.logger.info(f"Uploading backup {backup_id} from the chunk store to temporary location {temp_backup_path}")
+                            sftp.putfo(ManifestReader(manifest), temp_backup_path, file_size=manifest.size)
+                        else:
+                            app.logger.info(f"Uploading {backup_file_path} to temporary location {temp_backup_path}")
+                            sftp.put(str(backup_file_path), temp_backup_path)
+                        sftp.close()
                     
                     app.logger.info(f"Successfully uploaded backup to temporary location on {target_server.name}")
                     
@@ -592,20 +558,12 @@ def restore_backup(backup_id):
                         f'rm -f {temp_backup_path}'  # Clean up temp file
                     ]
                     
-                    for cmd in setup_commands:
-                        app.logger.info(f"Executing: {cmd}")
-                        stdin, stdout, stderr = client.exec_command(cmd, timeout=60)
-                        stdout.channel.settimeout(30)  # 30 second timeout for setup commands
-                        
-                        try:
-                            exit_code = stdout.channel.recv_exit_status()
-                            error_output = stderr.read().decode('utf-8')
-                            
-                            if exit_code != 0:
-                                app.logger.error(f"Command failed: {cmd} - Error: {error_output}")
-                                return jsonify({'success': False, 'message': f'Failed to setup backup file: {error_output}'}), 500
-                        except Exception as e:
-                            return jsonify({'success': False, 'message': f'Setup command timed out: {str(e)}'}), 500
+                    # One remote script for all steps instead of a channel per command
+                    app.logger.info(f"Executing setup steps: {setup_commands}")
+                    setup = ssh_service.run_steps(target_server, setup_commands, timeout=300)
+                    if not setup['success']:
+                        app.logger.error(f"Setup failed: {setup['error']}")
+                        return jsonify({'success': False, 'message': f"Failed to setup backup file: {setup['error']}"}), 500
                     
                     app.logger.info(f"Successfully prepared backup file with correct permissions at {final_backup_path}")
                     
@@ -637,26 +595,20 @@ def restore_backup(backup_id):
                     if not client:
                         return jsonify({'success': False, 'message': 'Failed to establish SSH connection for restore'}), 500
                     
-                    # First, check if the restore script exists in the container (not host)
-                    app.logger.info("Checking if restore script exists in container...")
-                    stdin, stdout, stderr = client.exec_command("cd /home/dynamic/nova-hr-docker && docker compose exec -T mssql ls -l /usr/src/app/restore-db.sh")
-                    container_script_check = stdout.read().decode('utf-8')
-                    container_script_error = stderr.read().decode('utf-8')
-                    app.logger.info(f"Container script check: {container_script_check}")
-                    if container_script_error:
-                        app.logger.error(f"Container script check error: {container_script_error}")
-                    
-                    # Check what paths are available inside the container and find nova_hr.bak
-                    app.logger.info(f"Checking container backup directory...")
-                    stdin, stdout, stderr = client.exec_command("cd /home/dynamic/nova-hr-docker && docker compose exec -T mssql ls -la /mssql/backup/")
-                    container_dir_check = stdout.read().decode('utf-8')
-                    app.logger.info(f"Container backup directory contents: {container_dir_check}")
-                    
-                    # Check if nova_hr.bak exists with various possible paths
-                    for backup_path in ["/mssql/backup/nova_hr.bak", "/backup/nova_hr.bak", "/var/opt/mssql/backup/nova_hr.bak"]:
-                        stdin, stdout, stderr = client.exec_command(f"cd /home/dynamic/nova-hr-docker && docker compose exec -T mssql ls -l {backup_path}")
-                        path_check = stdout.read().decode('utf-8')
-                        app.logger.info(f"Container path check {backup_path}: {path_check}")
+                    # Check the restore script and backup paths inside the container (not host) in one batch
+                    app.logger.info("Checking restore script and backup paths in container...")
+                    container_checks = ssh_service.run_steps(target_server, [
+                        "cd /home/dynamic/nova-hr-docker && docker compose exec -T mssql ls -l /usr/src/app/restore-db.sh",
+                        "cd /home/dynamic/nova-hr-docker && docker compose exec -T mssql ls -la /mssql/backup/"
+                    ] + [
+                        # Check if nova_hr.bak exists with various possible paths
+                        f"cd /home/dynamic/nova-hr-docker && docker compose exec -T mssql ls -l {backup_path}"
+                        for backup_path in ["/mssql/backup/nova_hr.bak", "/backup/nova_hr.bak", "/var/opt/mssql/backup/nova_hr.bak"]
+                    ], stop_on_error=False, timeout=120)
+                    for step in container_checks['steps']:
+                        app.logger.info(f"Container check '{step['command']}' (exit {step['exit_code']}): {step['output']}")
+                        if step['error_output']:
+                            app.logger.error(f"Container check error: {step['error_output']}")
                     
                     # Now execute the restore command without arguments (script will find nova_hr.bak automatically)
                     restore_command = "cd /home/dynamic/nova-hr-docker && docker compose exec -T mssql /usr/src/app/restore-db.sh"
@@ -704,13 +656,34 @@ def restore_backup(backup_id):
 
 @app.route('/upload-restore-backup', methods=['POST'])
 @login_required
-@csrf.exempt  # Exempt from CSRF due to large file uploads causing worker timeouts during form parsing
+@csrf.exempt  # The token is checked from the header below; CSRFProtect would parse (and spool) the whole upload first
 def upload_restore_backup():
-    """Upload a backup file and restore it to selected server"""
+    """Upload a backup file and restore it to selected server
+    
+    The file is streamed from the request body straight to the target server
+    while it arrives, so target_server_id (and keep_copy) must come before
+    backup_file in the form. With keep_copy a copy is kept in uploads/backups.
+    """
     if not current_user.has_permission('database_operations'):
         return jsonify({'success': False, 'message': 'Access denied. Technical Agent privileges required.'}), 403
     
-    target_server_id = request.form.get('target_server_id')
+    try:
+        if app.config.get('WTF_CSRF_ENABLED', True):
+            validate_csrf(request.headers.get('X-CSRFToken'))
+    except ValidationError:
+        return jsonify({'success': False, 'message': 'The CSRF token is missing or invalid. Please reload the page.'}), 400
+    
+    # Validate file size (2GB max for realistic backup files); enforced again while streaming
+    if request.content_length and request.content_length > BACKUP_UPLOAD_MAX_SIZE + 64 * 1024:
+        return jsonify({'success': False, 'message': 'File size exceeds 2GB limit'}), 400
+    
+    try:
+        upload = MultipartUpload(request.stream, request.content_type)
+        file_part = upload.next_file()
+    except UploadRejected as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    target_server_id = upload.fields.get('target_server_id')
     if not target_server_id:
         return jsonify({'success': False, 'message': 'Target server is required'}), 400
     
@@ -725,169 +698,153 @@ def upload_restore_backup():
         return jsonify({'success': False, 'message': 'Access denied. You do not have access to this server.'}), 403
     
     # Check if file was uploaded
-    if 'backup_file' not in request.files:
+    if file_part is None or file_part[0] != 'backup_file':
         return jsonify({'success': False, 'message': 'No backup file uploaded'}), 400
     
-    backup_file = request.files['backup_file']
-    if backup_file.filename == '':
+    original_filename = file_part[1]
+    if not original_filename:
         return jsonify({'success': False, 'message': 'No file selected'}), 400
     
     # Validate file type - only .bak files for MSSQL restore compatibility
     allowed_extensions = {'.bak'}
-    file_ext = Path(backup_file.filename).suffix.lower()
+    file_ext = Path(original_filename).suffix.lower()
     if file_ext not in allowed_extensions:
         return jsonify({'success': False, 'message': 'Only .bak files are supported for database restore operations'}), 400
     
-    # Validate file size (2GB max for realistic backup files)
-    max_size = 2 * 1024 * 1024 * 1024  # 2GB
-    backup_file.seek(0, 2)  # Seek to end to get file size
-    file_size = backup_file.tell()
-    backup_file.seek(0)  # Reset to beginning
-    
-    if file_size > max_size:
-        return jsonify({'success': False, 'message': 'File size exceeds 2GB limit'}), 400
+    keep_copy = upload.fields.get('keep_copy', 'true').lower() in ('true', 'on', '1')
     
     try:
-        # Create secure uploads directory outside web-accessible area
-        uploads_dir = Path('uploads/backups')
-        uploads_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Generate unique filename with timestamp and sanitize original filename
-        from werkzeug.utils import secure_filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        safe_original_filename = secure_filename(backup_file.filename)
-        safe_filename = f"uploaded_{timestamp}_{safe_original_filename}"
-        local_backup_path = uploads_dir / safe_filename
-        
-        # Save uploaded file
-        backup_file.save(str(local_backup_path))
-        app.logger.info(f"Uploaded backup file saved to {local_backup_path}")
-        
-        # Initialize SSH service
-        ssh_service = SSHService()
-        
-        app.logger.info(f"Initiating upload restore for {backup_file.filename} to {target_server.name}")
+        local_backup_path = uploaded_backup_path(original_filename)
+        app.logger.info(f"Initiating upload restore for {original_filename} to {target_server.name}")
         
-        # Step 1: Upload backup file to server and replace nova_hr.bak
-        temp_backup_path = f"/tmp/uploaded_restore_{timestamp}.bak"
-        final_backup_path = "/home/dynamic/nova-hr-docker/mssql/backup/nova_hr.bak"
-        
-        # Upload the backup file via SFTP
         try:
-            with ssh_service._get_ssh_client(target_server) as client:
-                if not client:
-                    return jsonify({'success': False, 'message': 'Failed to establish SSH connection'}), 500
-                
-                sftp = client.open_sftp()
-                sftp.put(str(local_backup_path), temp_backup_path)
-                sftp.close()
-                
-                # Move to correct location with proper permissions
-                setup_commands = [
-                    'sudo mkdir -p /home/dynamic/nova-hr-docker/mssql/backup',
-                    f'sudo cp {temp_backup_path} {final_backup_path}',
-                    f'sudo chown 10001:10001 {final_backup_path}',
-                    f'sudo chmod 644 {final_backup_path}',
-                    f'rm -f {temp_backup_path}'
-                ]
-                
-                for cmd in setup_commands:
-                    stdin, stdout, stderr = client.exec_command(cmd, timeout=60)
-                    stdout.channel.settimeout(30)  # 30 second timeout for setup commands
-                    
-                    try:
-                        exit_code = stdout.channel.recv_exit_status()
-                        error_output = stderr.read().decode('utf-8')
-                        
-                        if exit_code != 0:
-                            return jsonify({'success': False, 'message': f'Failed to setup backup file: {error_output}'}), 500
-                    except Exception as e:
-                        return jsonify({'success': False, 'message': f'Setup command timed out: {str(e)}'}), 500
-                        
-        except Exception as e:
-            return jsonify({'success': False, 'message': f'Failed to upload backup: {str(e)}'}), 500
+            result = restore_uploaded_backup(target_server, upload.iter_file(BACKUP_UPLOAD_MAX_SIZE),
+                                             tee_path=str(local_backup_path) if keep_copy else None)
+        except UploadRejected as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
-        # Step 2: Check containers and execute restore
-        try:
-            with ssh_service._get_ssh_client(target_server) as client:
-                if not client:
-                    return jsonify({'success': False, 'message': 'Failed to establish SSH connection'}), 500
-                
-                # Check if containers are running
-                stdin, stdout, stderr = client.exec_command("cd /home/dynamic/nova-hr-docker && docker compose ps --services --filter status=running", timeout=60)
-                stdout.channel.settimeout(30)  # 30 second timeout for container check
-                
-                try:
-                    exit_code = stdout.channel.recv_exit_status()
-                    output = stdout.read().decode('utf-8')
-                except Exception as e:
-                    return jsonify({'success': False, 'message': f'Failed to check container status: {str(e)}'}), 500
-                
-                if exit_code != 0 or 'mssql' not in output:
-                    return jsonify({'success': False, 'message': 'MSSQL container is not running. Please ensure the application is started.'}), 500
-                
-                # Execute restore command with timeout handling
-                restore_command = "cd /home/dynamic/nova-hr-docker && docker compose exec -T mssql /usr/src/app/restore-db.sh"
-                stdin, stdout, stderr = client.exec_command(restore_command, timeout=300)
-                
-                # Wait for command completion with timeout
-                channel = stdout.channel
-                channel.settimeout(120)  # 2 minute timeout for restore operation
-                
-                try:
-                    exit_code = channel.recv_exit_status()
-                    output = stdout.read().decode('utf-8')
-                    error_output = stderr.read().decode('utf-8')
-                except Exception as e:
-                    return jsonify({'success': False, 'message': f'Restore operation timed out or failed: {str(e)}'}), 500
-                
-                if exit_code == 0:
-                    # Create database record for uploaded backup
-                    try:
-                        uploaded_backup = DatabaseBackup()
-                        uploaded_backup.database_name = f"uploaded_{backup_file.filename}"
-                        uploaded_backup.backup_path = str(local_backup_path)
-                        uploaded_backup.backup_size = file_size  # Size in bytes
-                        uploaded_backup.backup_type = "full"
-                        uploaded_backup.started_at = datetime.utcnow()
-                        uploaded_backup.completed_at = datetime.utcnow()
-                        uploaded_backup.status = 'completed'
-                        uploaded_backup.initiated_by = current_user.id
-                        uploaded_backup.server_id = target_server.id
-                        db.session.add(uploaded_backup)
-                        db.session.commit()
-                    except Exception as e:
-                        app.logger.error(f"Failed to create backup record: {str(e)}")
-                        # Don't fail the restore if record creation fails
-                    
-                    flash(f'Backup uploaded and successfully restored to {target_server.name}', 'success')
-                    return jsonify({
-                        'success': True, 
-                        'message': f'Backup uploaded and successfully restored to {target_server.name}',
-                        'output': output
-                    })
-                else:
-                    # Clean up uploaded file on failure
-                    try:
-                        local_backup_path.unlink()
-                    except:
-                        pass
-                    return jsonify({
-                        'success': False, 
-                        'message': f'Restore failed: {error_output or "Unknown error"}'
-                    }), 500
-                    
-        except Exception as e:
+        if not result['success']:
             # Clean up uploaded file on failure
             try:
                 local_backup_path.unlink()
             except:
                 pass
-            return jsonify({'success': False, 'message': f'Failed to execute restore: {str(e)}'}), 500
+            return jsonify({'success': False, 'message': result['message']}), 500
+        
+        record_uploaded_backup(target_server, original_filename, local_backup_path if keep_copy else None, result, current_user.id)
+        flash(result['message'], 'success')
+        return jsonify({'success': True, 'message': result['message'], 'output': result['output']})
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error processing upload: {str(e)}'}), 500
 
+def get_upload_session(upload_id):
+    """The current user's chunked upload, or 404"""
+    return UploadSession.query.filter_by(upload_id=upload_id, user_id=current_user.id).first_or_404()
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def create_chunked_upload():
+    """Start a chunked, resumable upload of a backup file to restore
+    
+    The browser then PUTs the chunks to /api/uploads/<upload_id>/chunks/<offset>,
+    checks GET /api/uploads/<upload_id> for the chunks already received after a
+    disconnect, and POSTs /api/uploads/<upload_id>/finalize to queue the restore.
+    """
+    if not current_user.has_permission('database_operations'):
+        return jsonify({'success': False, 'message': 'Access denied. Technical Agent privileges required.'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    target_server_id = data.get('target_server_id')
+    if not target_server_id:
+        return jsonify({'success': False, 'message': 'Target server is required'}), 400
+    
+    target_server = HetznerServer.query.get_or_404(target_server_id)
+    
+    # Check if user has access to the target server
+    if not current_user.has_server_access(target_server.id, 'write'):
+        return jsonify({'success': False, 'message': 'Access denied. You do not have access to this server.'}), 403
+    
+    filename = data.get('filename') or ''
+    if not filename:
+        return jsonify({'success': False, 'message': 'No file selected'}), 400
+    
+    # Validate file type - only .bak files for MSSQL restore compatibility
+    if Path(filename).suffix.lower() != '.bak':
+        return jsonify({'success': False, 'message': 'Only .bak files are supported for database restore operations'}), 400
+    
+    size = data.get('size')
+    if not isinstance(size, int):
+        return jsonify({'success': False, 'message': 'File size is required'}), 400
+    
+    try:
+        upload = create_upload(current_user.id, target_server.id, filename, size, keep_copy=bool(data.get('keep_copy', True)))
+    except UploadRejected as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    app.logger.info(f"Started chunked upload {upload.upload_id} of {filename} ({size:,} bytes) for {target_server.name}")
+    return jsonify({'success': True, **upload_status(upload)})
+
+@app.route('/api/uploads/<upload_id>')
+@login_required
+def chunked_upload_status(upload_id):
+    """Chunks received so far, so an interrupted upload can send only the missing ones"""
+    upload = get_upload_session(upload_id)
+    return jsonify({'success': True, **upload_status(upload)})
+
+@app.route('/api/uploads/<upload_id>/chunks/<int:offset>', methods=['PUT'])
+@login_required
+def put_upload_chunk(upload_id, offset):
+    """Receive one chunk as the raw request body; X-Chunk-SHA256 is checked when sent"""
+    if not current_user.has_permission('database_operations'):
+        return jsonify({'success': False, 'message': 'Access denied. Technical Agent privileges required.'}), 403
+    
+    upload = get_upload_session(upload_id)
+    try:
+        checksum = write_chunk(upload, offset, request.stream, request.headers.get('X-Chunk-SHA256'))
+    except UploadRejected as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    return jsonify({'success': True, 'offset': offset, 'checksum': checksum})
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_chunked_upload(upload_id):
+    """Abandon an upload and delete what was received"""
+    upload = get_upload_session(upload_id)
+    try:
+        discard_upload(upload, statuses=('uploading', 'completed'))
+    except UploadRejected as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    return jsonify({'success': True, 'message': 'Upload cancelled'})
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_chunked_upload(upload_id):
+    """Queue a completely received upload for restore to its target server
+    
+    The backup worker runs the restore, which takes longer than a web worker
+    may block for a large file; poll GET /api/uploads/<upload_id> for the outcome.
+    """
+    if not current_user.has_permission('database_operations'):
+        return jsonify({'success': False, 'message': 'Access denied. Technical Agent privileges required.'}), 403
+    
+    upload = get_upload_session(upload_id)
+    target_server = upload.target_server
+    
+    # Check if user still has access to the target server
+    if not current_user.has_server_access(target_server.id, 'write'):
+        return jsonify({'success': False, 'message': 'Access denied. You do not have access to this server.'}), 403
+    
+    try:
+        queue_restore(upload)
+    except UploadRejected as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    app.logger.info(f"Queued restore of upload {upload.upload_id} ({upload.filename}) to {target_server.name}")
+    return jsonify({**upload_status(upload), 'success': True, 'message': f'Restore of {upload.filename} to {target_server.name} queued'}), 202
+
 @app.route('/delete-backup/<int:backup_id>', methods=['DELETE'])
 @login_required
 def delete_backup(backup_id):
@@ -906,6 +863,10 @@ def delete_backup(backup_id):
         if backup.backup_path and Path(backup.backup_path).exists():
             Path(backup.backup_path).unlink()
         
+        # A deduplicated backup's chunks are freed by the backup worker's garbage collection
+        BackupManifest.query.filter_by(backup_id=backup.id).delete()
+        BackupCatalogEntry.query.filter_by(backup_id=backup.id, deduplicated=True).delete()
+        
         # Delete the database record
         db.session.delete(backup)
         db.session.commit()
@@ -919,6 +880,17 @@ def delete_backup(backup_id):
         db.session.rollback()
         return jsonify({'success': False, 'message': f'Error deleting backup: {str(e)}'}), 500
 
+def stored_backup_response(manifest, filename):
+    """Download a backup kept in the chunk store, rebuilt as it is sent"""
+    return Response(
+        stream_with_context(iter_manifest(manifest)),
+        mimetype='application/octet-stream',
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Content-Length': str(manifest.size)
+        }
+    )
+
 @app.route('/download-backup/<int:backup_id>')
 @login_required
 def download_backup_by_id(backup_id):
@@ -936,6 +908,9 @@ def download_backup_by_id(backup_id):
     
     backup_path = Path(backup.backup_path)
     if not backup_path.exists():
+        manifest = BackupManifest.query.filter_by(backup_id=backup.id).first()
+        if manifest:
+            return stored_backup_response(manifest, backup_path.name)
         flash('Backup file not found on disk', 'danger')
         return redirect(url_for('list_all_backups'))
     
@@ -970,6 +945,10 @@ def download_server_backup_file(server_name, filename):
     
     backup_path = Path("static/backups/servers") / server_name / filename
     if not backup_path.exists():
+        entry = BackupCatalogEntry.query.filter_by(path=f'servers/{server_name}/{filename}', deduplicated=True).first()
+        manifest = BackupManifest.query.filter_by(backup_id=entry.backup_id).first() if entry and entry.backup_id else None
+        if manifest:
+            return stored_backup_response(manifest, filename)
         flash('Server backup file not found', 'danger')
         return redirect(url_for('list_all_backups'))
     
@@ -1366,12 +1345,22 @@ def deploy_server(request_id):
 @app.route('/api/deployment-progress/<request_id>')
 @login_required
 def deployment_progress(request_id):
-    if not current_user.is_admin:
-        return jsonify({'error': 'Access denied'}), 403
-    
     server_request = ServerRequest.query.filter_by(request_id=request_id).first_or_404()
     
-    if server_request.status == 'deploying':
+    # Same access as the request detail page, which polls this while deploying
+    if not current_user.is_admin and server_request.user_id != current_user.id:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    if server_request.status == 'deploying' and server_request.hetzner_action_id:
+        # Real provisioning: poll Hetzner unless sync_worker.py tracks actions
+        if not app.config['BACKGROUND_SYNC']:
+            try:
+                track_server_actions(project_id=server_request.project_id)
+            except Exception as e:
+                app.logger.error(f"Error tracking server actions: {e}")
+                db.session.rollback()
+            db.session.refresh(server_request)
+    elif server_request.status == 'deploying':
         # Simulate deployment progress
         current_progress = server_request.deployment_progress
         if current_progress < 100:
@@ -1512,6 +1501,14 @@ def sync_servers():
         flash('Access denied. Admin privileges required.', 'danger')
         return redirect(url_for('index'))
     
+    if app.config['BACKGROUND_SYNC']:
+        projects = HetznerProject.query.filter_by(is_active=True).all()
+        for project in projects:
+            project.request_sync()
+        db.session.commit()
+        flash(f'Sync queued for {len(projects)} projects. Servers will refresh in the background.', 'info')
+        return redirect(url_for('servers_list'))
+    
     try:
         hetzner_service = HetznerService()
         result = hetzner_service.sync_servers_from_hetzner()
@@ -1560,6 +1557,79 @@ def server_detail(server_id):
                          execution_form=execution_form,
                          recent_deployments=recent_deployments)
 
+@app.route('/api/servers/<int:server_id>/metrics')
+@login_required
+def server_metrics(server_id):
+    """Chart data for a server from the local metrics store"""
+    if not (current_user.is_admin or current_user.is_technical_agent):
+        return jsonify({'success': False, 'error': 'Access denied. Technical Agent or Admin privileges required.'}), 403
+    
+    server = HetznerServer.query.get_or_404(server_id)
+    
+    if not current_user.is_admin:
+        accessible_server_ids = [s.id for s in current_user.get_accessible_servers()]
+        if server_id not in accessible_server_ids:
+            return jsonify({'success': False, 'error': 'Access denied. You do not have permission to view this server.'}), 403
+    
+    metric_type = request.args.get('type', 'cpu')
+    if metric_type not in METRIC_TYPES:
+        return jsonify({'success': False, 'error': f'type must be one of {", ".join(METRIC_TYPES)}'}), 400
+    
+    try:
+        end = datetime.utcfromtimestamp(int(request.args['end'])) if 'end' in request.args else datetime.utcnow()
+        start = datetime.utcfromtimestamp(int(request.args['start'])) if 'start' in request.args else end - timedelta(hours=int(request.args.get('hours', 24)))
+        max_points = min(int(request.args.get('max_points', DEFAULT_MAX_POINTS)), 5000)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'start, end, hours and max_points must be integers'}), 400
+    
+    if start >= end:
+        return jsonify({'success': False, 'error': 'start must be before end'}), 400
+    
+    result = query_metrics(server.id, metric_type, start, end, max_points=max_points)
+    return jsonify(dict(result, success=True, server_id=server.id, type=metric_type,
+                        start=int((start - datetime(1970, 1, 1)).total_seconds()),
+                        end=int((end - datetime(1970, 1, 1)).total_seconds())))
+
+@app.route('/servers/<int:server_id>/refresh', methods=['POST'])
+@login_required
+def refresh_server(server_id):
+    """Refresh one server from Hetzner Cloud without syncing the whole project"""
+    if not (current_user.is_admin or current_user.is_technical_agent):
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return jsonify({'success': False, 'error': 'Access denied. Technical Agent or Admin privileges required.'}), 403
+        flash('Access denied. Technical Agent or Admin privileges required.', 'danger')
+        return redirect(url_for('index'))
+    
+    server = HetznerServer.query.get_or_404(server_id)
+    
+    if not current_user.is_admin:
+        accessible_server_ids = [s.id for s in current_user.get_accessible_servers()]
+        if server_id not in accessible_server_ids:
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return jsonify({'success': False, 'error': 'Access denied. You do not have permission to view this server.'}), 403
+            flash('Access denied. You do not have permission to view this server.', 'danger')
+            return redirect(url_for('server_operations'))
+    
+    if server.is_self_hosted or not server.hetzner_id or not server.project_id:
+        result = {'success': False, 'error': 'Only Hetzner servers assigned to a project can be refreshed'}
+    else:
+        try:
+            result = HetznerService(project_id=server.project_id).refresh_servers([server.hetzner_id])
+        except ValueError as e:
+            result = {'success': False, 'error': str(e)}
+    
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if not result['success']:
+            return jsonify({'success': False, 'error': result['error']})
+        db.session.refresh(server)
+        return jsonify(dict(result, status=server.status, public_ip=server.public_ip))
+    
+    if result['success']:
+        flash(f'Server {server.name} refreshed from Hetzner Cloud.', 'success')
+    else:
+        flash(f'Refresh failed: {result["error"]}', 'danger')
+    return redirect(url_for('server_detail', server_id=server_id))
+
 @app.route('/servers/<int:server_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_server(server_id):
@@ -1692,6 +1762,126 @@ def manage_server(server_id):
     
     return redirect(url_for('server_detail', server_id=server_id))
 
+@app.route('/api/servers/power', methods=['POST'])
+@login_required
+def bulk_power_action():
+    """Start, stop or reboot many servers at once and return per-server results"""
+    if not (current_user.is_admin or current_user.is_technical_agent):
+        return jsonify({'success': False, 'error': 'Access denied. Technical Agent or Admin privileges required.'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    server_ids = data.get('server_ids') or []
+    
+    if action not in ('start', 'stop', 'reboot'):
+        return jsonify({'success': False, 'error': 'Action must be one of start, stop or reboot'}), 400
+    if not isinstance(server_ids, list) or not server_ids:
+        return jsonify({'success': False, 'error': 'server_ids must be a non-empty list'}), 400
+    
+    try:
+        server_ids = [int(server_id) for server_id in server_ids]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'server_ids must be integers'}), 400
+    
+    servers = HetznerServer.query.filter(HetznerServer.id.in_(server_ids)).all()
+    
+    # Technical agents can only manage servers of their projects
+    if not current_user.is_admin:
+        accessible_server_ids = {s.id for s in current_user.get_accessible_servers()}
+        denied = [server.id for server in servers if server.id not in accessible_server_ids]
+        if denied:
+            return jsonify({'success': False, 'error': f'Access denied for servers: {", ".join(map(str, denied))}'}), 403
+    
+    found_ids = {server.id for server in servers}
+    results = {server_id: {'success': False, 'error': 'Server not found'} for server_id in server_ids if server_id not in found_ids}
+    
+    start_time = time.time()
+    try:
+        results.update(power_action_servers(servers, action))
+    except Exception as e:
+        app.logger.error(f"Error in bulk {action}: {e}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    succeeded = sum(1 for result in results.values() if result['success'])
+    pending = [server_id for server_id, result in results.items() if result.get('pending')]
+    app.logger.info(f"Bulk {action} by {current_user.username}: {succeeded}/{len(results)} servers confirmed, {len(pending)} pending")
+    
+    return jsonify({
+        'success': succeeded == len(results),
+        'action': action,
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded - len(pending),
+        'pending': pending,
+        'results': {str(server_id): result for server_id, result in results.items()},
+        'elapsed': round(time.time() - start_time, 2)
+    })
+
+@app.route('/api/servers/command', methods=['POST'])
+@login_required
+def fleet_command():
+    """Run one shell command on many servers at once
+    
+    Streams newline-delimited JSON: one line per server as it finishes,
+    then a summary line. The whole run has to fit in FANOUT_DEADLINE, so
+    the per-host timeout defaults to what fits for the number of servers and
+    requests whose hosts x timeout / max_parallel exceed it are rejected.
+    """
+    if not (current_user.is_admin or current_user.is_technical_agent):
+        return jsonify({'success': False, 'error': 'Access denied. Technical Agent or Admin privileges required.'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    command = (data.get('command') or '').strip()
+    server_ids = data.get('server_ids') or []
+    
+    if not command:
+        return jsonify({'success': False, 'error': 'command is required'}), 400
+    if not isinstance(server_ids, list) or not server_ids:
+        return jsonify({'success': False, 'error': 'server_ids must be a non-empty list'}), 400
+    
+    try:
+        server_ids = [int(server_id) for server_id in server_ids]
+        max_parallel = min(max(int(data.get('max_parallel', FANOUT_MAX_WORKERS)), 1), FANOUT_MAX_WORKERS)
+        waves = -(-len(set(server_ids)) // max_parallel)
+        timeout = min(max(int(data.get('timeout', min(FANOUT_TIMEOUT, FANOUT_DEADLINE // waves))), 1), FANOUT_DEADLINE)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'server_ids, max_parallel and timeout must be integers'}), 400
+    
+    # The response streams from this worker, which gunicorn kills after its timeout
+    if waves * timeout > FANOUT_DEADLINE:
+        return jsonify({'success': False, 'error': f'{len(set(server_ids))} servers at {max_parallel} in parallel with a {timeout}s timeout '
+                                                   f'can take longer than the {FANOUT_DEADLINE}s limit; '
+                                                   f'lower the timeout or split the servers into smaller batches'}), 400
+    
+    servers = HetznerServer.query.options(joinedload(HetznerServer.project)).filter(HetznerServer.id.in_(server_ids)).all()
+    
+    # Technical agents can only reach servers of their projects
+    if not current_user.is_admin:
+        denied = [server.id for server in servers if not current_user.has_server_access(server.id, 'write')]
+        if denied:
+            return jsonify({'success': False, 'error': f'Access denied for servers: {", ".join(map(str, denied))}'}), 403
+    
+    found_ids = {server.id for server in servers}
+    missing = [server_id for server_id in server_ids if server_id not in found_ids]
+    app.logger.info(f"Fleet command by {current_user.username} on {len(servers)} servers: {command}")
+    
+    ssh_service = SSHService()
+    results_stream = ssh_service.fan_out_command(servers, command, max_workers=max_parallel, timeout=timeout,
+                                                 deadline=FANOUT_DEADLINE)
+    
+    def generate():
+        start_time = time.time()
+        results = [{'server_id': server_id, 'server_name': None, 'success': False, 'exit_code': None,
+                    'output': '', 'error_output': '', 'error': 'Server not found'} for server_id in missing]
+        for result in results:
+            yield json.dumps(dict(result, type='result')) + '\n'
+        for result in results_stream:
+            results.append(result)
+            yield json.dumps(dict(result, type='result')) + '\n'
+        yield json.dumps(dict(summarize_fan_out(results, time.time() - start_time), type='summary')) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/servers/add-self-hosted', methods=['GET', 'POST'])
 @login_required
 def add_self_hosted_server():
@@ -2138,119 +2328,61 @@ def create_backup(server_id):
         flash('Access denied. You do not have access to this server.', 'danger')
         return redirect(url_for('server_operations'))
     
-    # Create backup record
-    backup = DatabaseBackup()
-    backup.server_id = server_id
-    backup.database_name = request.form.get('database_name', 'main')
-    backup.backup_type = request.form.get('backup_type', 'full')
-    backup.started_at = datetime.utcnow()
-    backup.initiated_by = current_user.id
-    
-    db.session.add(backup)
-    db.session.commit()
+    # Check if project has SSH configuration before queueing a job that cannot connect
+    if not server.project or not server.project.ssh_private_key:
+        error_msg = f'Project {server.project.name if server.project else "Unknown"} requires SSH key configuration for remote backup execution'
+        if is_ajax:
+            return jsonify({'success': False, 'message': error_msg, 'status': 'failed'})
+        flash(error_msg, 'warning')
+        return redirect(url_for('server_operations'))
     
-    try:
-        # Check if project has SSH configuration
-        if not server.project or not server.project.ssh_private_key:
-            backup.status = 'failed'
-            backup.error_log = 'No SSH private key configured for this project. Please configure SSH access in project settings.'
-            backup.completed_at = datetime.utcnow()
-            db.session.commit()
-            error_msg = f'Project {server.project.name if server.project else "Unknown"} requires SSH key configuration for remote backup execution'
-            if is_ajax:
-                return jsonify({'success': False, 'message': error_msg, 'status': 'failed'})
-            flash(error_msg, 'warning')
-            return redirect(url_for('server_operations'))
-        
-        # Use SSH service to execute backup command remotely and prepare file for download
-        ssh_service = SSHService()
-        
-        # Create backup directory structure organized by server name
-        server_backup_dir = Path(f"static/backups/servers/{server.name}")
-        server_backup_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Generate backup filename (will be updated with actual filename from server)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"{backup.database_name}_{timestamp}.bak"
-        local_backup_path = server_backup_dir / backup_filename
-        
-        # Execute the backup command - backup files are created in /home/dynamic/nova-hr-docker/mssql/backup/
-        backup_command = f"cd /home/dynamic/nova-hr-docker && docker compose exec backup ./usr/src/app/backup-db.sh && echo 'BACKUP_COMPLETED' && ls -la /home/dynamic/nova-hr-docker/mssql/backup/ | tail -1"
-        
-        success, stdout_output, stderr_output = ssh_service.execute_command(
-            server=server,
-            command=backup_command,
-            timeout=300  # 5 minute timeout
-        )
-        
-        # Update record with results
-        backup.completed_at = datetime.utcnow()
-        backup.backup_log = stdout_output
-        
-        if success:
-            # Step 2: Find and download the latest backup file from the server
-            try:
-                # Get the latest backup file from the remote server
-                latest_backup = ssh_service.get_latest_backup_file(server)
-                
-                if latest_backup:
-                    # Update local filename to match the actual backup filename
-                    actual_filename = Path(latest_backup).name
-                    local_backup_path = server_backup_dir / actual_filename
-                    
-                    # Download the backup file from remote server to our local storage
-                    download_success = ssh_service.download_file(
-                        server=server,
-                        remote_path=latest_backup,
-                        local_path=str(local_backup_path)
-                    )
-                    
-                    if download_success and local_backup_path.exists():
-                        # Get actual file size
-                        file_size = local_backup_path.stat().st_size
-                        backup.backup_path = str(local_backup_path)
-                        backup.backup_size = file_size
-                        backup.status = 'completed'
-                        
-                        flash(f'Database backup completed and downloaded for {server.name} ({file_size:,} bytes)', 'success')
-                    else:
-                        backup.status = 'failed'
-                        backup.error_log = 'Backup created on server but failed to download to management system'
-                        flash(f'Backup created on {server.name} but failed to download to management system', 'warning')
-                else:
-                    backup.status = 'failed'
-                    backup.error_log = 'No backup file found after backup command execution'
-                    flash(f'Backup command executed but no backup file found on {server.name}', 'warning')
-                    
-            except Exception as transfer_error:
-                backup.status = 'failed'
-                backup.error_log = f'File transfer error: {str(transfer_error)}'
-                flash(f'Backup process failed during file transfer: {str(transfer_error)}', 'warning')
-        else:
-            backup.status = 'failed'
-            backup.error_log = stderr_output
-            flash(f'Database backup failed on {server.name}. Check logs for details.', 'danger')
-        
-        db.session.commit()
-        
-    except Exception as e:
-        backup.status = 'failed'
-        backup.error_log = str(e)
-        backup.completed_at = datetime.utcnow()
-        db.session.commit()
-        flash(f'Error executing backup command: {str(e)}', 'danger')
+    # The dump and download run in backup_worker.py; a large backup takes longer than a web worker may block
+    backup = queue_backup(
+        server=server,
+        database_name=request.form.get('database_name', 'main'),
+        backup_type=request.form.get('backup_type', 'full'),
+        user_id=current_user.id
+    )
     
     # Return appropriate response
     if is_ajax:
         return jsonify({
-            'success': backup.status == 'completed',
-            'message': f'Backup {"completed" if backup.status == "completed" else "failed"} for {server.name}',
-            'timestamp': convert_to_cairo_timezone(backup.completed_at).strftime('%Y-%m-%d %H:%M') if backup.completed_at else None,
-            'status': backup.status
+            'success': True,
+            'message': f'Backup queued for {server.name}',
+            'backup_id': backup.id,
+            'job_id': backup.backup_id,
+            'status': backup.status,
+            'status_url': url_for('backup_status', backup_id=backup.id)
         })
     
+    flash(f'Backup queued for {server.name}. Progress is shown on the backups page.', 'info')
     return redirect(url_for('server_operations'))
 
+@app.route('/api/backups/<int:backup_id>/status')
+@login_required
+def backup_status(backup_id):
+    """Phase and progress of a queued or running backup job"""
+    if not current_user.has_permission('database_operations'):
+        return jsonify({'success': False, 'message': 'Access denied. Technical Agent privileges required.'}), 403
+    
+    backup = DatabaseBackup.query.get_or_404(backup_id)
+    if not current_user.has_server_access(backup.server_id):
+        return jsonify({'success': False, 'message': 'Access denied. You do not have access to this server.'}), 403
+    
+    return jsonify({
+        'success': True,
+        'backup_id': backup.id,
+        'job_id': backup.backup_id,
+        'status': backup.status,
+        'phase': backup.phase,
+        'progress': backup.progress or 0,
+        'bytes_transferred': backup.bytes_transferred or 0,
+        'backup_size': backup.backup_size,
+        'done': backup.status not in ('queued', 'running'),
+        'error': backup.error_message,
+        'timestamp': convert_to_cairo_timezone(backup.completed_at).strftime('%Y-%m-%d %H:%M') if backup.completed_at else None
+    })
+
 @app.route('/server/<int:server_id>/update', methods=['POST'])
 @login_required
 def create_system_update(server_id):
@@ -2302,23 +2434,23 @@ def create_system_update(server_id):
         # Execute the deployment script directly on the server
         deployment_command = get_default_deploy_script()
         
-        # Execute the command via SSH
-        success, stdout_output, stderr_output = ssh_service.execute_command(
+        # Execute the command via SSH, appending output to execution_log/error_log as it runs
+        output_log = CommandLog(SystemUpdate, update.id, 'execution_log', 'error_log')
+        success, exit_code = ssh_service.execute_command_streaming(
             server=server,
             command=deployment_command,
+            output_log=output_log,
             timeout=300  # 5 minute timeout
         )
         
         # Update record with results
         update.completed_at = datetime.utcnow()
-        update.execution_log = stdout_output
         
         if success:
             update.status = 'completed'
             flash(f'Nova HR deployment script executed successfully on {server.name}', 'success')
         else:
             update.status = 'failed'
-            update.error_log = stderr_output
             flash(f'Deployment script failed on {server.name}. Check logs for details.', 'danger')
         
         db.session.commit()
@@ -2564,6 +2696,37 @@ def get_log_details(log_type, log_id):
     else:
         return jsonify({'error': 'Invalid log type'}), 400
 
+@app.route('/api/logs/<log_type>/<int:log_id>/tail')
+@login_required
+def tail_log(log_type, log_id):
+    """Output written since the given offsets, for following a running operation"""
+    if not current_user.has_permission('server_operations'):
+        return jsonify({'error': 'Access denied'}), 403
+    
+    if log_type == 'update':
+        model, output_column = SystemUpdate, 'execution_log'
+    elif log_type == 'backup':
+        model, output_column = DatabaseBackup, 'backup_log'
+    else:
+        return jsonify({'error': 'Invalid log type'}), 400
+    
+    # Only the status is loaded here; the logs are read from the offsets on in SQL
+    log = model.query.options(load_only(model.status)).filter_by(id=log_id).first_or_404()
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    error_offset = max(request.args.get('error_offset', 0, type=int), 0)
+    
+    output, output_length = read_log_tail(model, log_id, output_column, offset)
+    error_output, error_length = read_log_tail(model, log_id, 'error_log', error_offset)
+    
+    return jsonify({
+        'status': log.status,
+        'done': log.status not in ('queued', 'running'),
+        'output': output,
+        'offset': output_length,
+        'error_output': error_output,
+        'error_offset': error_length
+    })
+
 @app.route('/api/logs/<log_type>/<int:log_id>/download')
 @login_required
 def download_log_file(log_type, log_id):
@@ -3143,6 +3306,23 @@ def hetzner_project_detail(project_id):
                          assigned_managers=assigned_managers,
                          available_managers=available_managers)
 
+def sync_managed_project_servers(project):
+    """Partial sync of a project's servers labelled managed-by=dynamic-servers"""
+    result = HetznerService(project_id=project.id).sync_servers_from_hetzner(label_selector=MANAGED_LABEL_SELECTOR)
+    
+    if result['success']:
+        message = f'Managed servers synced! {result["synced"]} new servers, {result["updated"]} updated, {result["total"]} managed.'
+    else:
+        message = f'Sync failed: {result["error"]}'
+    
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if not result['success']:
+            return jsonify({'success': False, 'error': result['error']})
+        return jsonify(dict(result, message=message, timestamp=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')))
+    
+    flash(message, 'success' if result['success'] else 'danger')
+    return redirect(url_for('hetzner_project_detail', project_id=project.id))
+
 @app.route('/hetzner-projects/<int:project_id>/sync', methods=['POST'])
 @login_required
 def sync_project_servers(project_id):
@@ -3164,9 +3344,29 @@ def sync_project_servers(project_id):
     
     project = HetznerProject.query.get_or_404(project_id)
     
+    # scope=managed lists only servers provisioned by this app; it is cheap, so it always runs inline
+    if request.values.get('scope') == 'managed':
+        return sync_managed_project_servers(project)
+    
+    if app.config['BACKGROUND_SYNC']:
+        project.request_sync()
+        db.session.commit()
+        freshness = project.sync_freshness()
+        message = f'Sync queued for {project.name}.'
+        if freshness['last_synced_at']:
+            message += f' Last successful sync: {freshness["last_synced_at"]} UTC.'
+        
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return jsonify(dict(freshness, success=True, queued=True, message=message))
+        flash(message, 'info')
+        return redirect(url_for('hetzner_project_detail', project_id=project_id))
+    
     try:
+        sync_started_at = datetime.utcnow()
         hetzner_service = HetznerService(project_id=project_id)
         result = hetzner_service.sync_servers_from_hetzner()
+        project.record_sync_result(result, sync_started_at)
+        db.session.commit()
         
         # Check if it's an AJAX request
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -3178,6 +3378,8 @@ def sync_project_servers(project_id):
                     'updated': result["updated"],
                     'deleted': result.get("deleted", 0),
                     'total': result["total"],
+                    'queries': result.get("queries"),
+                    'timings': result.get("timings"),
                     'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
                 })
             else:
@@ -3206,6 +3408,37 @@ def sync_project_servers(project_id):
     
     return redirect(url_for('hetzner_project_detail', project_id=project_id))
 
+@app.route('/api/hetzner-projects/<int:project_id>/catalog')
+@login_required
+def hetzner_project_catalog(project_id):
+    """Images, server types and locations for a project, served from the catalog cache"""
+    if not (current_user.is_admin or current_user.has_permission('create_requests') or current_user.has_project_access(project_id)):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    
+    try:
+        hetzner_service = HetznerService(project_id=project_id)
+        return jsonify({
+            'success': True,
+            'images': hetzner_service.get_available_images(),
+            'server_types': hetzner_service.get_available_server_types(),
+            'locations': hetzner_service.get_available_locations()
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+
+@app.route('/hetzner-projects/<int:project_id>/catalog/invalidate', methods=['POST'])
+@login_required
+def invalidate_project_catalog(project_id):
+    """Drop the cached catalog for a project so the next lookup re-fetches it"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'error': 'Access denied. Admin privileges required.'}), 403
+    
+    try:
+        HetznerService(project_id=project_id).invalidate_catalog_cache()
+        return jsonify({'success': True, 'message': 'Catalog cache cleared'})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+
 @app.route('/hetzner-projects/<int:project_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_hetzner_project(project_id):
@@ -3216,6 +3449,7 @@ def edit_hetzner_project(project_id):
     project = HetznerProject.query.get_or_404(project_id)
     
     if request.method == 'POST':
+        previous_token = project.hetzner_api_token
         project.name = request.form['name']
         project.description = request.form['description']
         project.hetzner_api_token = request.form['hetzner_api_token']
@@ -3225,6 +3459,11 @@ def edit_hetzner_project(project_id):
         project.updated_at = datetime.utcnow()
         
         db.session.commit()
+        
+        # Catalog entries are keyed by token; drop the ones for a replaced token
+        if previous_token != project.hetzner_api_token and previous_token != 'USE_ENV_TOKEN':
+            invalidate_catalog_cache(previous_token)
+        
         flash('Project updated successfully!', 'success')
         return redirect(url_for('hetzner_project_detail', project_id=project_id))
     
@@ -3265,31 +3504,58 @@ def sync_all_projects():
         return redirect(url_for('index'))
     
     projects = HetznerProject.query.filter_by(is_active=True).all()
+    
+    if app.config['BACKGROUND_SYNC']:
+        for project in projects:
+            project.request_sync()
+        db.session.commit()
+        message = f'Sync queued for {len(projects)} projects. Servers will refresh in the background.'
+        
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return jsonify({
+                'success': True,
+                'queued': True,
+                'message': message,
+                'projects': [project.sync_freshness() for project in projects],
+                'projects_count': len(projects)
+            })
+        flash(message, 'info')
+        return redirect(url_for('hetzner_projects'))
+    
     total_synced = 0
     total_updated = 0
     total_deleted = 0
     errors = []
+    project_results = []
+    
+    # Projects are synced concurrently, each worker with its own DB session
+    sync_started_at = datetime.utcnow()
+    sync_started = time.perf_counter()
+    results = sync_projects([project.id for project in projects])
+    elapsed = round(time.perf_counter() - sync_started, 3)
     
     for project in projects:
-        try:
-            hetzner_service = HetznerService(project_id=project.id)
-            result = hetzner_service.sync_servers_from_hetzner()
-            
-            if result['success']:
-                total_synced += result['synced']
-                total_updated += result['updated']
-                total_deleted += result.get('deleted', 0)
-            else:
-                errors.append(f'{project.name}: {result["error"]}')
-        except Exception as e:
-            errors.append(f'{project.name}: {str(e)}')
+        result = results.get(project.id, {'success': False, 'error': 'Sync did not run'})
+        project.record_sync_result(result, sync_started_at)
+        project_results.append(dict(result, project_id=project.id, project_name=project.name))
+        
+        if result['success']:
+            total_synced += result['synced']
+            total_updated += result['updated']
+            total_deleted += result.get('deleted', 0)
+        else:
+            errors.append(f'{project.name}: {result["error"]}')
+    
+    db.session.commit()
     
     # Check if it's an AJAX request
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         if errors:
             return jsonify({
                 'success': False,
-                'error': f'Sync completed with errors. Synced: {total_synced}, Updated: {total_updated}, Deleted: {total_deleted}. Errors: {", ".join(errors)}'
+                'error': f'Sync completed with errors. Synced: {total_synced}, Updated: {total_updated}, Deleted: {total_deleted}. Errors: {", ".join(errors)}',
+                'projects': project_results,
+                'elapsed': elapsed
             })
         else:
             return jsonify({
@@ -3299,6 +3565,8 @@ def sync_all_projects():
                 'updated': total_updated,
                 'deleted': total_deleted,
                 'projects_count': len(projects),
+                'projects': project_results,
+                'elapsed': elapsed,
                 'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
             })
     else:
@@ -3309,3 +3577,31 @@ def sync_all_projects():
             flash(f'All projects synced successfully! {total_synced} new servers, {total_updated} updated, {total_deleted} deleted.', 'success')
         
         return redirect(url_for('hetzner_projects'))
+
+@app.route('/api/sync-status')
+@login_required
+def sync_status():
+    """Freshness of the last sync for each accessible project"""
+    if not (current_user.is_admin or current_user.is_technical_agent):
+        return jsonify({'success': False, 'error': 'Access denied. Technical Agent or Admin privileges required.'}), 403
+    
+    projects = current_user.get_accessible_projects()
+    return jsonify({
+        'success': True,
+        'background_sync': app.config['BACKGROUND_SYNC'],
+        'projects': [project.sync_freshness() for project in projects if project.is_active]
+    })
+
+@app.route('/api/hetzner-rate-limits')
+@login_required
+def hetzner_rate_limits():
+    """Rate limit state and throttle/retry counters of this worker's Hetzner clients"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'error': 'Access denied. Admin privileges required.'}), 403
+    
+    return jsonify({
+        'success': True,
+        'worker_pid': os.getpid(),
+        'tokens': rate_limit_stats()
+    })
+
@@ -0,0 +1,399 @@
+"""
+SFTP transfer engine
+Downloads large files (database backups) over an existing SSH connection
+with a wide channel window and pipelined read requests, resuming from a
+partially written local file and verifying a SHA-256 checksum at the end.
+Files can also be compressed on the server and streamed through an exec
+channel, which is much faster for compressible data such as MSSQL .bak files,
+or relayed from one server straight into another without touching local disk.
+Uploads arriving in a web request are streamed to a server the same way.
+"""
+
+import hashlib
+import logging
+import os
+import shlex
+import zlib
+
+import paramiko
+
+try:
+    import zstandard
+except ImportError:  # zstd transfers are only offered when the zstandard package is installed
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+SFTP_WINDOW_SIZE = 16 * 1024 * 1024  # bytes in flight per channel before the server waits for us
+SFTP_MAX_PACKET_SIZE = 32768  # paramiko never asks for more than this per SFTP read
+SFTP_MAX_REQUESTS = 256  # pipelined read requests, up to 8MB outstanding
+SFTP_READ_SIZE = 1024 * 1024  # bytes copied from the prefetch buffer to disk at a time
+RELAY_BUFFER_SIZE = 8 * 1024 * 1024  # bytes read ahead from the source while relaying to a target
+PART_SUFFIX = '.part'
+STREAM_READ_TIMEOUT = 120  # seconds without data before a compressed stream is considered stalled
+
+# Remote compressors in order of preference: tool, command, codec, suffix of a stored compressed file.
+# Levels favour speed; the link, not the ratio, is the bottleneck.
+COMPRESSORS = (
+    ('zstd', 'zstd -q -c -T0 -3', 'zstd', '.zst'),
+    ('pigz', 'pigz -c -1', 'gzip', '.gz'),
+    ('gzip', 'gzip -c -1', 'gzip', '.gz'),
+)
+
+
+def open_sftp(client):
+    """SFTP session on the client's transport with a window sized for fast, long links"""
+    return paramiko.SFTPClient.from_transport(client.get_transport(), window_size=SFTP_WINDOW_SIZE,
+                                              max_packet_size=SFTP_MAX_PACKET_SIZE)
+
+
+def start_remote_checksum(client, remote_path):
+    """Start sha256sum of remote_path on its own channel; returns a function that waits for the digest
+
+    Runs alongside the transfer, so hashing a large file on the server costs
+    no extra wall time. The function returns None if sha256sum is unavailable.
+    """
+    channel = client.get_transport().open_session(timeout=30)
+    channel.exec_command(f"sha256sum -- {shlex.quote(remote_path)}")
+
+    def result(timeout=600):
+        try:
+            channel.settimeout(timeout)
+            output = b''
+            while True:
+                data = channel.recv(4096)
+                if not data:
+                    break
+                output += data
+            if channel.recv_exit_status() != 0 or not output:
+                return None
+            return output.split()[0].decode()
+        except Exception as e:
+            logger.warning(f"Remote checksum of {remote_path} failed: {str(e)}")
+            return None
+        finally:
+            channel.close()
+
+    return result
+
+
+class DownloadState:
+    """Progress of one resumable download, carried across reconnects"""
+
+    def __init__(self, local_path):
+        self.local_path = local_path
+        self.part_path = local_path + PART_SUFFIX
+        self.hasher = hashlib.sha256()
+        self.offset = 0
+        self.resumed_from = 0
+        self.transferred = 0
+        self.wire_bytes = 0  # bytes received over SSH, smaller than transferred when compressed
+        self.remote_size = None
+        self.remote_mtime = None
+        self.remote_checksum = None
+
+        # Hash what an earlier, interrupted run left behind so the transfer can continue after it
+        if os.path.exists(self.part_path):
+            with open(self.part_path, 'rb') as part:
+                for block in iter(lambda: part.read(SFTP_READ_SIZE), b''):
+                    self.hasher.update(block)
+                    self.offset += len(block)
+            self.resumed_from = self.offset
+
+    def restart(self):
+        """Forget the partial file, e.g. because the remote file changed underneath it"""
+        self.hasher = hashlib.sha256()
+        self.offset = 0
+        self.resumed_from = 0
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+
+def _check_remote_file(sftp, remote_path, state):
+    """Record the remote size and mtime, starting over if the file changed since the last attempt"""
+    attributes = sftp.stat(remote_path)
+    if state.remote_size is not None and (attributes.st_size, attributes.st_mtime) != (state.remote_size, state.remote_mtime):
+        logger.warning(f"{remote_path} changed during download; starting over")
+        state.restart()
+        state.remote_checksum = None
+    if state.offset > attributes.st_size:
+        state.restart()
+    state.remote_size, state.remote_mtime = attributes.st_size, attributes.st_mtime
+
+
+def _decompressor(codec):
+    if codec == 'gzip':
+        return zlib.decompressobj(wbits=31)
+    if codec == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+class _BlockReader:
+    """Minimal file object over an iterator of byte blocks, for zstandard's stream_reader"""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while not self.buffer:
+            self.buffer = next(self.blocks, None)
+            if self.buffer is None:
+                self.buffer = b''
+                return b''
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def _decompress_blocks(codec, blocks, block_size=SFTP_READ_SIZE):
+    """Decompress an iterator of compressed blocks, yielding output blocks of at most block_size bytes"""
+    if codec == 'gzip':
+        decoder = _decompressor(codec)
+        for data in blocks:
+            while data:
+                block = decoder.decompress(data, block_size)
+                data = decoder.unconsumed_tail
+                if block:
+                    yield block
+        block = decoder.flush()
+        if block:
+            yield block
+    elif codec == 'zstd' and zstandard is not None:
+        reader = zstandard.ZstdDecompressor().stream_reader(_BlockReader(blocks), read_size=block_size,
+                                                           read_across_frames=True)
+        for block in iter(lambda: reader.read(block_size), b''):
+            yield block
+    else:
+        raise ValueError(f"Cannot decompress {codec} streams")
+
+
+def pick_compressor(client, preferred='auto'):
+    """The first entry of COMPRESSORS installed on the server that can be decoded here, or None
+
+    preferred is 'auto' or a codec name ('zstd', 'gzip').
+    """
+    candidates = [compressor for compressor in COMPRESSORS
+                  if preferred in ('auto', compressor[2]) and _decompressor(compressor[2]) is not None]
+    if not candidates:
+        return None
+
+    # command -v prints the path of each tool it finds
+    stdin, stdout, stderr = client.exec_command(f"command -v {' '.join(c[0] for c in candidates)}", timeout=30)
+    available = {os.path.basename(line.strip()) for line in stdout.read().decode().splitlines()}
+    return next((compressor for compressor in candidates if compressor[0] in available), None)
+
+
+def compressed_download_attempt(client, remote_path, state, compressor, verify=True, store_compressed=False,
+                                progress=None):
+    """Stream remote_path through a remote compressor into the part file
+
+    The data is decompressed as it arrives for the checksum and, unless
+    store_compressed, for the part file itself. Plain output resumes from
+    state.offset by compressing only the rest of the file; a stored
+    compressed file always starts over. progress is called with the state
+    after each block received.
+    """
+    tool, command, codec, _ = compressor
+
+    sftp = open_sftp(client)
+    try:
+        _check_remote_file(sftp, remote_path, state)
+    finally:
+        sftp.close()
+    if store_compressed:
+        state.restart()
+
+    checksum = start_remote_checksum(client, remote_path) if verify and state.remote_checksum is None else None
+
+    quoted_path = shlex.quote(remote_path)
+    if state.offset:
+        command = f"tail -c +{state.offset + 1} -- {quoted_path} | {command}"
+    else:
+        command = f"{command} -- {quoted_path}"
+
+    channel = client.get_transport().open_session(window_size=SFTP_WINDOW_SIZE, max_packet_size=SFTP_MAX_PACKET_SIZE,
+                                                  timeout=30)
+    try:
+        channel.settimeout(STREAM_READ_TIMEOUT)
+        channel.exec_command(command)
+
+        def wire_blocks():
+            while True:
+                data = channel.recv(SFTP_READ_SIZE)
+                if not data:
+                    return
+                state.wire_bytes += len(data)
+                if store_compressed:
+                    part.write(data)
+                yield data
+
+        with open(state.part_path, 'ab') as part:
+            part.truncate(state.offset)
+            # Inflated blocks are at most SFTP_READ_SIZE, so a highly compressible file cannot balloon memory
+            for block in _decompress_blocks(codec, wire_blocks()):
+                if not store_compressed:
+                    part.write(block)
+                state.hasher.update(block)
+                state.offset += len(block)
+                state.transferred += len(block)
+                if progress is not None:
+                    progress(state)
+
+        exit_status = channel.recv_exit_status()
+        if exit_status != 0 or state.offset != state.remote_size:
+            error_output = channel.recv_stderr(4096).decode(errors='replace').strip()
+            raise EOFError(f"{tool} stream of {remote_path} ended at byte {state.offset} of {state.remote_size} "
+                           f"(exit {exit_status}) {error_output}".strip())
+    finally:
+        channel.close()
+
+    if checksum is not None:
+        state.remote_checksum = checksum()
+
+
+def download_attempt(client, remote_path, state, verify=True, progress=None):
+    """Copy remote_path into the part file from state.offset on; raises on connection errors
+
+    Returns once every byte is on disk. The part file is truncated to the
+    hashed offset first, so a write torn by an earlier failure is redone.
+    progress is called with the state after each block written.
+    """
+    sftp = open_sftp(client)
+    try:
+        _check_remote_file(sftp, remote_path, state)
+        checksum = start_remote_checksum(client, remote_path) if verify and state.remote_checksum is None else None
+
+        with open(state.part_path, 'ab') as part:
+            part.truncate(state.offset)
+            with sftp.open(remote_path, 'rb') as remote:
+                remote.seek(state.offset)
+                remote.prefetch(state.remote_size, max_concurrent_requests=SFTP_MAX_REQUESTS)
+                while state.offset < state.remote_size:
+                    block = remote.read(min(SFTP_READ_SIZE, state.remote_size - state.offset))
+                    if not block:
+                        raise EOFError(f"Unexpected end of {remote_path} at byte {state.offset}")
+                    part.write(block)
+                    state.hasher.update(block)
+                    state.offset += len(block)
+                    state.transferred += len(block)
+                    state.wire_bytes += len(block)
+                    if progress is not None:
+                        progress(state)
+
+        if checksum is not None:
+            state.remote_checksum = checksum()
+    finally:
+        sftp.close()
+
+
+def finish_download(state, verify=True):
+    """Move a complete part file into place; returns an error message or None"""
+    local_checksum = state.hasher.hexdigest()
+    if verify and state.remote_checksum and state.remote_checksum != local_checksum:
+        state.restart()
+        return f"Checksum mismatch (remote {state.remote_checksum}, local {local_checksum})"
+    os.replace(state.part_path, state.local_path)
+    return None
+
+
+def relay_file(source_client, source_path, target_client, target_path, verify=True, expected_checksum=None):
+    """Copy source_path on one server to target_path on another through this process
+
+    Reads are pipelined in batches of RELAY_BUFFER_SIZE and writes are
+    pipelined too, so at most a batch plus the target's channel window is
+    held here. The data is hashed on the way through and compared with
+    expected_checksum if given (the checksum recorded when the file was
+    made, which also catches a source file replaced since), otherwise with
+    verify against sha256sum of the source file. Returns the size, the
+    SHA-256 and the checksum it was compared with (None if none); raises on
+    connection errors and on a checksum or size mismatch, removing the copy
+    on the target if it does not match.
+    """
+    source_sftp = open_sftp(source_client)
+    target_sftp = open_sftp(target_client)
+    try:
+        size = source_sftp.stat(source_path).st_size
+        checksum = start_remote_checksum(source_client, source_path) if verify and not expected_checksum else None
+        hasher = hashlib.sha256()
+
+        with source_sftp.open(source_path, 'rb') as reader, target_sftp.open(target_path, 'wb') as writer:
+            # Do not wait for each write to be acknowledged; errors surface on a later write or on close
+            writer.set_pipelined(True)
+            offset = 0
+            while offset < size:
+                # prefetch() would read ahead the whole file if the target is slower; readv stops at the batch
+                batch_end = min(offset + RELAY_BUFFER_SIZE, size)
+                blocks = [(start, min(SFTP_READ_SIZE, batch_end - start))
+                          for start in range(offset, batch_end, SFTP_READ_SIZE)]
+                for block in reader.readv(blocks, max_concurrent_prefetch_requests=SFTP_MAX_REQUESTS):
+                    if not block:
+                        raise EOFError(f"Unexpected end of {source_path} at byte {offset}")
+                    hasher.update(block)
+                    writer.write(block)
+                    offset += len(block)
+
+        written = target_sftp.stat(target_path).st_size
+        if written != size:
+            raise EOFError(f"{target_path} has {written} of {size} bytes after relay")
+
+        remote_checksum = expected_checksum or (checksum() if checksum is not None else None)
+        local_checksum = hasher.hexdigest()
+        if remote_checksum and remote_checksum != local_checksum:
+            target_sftp.remove(target_path)
+            raise ValueError(f"Checksum mismatch (expected {remote_checksum}, relayed {local_checksum})")
+        return size, local_checksum, remote_checksum
+    finally:
+        source_sftp.close()
+        target_sftp.close()
+
+
+def upload_stream(blocks, target_client, target_path, tee_path=None):
+    """Write an iterable of byte blocks to target_path on a server as they arrive
+
+    Writes are pipelined, so a block travels while the next one is read.
+    With tee_path every block is also written to that local file. The data is
+    hashed on the way through. Returns the size and the SHA-256; on any error,
+    including one raised by blocks, the partial target and tee files are
+    removed and the error is raised again.
+    """
+    sftp = open_sftp(target_client)
+    tee = open(tee_path, 'wb') if tee_path else None
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with sftp.open(target_path, 'wb') as writer:
+            # Do not wait for each write to be acknowledged; errors surface on a later write or on close
+            writer.set_pipelined(True)
+            for block in blocks:
+                hasher.update(block)
+                writer.write(block)
+                if tee:
+                    tee.write(block)
+                size += len(block)
+
+        written = sftp.stat(target_path).st_size
+        if written != size:
+            raise EOFError(f"{target_path} has {written} of {size} bytes after upload")
+        return size, hasher.hexdigest()
+    except BaseException:
+        try:
+            sftp.remove(target_path)
+        except Exception:
+            pass
+        if tee:
+            tee.close()
+            os.remove(tee_path)
+        raise
+    finally:
+        if tee:
+            tee.close()
+        sftp.close()
+
+
+def throughput(transferred, seconds):
+    """Megabytes per second, for logs and results"""
+    return round(transferred / 1024 / 1024 / seconds, 2) if seconds > 0 else None
+
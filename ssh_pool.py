@@ -0,0 +1,159 @@
+"""
+SSH connection pool
+Keeps one authenticated paramiko connection per (host, port, user, key
+fingerprint) open between SSHService calls, so multi-step operations pay for
+the TCP connect and SSH handshake once. Channels are multiplexed on the
+shared transport, so several threads can run commands on it at the same time.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+SSH_KEEPALIVE_INTERVAL = 30  # seconds between keepalive packets on idle transports
+SSH_IDLE_TIMEOUT = 300  # seconds an unused connection stays open
+SSH_HEALTH_CHECK_AFTER = 15  # seconds idle before a connection is probed on checkout
+
+
+class PooledConnection:
+    """An open SSHClient and how many callers are using it"""
+
+    def __init__(self, client):
+        self.client = client
+        self.users = 0
+        self.last_used = time.monotonic()
+
+    def is_healthy(self, probe=False):
+        """Whether the transport is still up; probe also writes to the socket"""
+        transport = self.client.get_transport()
+        if transport is None or not transport.is_active() or not transport.is_authenticated():
+            return False
+        if not probe:
+            return True
+        # The socket may have been dropped without the transport noticing yet
+        try:
+            transport.send_ignore()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+class SSHConnectionPool:
+    """Authenticated SSH connections shared across calls and threads"""
+
+    def __init__(self, idle_timeout=SSH_IDLE_TIMEOUT, keepalive_interval=SSH_KEEPALIVE_INTERVAL):
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.lock = threading.Lock()
+        self.connections = {}  # pool key -> PooledConnection
+        self.connect_locks = {}  # pool key -> Lock, so a host is only dialled once at a time
+        self.stats = {'connects': 0, 'reuses': 0, 'evicted': 0, 'broken': 0}
+
+    @contextmanager
+    def connection(self, key, connect_kwargs):
+        """Check out the SSHClient for key, connecting with connect_kwargs if needed"""
+        connection = self.checkout(key, connect_kwargs)
+        failed = False
+        try:
+            yield connection.client
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.release(key, connection, failed)
+
+    def release(self, key, connection, failed=False):
+        """Return a checked-out connection; one that failed in use is dropped if broken"""
+        with self.lock:
+            connection.users -= 1
+            connection.last_used = time.monotonic()
+        if failed and not connection.is_healthy(probe=True):
+            self._discard(key, connection)
+
+    def checkout(self, key, connect_kwargs):
+        """Reserve the connection for key, reusing a healthy one or connecting anew"""
+        self.evict_idle()
+
+        with self.lock:
+            connect_lock = self.connect_locks.setdefault(key, threading.Lock())
+
+        with connect_lock:
+            now = time.monotonic()
+            with self.lock:
+                connection = self.connections.get(key)
+                if connection is not None and connection.users:
+                    # Busy connections were healthy a moment ago; share the transport
+                    connection.users += 1
+                    self.stats['reuses'] += 1
+                    return connection
+
+            if connection is not None:
+                if connection.is_healthy(probe=now - connection.last_used >= SSH_HEALTH_CHECK_AFTER):
+                    with self.lock:
+                        connection.users += 1
+                        self.stats['reuses'] += 1
+                    return connection
+                self._discard(key, connection)
+
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(**connect_kwargs)
+            client.get_transport().set_keepalive(self.keepalive_interval)
+
+            connection = PooledConnection(client)
+            connection.users = 1
+            with self.lock:
+                self.connections[key] = connection
+                self.stats['connects'] += 1
+            logger.debug(f"Opened pooled SSH connection to {key[0]}:{key[1]} as {key[2]}")
+            return connection
+
+    def _discard(self, key, connection):
+        with self.lock:
+            if self.connections.get(key) is connection:
+                del self.connections[key]
+                self.stats['broken'] += 1
+        connection.close()
+
+    def evict_idle(self):
+        """Close connections nobody has used for idle_timeout seconds"""
+        now = time.monotonic()
+        with self.lock:
+            expired = [(key, connection) for key, connection in self.connections.items()
+                       if not connection.users and now - connection.last_used > self.idle_timeout]
+            for key, _ in expired:
+                del self.connections[key]
+            self.stats['evicted'] += len(expired)
+
+        for _, connection in expired:
+            connection.close()
+        return len(expired)
+
+    def close_all(self):
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+
+        for connection in connections:
+            connection.close()
+
+    def pool_stats(self):
+        with self.lock:
+            return dict(self.stats, open=len(self.connections),
+                        in_use=sum(1 for connection in self.connections.values() if connection.users))
+
+
+ssh_pool = SSHConnectionPool()
+atexit.register(ssh_pool.close_all)
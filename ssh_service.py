@@ -4,13 +4,48 @@ Handles SSH connections and remote script execution on servers
 """
 
 import paramiko
+import codecs
+import hashlib
 import io
 import logging
+import re
+import select
+import shlex
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
 from datetime import datetime
 from contextlib import contextmanager
+from types import SimpleNamespace
+
+from sqlalchemy import event, inspect as sa_inspect
+
+from models import HetznerProject
+from ssh_pool import ssh_pool
+from sftp_transfer import (DownloadState, compressed_download_attempt, download_attempt, finish_download, pick_compressor,
+                           relay_file, throughput)
 
 logger = logging.getLogger(__name__)
 
+# paramiko key classes tried in order when loading a project's private key
+SSH_KEY_TYPES = ('RSAKey', 'DSSKey', 'ECDSAKey', 'Ed25519Key')
+
+STREAM_CHUNK_SIZE = 32768  # bytes read from a channel at a time
+STREAM_POLL_INTERVAL = 1.0  # seconds to wait for output before checking the timeout
+
+FANOUT_MAX_WORKERS = 20  # hosts a fleet command runs on at the same time
+FANOUT_TIMEOUT = 60  # seconds per host
+FANOUT_DEADLINE = 100  # seconds a whole fan-out may take, inside gunicorn's 120s worker timeout
+FANOUT_OUTPUT_LIMIT = 16 * 1024  # characters of output kept per host and stream
+
+STEP_MARKER = '@@step'  # prefix of the lines run_steps uses to split a batch's output per step
+
+SFTP_MAX_RETRIES = 5  # reconnects per download before giving up; the .part file is kept
+SFTP_RETRY_DELAY = 2  # seconds before the first reconnect, doubling after each
+
 class SSHService:
     def __init__(self):
         self.client = None
@@ -96,30 +131,308 @@ class SSHService:
             logger.error(f"Error executing command on {server.name}: {str(e)}")
             return False, "", f"Command execution error: {str(e)}"
     
-    def download_file(self, server, remote_path, local_path):
-        """Download a file from remote server to local system using SFTP"""
-        try:
-            with self._get_ssh_client(server) as client:
-                if not client:
-                    logger.error(f"Failed to establish SSH connection to {server.name}")
-                    return False
-                
-                # Create SFTP client
-                sftp = client.open_sftp()
-                
-                # Download the file
-                sftp.get(remote_path, local_path)
-                sftp.close()
+    def stream_command(self, server, command, timeout=300):
+        """Run a command and yield its output as it arrives
+        
+        Yields ('stdout', text) and ('stderr', text) chunks, then a final
+        ('exit', exit_code). At most STREAM_CHUNK_SIZE bytes are held per
+        read, however much the command prints.
+        """
+        with self._get_ssh_client(server) as client:
+            if not client:
+                raise paramiko.SSHException(f"Failed to establish SSH connection to {server.name}")
+            
+            channel = client.get_transport().open_session(timeout=30)
+            try:
+                channel.exec_command(command)
+                decoders = {
+                    'stdout': codecs.getincrementaldecoder('utf-8')(errors='replace'),
+                    'stderr': codecs.getincrementaldecoder('utf-8')(errors='replace')
+                }
+                deadline = time.monotonic() + timeout
                 
-                logger.info(f"Successfully downloaded {remote_path} from {server.name} to {local_path}")
-                return True
+                while True:
+                    # Checked on every pass: a command that never stops printing must still time out
+                    if time.monotonic() > deadline:
+                        raise socket.timeout(f"Command timed out after {timeout} seconds")
+                    
+                    received = False
+                    if channel.recv_ready():
+                        received = True
+                        yield 'stdout', decoders['stdout'].decode(channel.recv(STREAM_CHUNK_SIZE))
+                    if channel.recv_stderr_ready():
+                        received = True
+                        yield 'stderr', decoders['stderr'].decode(channel.recv_stderr(STREAM_CHUNK_SIZE))
+                    if received:
+                        continue
+                    
+                    if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                        break
+                    # The channel's pipe becomes readable when either stream has data or the command exits
+                    select.select([channel], [], [], STREAM_POLL_INTERVAL)
                 
-        except paramiko.SSHException as e:
-            logger.error(f"SSH error downloading file from {server.name}: {str(e)}")
-            return False
+                for stream, decoder in decoders.items():
+                    yield stream, decoder.decode(b'', final=True)
+                yield 'exit', channel.recv_exit_status()
+            finally:
+                channel.close()
+    
+    def execute_command_streaming(self, server, command, output_log, timeout=300):
+        """Execute a command, appending its output to a CommandLog as it runs
+        
+        Returns (success, exit_code); connection errors and timeouts are
+        written to the log's stderr and return exit code None.
+        """
+        exit_code = None
+        try:
+            for stream, data in self.stream_command(server, command, timeout=timeout):
+                if stream == 'exit':
+                    exit_code = data
+                else:
+                    output_log.write(stream, data)
+        except Exception as e:
+            logger.error(f"Error streaming command on {server.name}: {str(e)}")
+            output_log.write('stderr', f"Command execution error: {str(e)}")
+        finally:
+            output_log.flush()
+        
+        return exit_code == 0, exit_code
+    
+    def fan_out_command(self, servers, command, max_workers=FANOUT_MAX_WORKERS, timeout=FANOUT_TIMEOUT,
+                        deadline=None):
+        """Run one command on many servers concurrently, yielding each host's result as it finishes
+        
+        Connection details are copied from the HetznerServer rows up front, so
+        worker threads never touch the database session. timeout applies per
+        host; output is truncated to the last FANOUT_OUTPUT_LIMIT characters.
+        With deadline, hosts that have not finished after that many seconds in
+        total are reported as failed and the fan-out ends.
+        """
+        # Detach now: the results are consumed lazily, possibly after the session is gone
+        targets = [_detach_server(server) for server in servers]
+        return self._fan_out(targets, command, max_workers, timeout, deadline)
+    
+    def _fan_out(self, targets, command, max_workers, timeout, deadline=None):
+        if not targets:
+            return
+        
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(targets)), thread_name_prefix='ssh-fanout')
+        try:
+            futures = {executor.submit(self._run_on_target, target, command, timeout): target for target in targets}
+            finished = set()
+            try:
+                for future in as_completed(futures, timeout=deadline):
+                    finished.add(future)
+                    yield future.result()
+            except FuturesTimeoutError:
+                for future, target in futures.items():
+                    if future not in finished:
+                        yield {'server_id': target.id, 'server_name': target.name, 'success': False, 'exit_code': None,
+                               'output': '', 'error_output': '', 'duration': deadline,
+                               'error': f'Did not finish within the {deadline}s limit of the whole run'}
+        finally:
+            # A client that stops reading should not leave queued hosts running
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _run_on_target(self, target, command, timeout):
+        started = time.monotonic()
+        result = {'server_id': target.id, 'server_name': target.name, 'success': False, 'exit_code': None,
+                  'output': '', 'error_output': ''}
+        try:
+            for stream, data in self.stream_command(target, command, timeout=timeout):
+                if stream == 'exit':
+                    result['exit_code'] = data
+                    result['success'] = data == 0
+                else:
+                    key = 'output' if stream == 'stdout' else 'error_output'
+                    result[key] = (result[key] + data)[-FANOUT_OUTPUT_LIMIT:]
+        except Exception as e:
+            result['error'] = str(e) or e.__class__.__name__
+        result['duration'] = round(time.monotonic() - started, 2)
+        return result
+    
+    def run_steps(self, server, steps, stop_on_error=True, timeout=300):
+        """Run an ordered list of commands as one remote script over a single channel
+        
+        Each step runs in its own subshell with no stdin, so steps behave like
+        separate exec_command calls but cost one round trip in total. With
+        stop_on_error, the first failing step ends the batch and the rest are
+        marked skipped. timeout applies to the whole batch.
+        
+        Returns success, steps (command, exit_code, output, error_output,
+        duration, skipped per step), failed_step (index or None), duration
+        and error.
+        """
+        marker = f"{STEP_MARKER}-{uuid.uuid4().hex}"
+        script = _steps_script(steps, marker, stop_on_error)
+        output, error_output = [], []
+        started = time.monotonic()
+        error = None
+        
+        try:
+            for stream, data in self.stream_command(server, f"bash -c {shlex.quote(script)}", timeout=timeout):
+                if stream == 'stdout':
+                    output.append(data)
+                elif stream == 'stderr':
+                    error_output.append(data)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            logger.error(f"Error running {len(steps)} steps on {server.name}: {error}")
+        
+        results = _parse_steps(steps, marker, ''.join(output), ''.join(error_output))
+        failed_step = next((index for index, result in enumerate(results)
+                            if result['exit_code'] not in (0, None)), None)
+        if error is None and failed_step is not None:
+            failed = results[failed_step]
+            error = f"Step {failed_step + 1} ({failed['command']}) exited with {failed['exit_code']}: " \
+                    f"{failed['error_output'].strip() or failed['output'].strip()}".rstrip(': ')
+        elif error is None and any(result['exit_code'] is None for result in results):
+            error = "Batch ended before every step ran"
+        
+        return {
+            'success': error is None,
+            'steps': results,
+            'failed_step': failed_step,
+            'duration': round(time.monotonic() - started, 2),
+            'error': error
+        }
+    
+    def download_file(self, server, remote_path, local_path, compression='none'):
+        """Download a file from remote server to local system using SFTP"""
+        result = self.download_file_resumable(server, remote_path, local_path, compression=compression)
+        return result['success']
+    
+    def download_file_resumable(self, server, remote_path, local_path, verify=True, max_retries=SFTP_MAX_RETRIES,
+                                compression='none', store_compressed=False, progress=None):
+        """Download a large file with pipelined SFTP reads, resuming after disconnects
+        
+        Data goes to local_path + '.part' first; a later call for the same
+        file continues where it stopped. With verify, the result is checked
+        against sha256sum run on the server.
+        
+        compression 'auto', 'zstd' or 'gzip' compresses on the server and
+        streams through an exec channel instead, falling back to plain SFTP
+        when no usable compressor is installed there. store_compressed keeps
+        the compressed stream, saved as local_path plus '.zst' or '.gz'.
+        
+        progress, if given, is called with the DownloadState (offset,
+        remote_size) after each block; an exception it raises aborts the
+        download and propagates, leaving the .part file for a later call.
+        
+        Returns success, path, bytes, resumed_from, transferred, wire_bytes,
+        compression, retries, seconds, throughput_mbps, sha256 and error.
+        """
+        compressor = None
+        if compression != 'none':
+            try:
+                with self._get_ssh_client(server) as client:
+                    compressor = pick_compressor(client, compression) if client else None
+            except Exception as e:
+                logger.warning(f"Could not probe compressors on {server.name}: {str(e)}")
+            if compressor is None:
+                logger.info(f"No usable {compression} compressor on {server.name}; downloading {remote_path} over plain SFTP")
+        
+        if compressor and store_compressed:
+            local_path += compressor[3]
+        state = DownloadState(local_path)
+        started = time.monotonic()
+        retries = 0
+        error = None
+        
+        while True:
+            try:
+                with self._get_ssh_client(server) as client:
+                    if not client:
+                        raise paramiko.SSHException(f"Failed to establish SSH connection to {server.name}")
+                    if compressor:
+                        compressed_download_attempt(client, remote_path, state, compressor, verify=verify,
+                                                    store_compressed=store_compressed, progress=progress)
+                    else:
+                        download_attempt(client, remote_path, state, verify=verify, progress=progress)
+                error = finish_download(state, verify=verify)
+                if error is None:
+                    break
+            except (FileNotFoundError, PermissionError) as e:
+                # Reconnecting will not make the remote file appear
+                error = str(e)
+                break
+            except (paramiko.SSHException, EOFError, OSError) as e:
+                error = str(e) or e.__class__.__name__
+            
+            if retries >= max_retries:
+                break
+            retries += 1
+            delay = min(SFTP_RETRY_DELAY * 2 ** (retries - 1), 30)
+            logger.warning(f"Download of {remote_path} from {server.name} interrupted at byte {state.offset} "
+                           f"({error}); retry {retries}/{max_retries} in {delay}s")
+            time.sleep(delay)
+        
+        seconds = time.monotonic() - started
+        result = {
+            'success': error is None,
+            'path': local_path,
+            'bytes': state.remote_size,
+            'resumed_from': state.resumed_from,
+            'transferred': state.transferred,
+            'wire_bytes': state.wire_bytes,
+            'compression': compressor[0] if compressor else None,
+            'retries': retries,
+            'seconds': round(seconds, 2),
+            'throughput_mbps': throughput(state.transferred, seconds),
+            'sha256': state.hasher.hexdigest() if error is None else None,
+            'verified': error is None and bool(state.remote_checksum),
+            'error': error
+        }
+        
+        if result['success']:
+            logger.info(f"Downloaded {remote_path} from {server.name} to {local_path}: {state.transferred:,} bytes "
+                        f"({state.wire_bytes:,} on the wire{' via ' + compressor[0] if compressor else ''}) "
+                        f"in {result['seconds']}s ({result['throughput_mbps']} MB/s, {retries} retries)")
+        else:
+            logger.error(f"Error downloading {remote_path} from {server.name}: {error}")
+        return result
+    
+    def relay_file(self, source_server, source_path, target_server, target_path, verify=True, expected_checksum=None):
+        """Stream a file from one server into another without staging it on this machine
+        
+        Only a few megabytes are buffered here at a time. The relayed bytes
+        are checked against expected_checksum if given, otherwise (with
+        verify) against sha256sum of the source file.
+        
+        Returns success, bytes, seconds, throughput_mbps, sha256, verified and error.
+        """
+        started = time.monotonic()
+        size, checksum, remote_checksum, error = None, None, None, None
+        
+        try:
+            with self._get_ssh_client(source_server) as source_client, \
+                    self._get_ssh_client(target_server) as target_client:
+                if not source_client:
+                    raise paramiko.SSHException(f"Failed to establish SSH connection to {source_server.name}")
+                if not target_client:
+                    raise paramiko.SSHException(f"Failed to establish SSH connection to {target_server.name}")
+                size, checksum, remote_checksum = relay_file(source_client, source_path, target_client, target_path,
+                                                             verify=verify, expected_checksum=expected_checksum)
         except Exception as e:
-            logger.error(f"Unexpected error downloading file from {server.name}: {str(e)}")
-            return False
+            error = str(e) or e.__class__.__name__
+        
+        seconds = time.monotonic() - started
+        result = {
+            'success': error is None,
+            'bytes': size,
+            'seconds': round(seconds, 2),
+            'throughput_mbps': throughput(size, seconds) if size else None,
+            'sha256': checksum,
+            'verified': error is None and bool(remote_checksum),
+            'error': error
+        }
+        
+        if result['success']:
+            logger.info(f"Relayed {source_server.name}:{source_path} to {target_server.name}:{target_path}: "
+                        f"{size:,} bytes in {result['seconds']}s ({result['throughput_mbps']} MB/s)")
+        else:
+            logger.error(f"Error relaying {source_path} from {source_server.name} to {target_server.name}: {error}")
+        return result
     
     def get_latest_backup_file(self, server, backup_dir="/home/dynamic/nova-hr-docker/mssql/backup/"):
         """Get the latest backup file from the remote backup directory"""
@@ -148,83 +461,184 @@ class SSHService:
     
     @contextmanager
     def _get_ssh_client(self, server):
-        """Create and configure SSH client for a server"""
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        """Check out a pooled SSH client for a server, or None if it cannot connect
         
+        Connections are shared per host, port, user and key (see ssh_pool.py),
+        so consecutive calls for the same server reuse one SSH session.
+        """
         try:
             # Configure connection parameters using project SSH settings
             project = server.project
             if not project:
                 yield None
                 return
-                
-            connect_kwargs = {
-                'hostname': server.public_ip,
-                'port': project.ssh_port or 22,
-                'username': project.ssh_username or 'root',
-                'timeout': 30
-            }
             
             # Use private key from project if available
-            if project.ssh_private_key:
-                try:
-                    key_file = io.StringIO(project.ssh_private_key)
-                    private_key = paramiko.RSAKey.from_private_key(
-                        key_file, 
-                        password=project.ssh_key_passphrase
-                    )
-                    connect_kwargs['pkey'] = private_key
-                except Exception as key_error:
-                    # Try DSA key if RSA fails
-                    try:
-                        key_file = io.StringIO(project.ssh_private_key)
-                        private_key = paramiko.DSSKey.from_private_key(
-                            key_file, 
-                            password=project.ssh_key_passphrase
-                        )
-                        connect_kwargs['pkey'] = private_key
-                    except Exception:
-                        # Try ECDSA key
-                        try:
-                            key_file = io.StringIO(project.ssh_private_key)
-                            private_key = paramiko.ECDSAKey.from_private_key(
-                                key_file, 
-                                password=project.ssh_key_passphrase
-                            )
-                            connect_kwargs['pkey'] = private_key
-                        except Exception:
-                            # Try Ed25519 key
-                            try:
-                                key_file = io.StringIO(project.ssh_private_key)
-                                private_key = paramiko.Ed25519Key.from_private_key(
-                                    key_file, 
-                                    password=project.ssh_key_passphrase
-                                )
-                                connect_kwargs['pkey'] = private_key
-                            except Exception as final_error:
-                                logger.error(f"Could not load SSH key for {server.name}: {final_error}")
-                                yield None
-                                return
-            else:
+            if not project.ssh_private_key:
                 # No private key provided - this might fail for most servers
                 logger.warning(f"No SSH private key configured for server {server.name}")
                 # Could try password authentication here if implemented
                 yield None
                 return
             
-            # Connect to the server
-            client.connect(**connect_kwargs)
-            yield client
+            private_key = self._load_private_key(project, server)
+            if private_key is None:
+                yield None
+                return
+            
+            connect_kwargs = {
+                'hostname': server.public_ip,
+                'port': project.ssh_port or 22,
+                'username': project.ssh_username or 'root',
+                'pkey': private_key,
+                'timeout': 30
+            }
+            pool_key = (connect_kwargs['hostname'], connect_kwargs['port'], connect_kwargs['username'],
+                        private_key.get_fingerprint().hex())
             
+            connection = ssh_pool.checkout(pool_key, connect_kwargs)
         except Exception as e:
             logger.error(f"SSH connection failed for {server.name}: {str(e)}")
             yield None
+            return
+        
+        # Errors inside the with block belong to the caller; the pool only
+        # needs to know about them to drop a broken connection
+        failed = False
+        try:
+            yield connection.client
+        except Exception:
+            failed = True
+            raise
         finally:
-            try:
-                client.close()
-            except:
-                pass
+            ssh_pool.release(pool_key, connection, failed)
+    
+    def _load_private_key(self, project, server):
+        """Parsed private key of the project, from the key cache when it is unchanged"""
+        key_hash = _key_material_hash(project.ssh_private_key, project.ssh_key_passphrase)
+        with _private_keys_lock:
+            cached = _private_keys.get(project.id)
+        if cached and cached[0] == key_hash:
+            _, _, private_key, error = cached
+        else:
+            # Remember failures too, so a wrong passphrase does not rerun the KDF on every call
+            key_type, private_key, error = _parse_private_key(project.ssh_private_key, project.ssh_key_passphrase)
+            with _private_keys_lock:
+                _private_keys[project.id] = (key_hash, key_type, private_key, error)
+            if private_key is not None:
+                logger.debug(f"Loaded {key_type} SSH key for project {project.id}")
+        
+        if private_key is None:
+            logger.error(f"Could not load SSH key for {server.name}: {error}")
+        return private_key
+
+def _detach_server(server):
+    """Copy the fields SSH connections use off a HetznerServer row"""
+    project = server.project
+    return SimpleNamespace(
+        id=server.id,
+        name=server.name,
+        public_ip=server.public_ip,
+        project=project and SimpleNamespace(
+            id=project.id,
+            ssh_username=project.ssh_username,
+            ssh_port=project.ssh_port,
+            ssh_private_key=project.ssh_private_key,
+            ssh_key_passphrase=project.ssh_key_passphrase
+        )
+    )
+
+def summarize_fan_out(results, elapsed=None):
+    """Aggregate fan_out_command results: counts, exit codes and failed hosts"""
+    exit_codes = Counter(str(result['exit_code']) for result in results if result['exit_code'] is not None)
+    failed = [result['server_name'] or result['server_id'] for result in results if not result['success']]
+    return {
+        'total': len(results),
+        'succeeded': len(results) - len(failed),
+        'failed': len(failed),
+        'unreachable': sum(1 for result in results if result['exit_code'] is None),
+        'exit_codes': dict(exit_codes),
+        'failed_servers': failed,
+        'elapsed': round(elapsed, 2) if elapsed is not None else None
+    }
+
+def _steps_script(steps, marker, stop_on_error):
+    """Shell script running each step in a subshell between marker lines on stdout and stderr"""
+    lines = []
+    for index, command in enumerate(steps):
+        lines += [
+            f"echo '{marker} {index}'; echo '{marker} {index}' >&2",
+            "started=$(date +%s%N)",
+            # The newline lets a step end in a comment
+            f"( {command}\n) </dev/null",
+            "status=$?",
+            f"printf '\\n{marker} end {index} %s %s %s\\n' \"$status\" \"$started\" \"$(date +%s%N)\"",
+            f"printf '\\n{marker} end {index}\\n' >&2",
+        ]
+        if stop_on_error:
+            lines.append('[ "$status" -eq 0 ] || exit "$status"')
+    return '\n'.join(lines) + '\n'
+
+def _parse_steps(steps, marker, output, error_output):
+    """Split a batch's stdout and stderr back into per-step results"""
+    quoted = re.escape(marker)
+    finished = {
+        int(match.group(1)): match
+        for match in re.finditer(rf"^{quoted} (\d+)\n(.*?)\n{quoted} end \1 (\d+) (\d+) (\d+)$", output, re.S | re.M)
+    }
+    started = {int(index) for index in re.findall(rf"^{quoted} (\d+)$", output, re.M)}
+    errors = {
+        int(match.group(1)): match.group(2)
+        for match in re.finditer(rf"^{quoted} (\d+)\n(.*?)\n{quoted} end \1$", error_output, re.S | re.M)
+    }
+    
+    results = []
+    for index, command in enumerate(steps):
+        match = finished.get(index)
+        results.append({
+            'command': command,
+            'exit_code': int(match.group(3)) if match else None,
+            'output': match.group(2) if match else '',
+            'error_output': errors.get(index, ''),
+            # date +%s%N gives nanoseconds
+            'duration': round((int(match.group(5)) - int(match.group(4))) / 1e9, 3) if match else None,
+            'skipped': index not in started
+        })
+    return results
+
+_private_keys = {}  # project id -> (key material hash, key type, parsed key or None, parse error)
+_private_keys_lock = threading.Lock()
+
+def _key_material_hash(private_key, passphrase):
+    return hashlib.sha256(f"{private_key}\0{passphrase or ''}".encode()).hexdigest()
+
+def _parse_private_key(private_key, passphrase):
+    """Try each supported key type; returns (key type, key, None) or (None, None, error)"""
+    final_error = None
+    for key_type in SSH_KEY_TYPES:
+        key_class = getattr(paramiko, key_type, None)
+        if key_class is None:
+            continue
+        try:
+            return key_type, key_class.from_private_key(io.StringIO(private_key), password=passphrase), None
+        except Exception as key_error:
+            final_error = key_error
+    return None, None, str(final_error)
+
+def forget_private_key(project_id):
+    """Drop a project's cached key so the next connection parses it again"""
+    with _private_keys_lock:
+        _private_keys.pop(project_id, None)
+
+@event.listens_for(HetznerProject, 'after_update')
+def _project_ssh_key_changed(mapper, connection, target):
+    state = sa_inspect(target)
+    if state.attrs.ssh_private_key.history.has_changes() or state.attrs.ssh_key_passphrase.history.has_changes():
+        forget_private_key(target.id)
+
+@event.listens_for(HetznerProject, 'after_delete')
+def _project_deleted(mapper, connection, target):
+    forget_private_key(target.id)
 
 def get_default_deploy_script():
     """Returns the command to execute the Nova HR Docker deployment script"""
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Background Hetzner Sync Worker
+==============================
+
+Keeps the local server table warm by syncing every active Hetzner project on
+its own interval (HetznerProject.sync_interval_minutes). Sync routes only
+queue a sync by setting sync_requested_at; this worker picks it up on its
+next poll and records a per-project watermark in last_synced_at. After a
+successful sync it also refreshes the project's expired catalog cache entries.
+Every poll also advances server requests waiting on a Hetzner create action
+(see action_tracker.py), and every METRICS_COLLECT_INTERVAL seconds, after
+the due syncs, the worker collects server metrics for as much of the fleet as
+its share of each project's API budget allows (see metrics_store.py).
+
+Usage:
+    python sync_worker.py                 # run until stopped
+    python sync_worker.py --once          # sync due projects once and exit
+    python sync_worker.py --poll 30       # check for due projects every 30s
+
+Requirements:
+    - Same environment as the web app (DATABASE_URL, SESSION_SECRET)
+    - Run exactly one worker per database
+"""
+
+import argparse
+import logging
+import signal
+import threading
+import time
+from datetime import datetime
+
+from app import app, db
+from models import HetznerProject
+from hetzner_service import HetznerService, sync_projects
+from action_tracker import track_server_actions
+from metrics_store import collect_metrics, prune_metrics
+
+logger = logging.getLogger('sync_worker')
+
+stop_event = threading.Event()
+
+last_metrics_collection = None  # time.monotonic() of the last metrics collection
+
+
+def refresh_project_catalogs(project):
+    """Keep the project's image/server type/location catalog cache warm"""
+    try:
+        refreshed = HetznerService(project_id=project.id).refresh_catalogs()
+        if refreshed:
+            logger.info(f"{project.name}: refreshed catalogs {', '.join(refreshed)}")
+    except Exception as e:
+        logger.warning(f"{project.name}: catalog refresh failed - {str(e)}")
+
+
+def track_actions():
+    """Advance server requests whose Hetzner create action has moved on"""
+    try:
+        summary = track_server_actions()
+        if summary['completed'] or summary['failed']:
+            logger.info(f"Server actions: {summary['completed']} completed, {summary['failed']} failed, "
+                        f"{summary['running']} running")
+    except Exception as e:
+        logger.error(f"Server action tracking failed: {str(e)}")
+        db.session.rollback()
+
+
+def collect_fleet_metrics():
+    """Collect metrics for all active projects when METRICS_COLLECT_INTERVAL has passed"""
+    global last_metrics_collection
+    
+    interval = app.config['METRICS_COLLECT_INTERVAL']
+    if interval <= 0:
+        return
+    if last_metrics_collection is not None and time.monotonic() - last_metrics_collection < interval:
+        return
+    last_metrics_collection = time.monotonic()
+    
+    try:
+        project_ids = [project.id for project in HetznerProject.query.filter_by(is_active=True).all()]
+        results = collect_metrics(project_ids)
+        pruned = prune_metrics()
+        logger.info(f"Metrics: {sum(r['samples'] for r in results.values())} samples from "
+                    f"{sum(r['servers'] for r in results.values())} servers "
+                    f"({sum(r['skipped'] for r in results.values())} left for the next runs), {pruned} expired blocks pruned")
+    except Exception as e:
+        logger.error(f"Metrics collection failed: {str(e)}")
+        db.session.rollback()
+
+
+def run_once():
+    """Sync every project that is due and record the results
+    
+    Metrics are collected after the syncs, so a large fleet never delays them.
+    """
+    track_actions()
+    
+    now = datetime.utcnow()
+    due_projects = [project for project in HetznerProject.query.filter_by(is_active=True).all()
+                    if project.is_sync_due(now)]
+    
+    results = {}
+    if due_projects:
+        logger.info(f"Syncing {len(due_projects)} due project(s): {', '.join(p.name for p in due_projects)}")
+        
+        started_at = datetime.utcnow()
+        results = sync_projects([project.id for project in due_projects])
+        
+        for project in due_projects:
+            result = results.get(project.id, {'success': False, 'error': 'Sync did not run'})
+            project.record_sync_result(result, started_at)
+            
+            if result['success']:
+                logger.info(f"{project.name}: {result['synced']} new, {result['updated']} updated, "
+                            f"{result.get('deleted', 0)} deleted ({result.get('queries')} queries)")
+                refresh_project_catalogs(project)
+            else:
+                logger.warning(f"{project.name}: sync failed - {result['error']}")
+        
+        db.session.commit()
+    
+    collect_fleet_metrics()
+    return results
+
+
+def run_forever(poll_seconds):
+    """Poll for due projects until SIGTERM/SIGINT"""
+    logger.info(f"Sync worker started (poll every {poll_seconds}s)")
+    
+    while not stop_event.is_set():
+        with app.app_context():
+            try:
+                run_once()
+            except Exception as e:
+                logger.error(f"Sync worker iteration failed: {str(e)}")
+                db.session.rollback()
+        stop_event.wait(poll_seconds)
+    
+    logger.info("Sync worker stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Background Hetzner server sync worker')
+    parser.add_argument('--once', action='store_true',
+                       help='Sync due projects once and exit')
+    parser.add_argument('--poll', type=int, default=15,
+                       help='Seconds between checks for due projects (default: 15)')
+    
+    args = parser.parse_args()
+    
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    
+    if args.once:
+        with app.app_context():
+            run_once()
+        return
+    
+    run_forever(args.poll)
+
+
+if __name__ == '__main__':
+    main()
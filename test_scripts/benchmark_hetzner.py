@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Hetzner Sync/Provisioning Benchmark
+===================================
+
+Runs HetznerService against test_scripts/fake_hetzner_api.py with a seeded
+fleet of 100, 1k and 10k servers and reports wall time, SQL statements,
+peak Python memory and API calls for each scenario:
+
+    sync-initial      first sync of an empty server table
+    sync-unchanged    resync with nothing changed remotely
+    sync-1pct         resync after 1% of the servers changed status
+    create-server     create_server, waiting for the create action
+    sync-projects     sync_projects() across three projects of the same size
+
+Usage:
+    python test_scripts/benchmark_hetzner.py
+    python test_scripts/benchmark_hetzner.py --sizes 100 1000 --latency 0.05
+    python test_scripts/benchmark_hetzner.py --output bench.jsonl   # append results for comparison
+
+The benchmark uses its own SQLite database and never talks to the real
+Hetzner API. It empties the server table and overwrites project tokens, so
+--database only accepts a SQLite file in the temporary directory unless
+--i-know-this-wipes-data is given. create_server waits at least one hcloud poll interval
+(1s) per server, so keep --creates small.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import requests
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+PROJECT_COUNT = 3
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_api(port, args):
+    """Run the fake API in its own process so it stays out of the memory numbers"""
+    process = subprocess.Popen([
+        sys.executable, os.path.join(SCRIPT_DIR, 'fake_hetzner_api.py'),
+        '--port', str(port),
+        '--latency', str(args.latency),
+        '--rate-limit', str(args.rate_limit),
+        '--error-rate', str(args.error_rate),
+        '--rate-limit-error-rate', str(args.rate_limit_error_rate),
+        '--action-duration', str(args.action_duration)
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    control_url = f'http://127.0.0.1:{port}/_fake'
+    for _ in range(100):
+        try:
+            requests.get(f'{control_url}/stats', timeout=1)
+            return process, control_url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('Fake Hetzner API did not start')
+
+
+class Measurement:
+    """Wall time, SQL statements from every thread, peak traced memory and API calls"""
+
+    def __init__(self, engine, control_url):
+        self.engine = engine
+        self.control_url = control_url
+        self.queries = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.queries += 1
+
+    def _api_requests(self):
+        return requests.get(f'{self.control_url}/stats', timeout=10).json()['requests']
+
+    def __enter__(self):
+        from sqlalchemy import event
+        self.api_before = self._api_requests()
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        tracemalloc.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        from sqlalchemy import event
+        self.wall = time.perf_counter() - self.started
+        _, self.peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+        self.api_calls = self._api_requests() - self.api_before
+        return False
+
+
+def run_scenario(name, size, control_url, func, report):
+    from app import db
+
+    with Measurement(db.engine, control_url) as measurement:
+        result = func()
+
+    row = {
+        'scenario': name,
+        'servers': size,
+        'wall_seconds': round(measurement.wall, 3),
+        'queries': measurement.queries,
+        'peak_memory_kb': measurement.peak_memory // 1024,
+        'api_calls': measurement.api_calls,
+        'success': result.get('success', False) if isinstance(result, dict) else bool(result)
+    }
+    report.append(row)
+    print(f"{name:<16}{size:>8}{row['wall_seconds']:>10.2f}{row['queries']:>10}"
+          f"{row['peak_memory_kb']:>12}{row['api_calls']:>8}  {'ok' if row['success'] else 'FAILED'}")
+    return result
+
+
+def is_scratch_database(url):
+    """True for a SQLite database in memory or in the temporary directory"""
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.exc import ArgumentError
+
+    try:
+        url = make_url(url)
+    except ArgumentError:
+        return False
+    if url.get_backend_name() != 'sqlite':
+        return False
+    if not url.database or url.database == ':memory:':
+        return True
+    temp_dir = os.path.realpath(tempfile.gettempdir())
+    return os.path.commonpath([os.path.realpath(url.database), temp_dir]) == temp_dir
+
+
+def benchmark_size(size, args, control_url, report):
+    from app import app, db
+    from models import HetznerProject, HetznerServer
+    from hetzner_service import HetznerService, sync_projects
+
+    run_id = f'{size}-{int(time.time())}'
+    tokens = [f'bench-{run_id}-p{n}' for n in range(PROJECT_COUNT)]
+
+    with app.app_context():
+        # Start every size from an empty server table and fresh fake accounts
+        HetznerServer.query.delete()
+        projects = HetznerProject.query.order_by(HetznerProject.id).limit(PROJECT_COUNT).all()
+        if len(projects) < PROJECT_COUNT:
+            raise RuntimeError(f'Benchmark needs {PROJECT_COUNT} Hetzner projects in the database')
+        for project, token in zip(projects, tokens):
+            project.hetzner_api_token = token
+            project.is_active = True
+            requests.post(f'{control_url}/seed', json={'token': token, 'servers': size,
+                                                         'labels': {'managed-by': 'dynamic-servers'}}, timeout=600)
+        db.session.commit()
+        project_ids = [project.id for project in projects]
+
+        def sync():
+            db.session.expunge_all()
+            return HetznerService(project_id=project_ids[0]).sync_servers_from_hetzner()
+
+        run_scenario('sync-initial', size, control_url, sync, report)
+        run_scenario('sync-unchanged', size, control_url, sync, report)
+
+        requests.post(f'{control_url}/mutate', json={'token': tokens[0], 'fraction': 0.01}, timeout=60)
+        run_scenario('sync-1pct', size, control_url, sync, report)
+
+        for n in range(args.creates):
+            run_scenario('create-server', size, control_url,
+                         lambda: HetznerService(project_id=project_ids[0]).create_server(f'bench-new-{run_id}-{n}', 'cx22'),
+                         report)
+
+        def sync_all():
+            results = sync_projects(project_ids)
+            return {'success': all(result['success'] for result in results.values())}
+
+        run_scenario('sync-projects', size * PROJECT_COUNT, control_url, sync_all, report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Hetzner sync and provisioning against the fake API')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                       help='Fleet sizes to benchmark (default: 100 1000 10000)')
+    parser.add_argument('--creates', type=int, default=3,
+                       help='create_server calls per size (default: 3)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                       help='Seconds of latency the fake API adds to every call')
+    parser.add_argument('--rate-limit', type=int, default=1000000,
+                       help='Fake API requests per hour per token (default: effectively unlimited)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                       help='Probability of a 503 from the fake API')
+    parser.add_argument('--rate-limit-error-rate', type=float, default=0.0,
+                       help='Probability of a spurious 429 from the fake API')
+    parser.add_argument('--action-duration', type=float, default=0.0,
+                       help='Seconds until fake actions succeed')
+    parser.add_argument('--database', help='Database URL (default: a temporary SQLite file)')
+    parser.add_argument('--i-know-this-wipes-data', action='store_true',
+                       help='Allow a --database that is not a temporary SQLite file; its servers are deleted')
+    parser.add_argument('--output', help='Append results as JSON lines to this file')
+
+    args = parser.parse_args()
+    if args.database and not args.i_know_this_wipes_data and not is_scratch_database(args.database):
+        parser.error('--database must be a SQLite file in the temporary directory: the benchmark deletes '
+                     'all servers and overwrites project tokens. Pass --i-know-this-wipes-data to use it anyway.')
+
+    database_dir = tempfile.mkdtemp(prefix='hetzner-bench-')
+    port = free_port()
+    process, control_url = start_fake_api(port, args)
+
+    # app reads its configuration at import time
+    os.environ['HETZNER_API_ENDPOINT'] = f'http://127.0.0.1:{port}/v1'
+    os.environ['DATABASE_URL'] = args.database or f"sqlite:///{os.path.join(database_dir, 'benchmark.db')}"
+    os.environ.setdefault('SESSION_SECRET', 'benchmark')
+
+    try:
+        import app  # noqa: F401  creates the tables and sample projects
+        logging.getLogger().setLevel(logging.WARNING)
+
+        report = []
+        print(f"{'scenario':<16}{'servers':>8}{'wall s':>10}{'queries':>10}{'peak KB':>12}{'API':>8}")
+        for size in args.sizes:
+            benchmark_size(size, args, control_url, report)
+
+        if args.output:
+            started_at = datetime.utcnow().isoformat()
+            with open(args.output, 'a') as f:
+                for row in report:
+                    f.write(json.dumps(dict(row, run_at=started_at, latency=args.latency)) + '\n')
+            print(f"Results appended to {args.output}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Fake Hetzner Cloud API
+======================
+
+A local stand-in for the parts of the Hetzner Cloud API this app uses
+(servers, server actions, actions, images, server types, locations and
+metrics), compatible with hcloud.Client. Every API token gets its own
+account. Latency, rate limiting, spurious 429s and 5xx errors can be
+injected to load-test HetznerService without touching the real API.
+
+Usage:
+    python test_scripts/fake_hetzner_api.py --port 8765 --servers 1000 --token bench
+    HETZNER_API_ENDPOINT=http://127.0.0.1:8765/v1 python main.py
+
+Control endpoints (no authentication):
+    POST /_fake/seed     {"token": "...", "servers": 1000, "labels": {...}}
+    POST /_fake/config   {"latency": 0.02, "rate_limit": 3600, "error_rate": 0.01, ...}
+    POST /_fake/mutate   {"token": "...", "fraction": 0.01}  change some server statuses
+    GET  /_fake/stats    request counters
+    POST /_fake/reset    drop all accounts and counters
+"""
+
+import argparse
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+LOCATION = {
+    'id': 1, 'name': 'nbg1', 'description': 'Nuremberg DC Park 1', 'country': 'DE',
+    'city': 'Nuremberg', 'latitude': 49.452102, 'longitude': 11.076665, 'network_zone': 'eu-central'
+}
+DATACENTER = {
+    'id': 2, 'name': 'nbg1-dc3', 'description': 'Nuremberg 1 virtual DC 3', 'location': LOCATION,
+    'server_types': {'supported': [1, 2, 3], 'available': [1, 2, 3], 'available_for_migration': [1, 2, 3]}
+}
+SERVER_TYPES = [
+    {'id': 1, 'name': 'cx22', 'description': 'CX22', 'cores': 2, 'memory': 4.0, 'disk': 40,
+     'storage_type': 'local', 'cpu_type': 'shared', 'architecture': 'x86', 'deprecated': False,
+     'prices': [{'location': 'nbg1', 'price_hourly': {'net': '0.0060', 'gross': '0.0071'},
+                 'price_monthly': {'net': '3.7900', 'gross': '4.5101'}}]},
+    {'id': 2, 'name': 'cx32', 'description': 'CX32', 'cores': 4, 'memory': 8.0, 'disk': 80,
+     'storage_type': 'local', 'cpu_type': 'shared', 'architecture': 'x86', 'deprecated': False,
+     'prices': [{'location': 'nbg1', 'price_hourly': {'net': '0.0110', 'gross': '0.0131'},
+                 'price_monthly': {'net': '6.8000', 'gross': '8.0920'}}]},
+    {'id': 3, 'name': 'cx42', 'description': 'CX42', 'cores': 8, 'memory': 16.0, 'disk': 160,
+     'storage_type': 'local', 'cpu_type': 'shared', 'architecture': 'x86', 'deprecated': False,
+     'prices': [{'location': 'nbg1', 'price_hourly': {'net': '0.0270', 'gross': '0.0321'},
+                 'price_monthly': {'net': '16.4000', 'gross': '19.5160'}}]},
+]
+IMAGES = [
+    {'id': 67794396, 'type': 'system', 'status': 'available', 'name': 'ubuntu-22.04',
+     'description': 'Ubuntu 22.04', 'os_flavor': 'ubuntu', 'os_version': '22.04',
+     'rapid_deploy': True, 'architecture': 'x86', 'created': '2023-01-01T00:00:00+00:00',
+     'labels': {}, 'protection': {'delete': False}},
+    {'id': 114690387, 'type': 'system', 'status': 'available', 'name': 'debian-12',
+     'description': 'Debian 12', 'os_flavor': 'debian', 'os_version': '12',
+     'rapid_deploy': True, 'architecture': 'x86', 'created': '2023-06-13T00:00:00+00:00',
+     'labels': {}, 'protection': {'delete': False}},
+]
+SERVER_ACTIONS = {
+    'poweron': ('start_server', 'running'),
+    'poweroff': ('stop_server', 'off'),
+    'shutdown': ('shutdown_server', 'off'),
+    'reboot': ('reboot_server', 'running'),
+    'reset': ('reset_server', 'running'),
+}
+MAX_PER_PAGE = 50
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _error(status, code, message):
+    response = jsonify({'error': {'code': code, 'message': message, 'details': {}}})
+    response.status_code = status
+    return response
+
+
+class FakeAccount:
+    """Servers and actions visible to one API token"""
+
+    def __init__(self):
+        self.servers = {}
+        self.actions = {}
+
+
+class FakeHetznerAPI:
+    """State, fault injection and the Flask app of the fake API"""
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=3600, error_rate=0.0,
+                 rate_limit_error_rate=0.0, action_duration=0.5):
+        self.lock = threading.Lock()
+        self.accounts = {}
+        self.buckets = {}  # token -> [tokens, updated]
+        self.next_id = 1000
+        self.config = {
+            'latency': latency,  # seconds added to every API call
+            'jitter': jitter,  # extra random latency, up to this many seconds
+            'rate_limit': rate_limit,  # requests per hour per token, as a token bucket
+            'error_rate': error_rate,  # probability of a 503
+            'rate_limit_error_rate': rate_limit_error_rate,  # probability of a spurious 429
+            'action_duration': action_duration  # seconds until an action succeeds
+        }
+        self.stats = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'by_endpoint': {}}
+        self.app = self._build_app()
+
+    # State helpers
+
+    def _new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+    def account(self, token):
+        with self.lock:
+            return self.accounts.setdefault(token, FakeAccount())
+
+    def seed(self, token, count, labels=None, name_prefix='bench'):
+        account = self.account(token)
+        created = _now() - timedelta(days=30)
+        for _ in range(count):
+            server_id = self._new_id()
+            account.servers[server_id] = self._make_server(server_id, f'{name_prefix}-{server_id}', SERVER_TYPES[server_id % 3],
+                                                           IMAGES[0], dict(labels or {}), 'running', created)
+        return len(account.servers)
+
+    def mutate(self, token, fraction):
+        account = self.account(token)
+        servers = list(account.servers.values())
+        changed = random.sample(servers, min(len(servers), math.ceil(len(servers) * fraction)))
+        for server in changed:
+            server['status'] = 'off' if server['status'] == 'running' else 'running'
+        return len(changed)
+
+    def _make_server(self, server_id, name, server_type, image, labels, status, created):
+        ip = f'10.{(server_id >> 16) & 255}.{(server_id >> 8) & 255}.{server_id & 255}'
+        return {
+            'id': server_id,
+            'name': name,
+            'status': status,
+            'created': _iso(created),
+            'public_net': {
+                'ipv4': {'id': server_id, 'ip': ip, 'blocked': False, 'dns_ptr': f'static.{ip}.clients.your-server.de'},
+                'ipv6': {'id': server_id + 1, 'ip': f'2a01:4f8:{server_id & 0xffff:x}::/64', 'blocked': False, 'dns_ptr': []},
+                'floating_ips': [],
+                'firewalls': []
+            },
+            'private_net': [],
+            'server_type': server_type,
+            'datacenter': DATACENTER,
+            'image': image,
+            'iso': None,
+            'rescue_enabled': False,
+            'locked': False,
+            'backup_window': None,
+            'outgoing_traffic': 0,
+            'ingoing_traffic': 0,
+            'included_traffic': 21990232555520,
+            'protection': {'delete': False, 'rebuild': False},
+            'labels': labels,
+            'volumes': [],
+            'load_balancers': [],
+            'primary_disk_size': server_type['disk'],
+            'placement_group': None
+        }
+
+    def _new_action(self, account, command, server_id, final_status=None):
+        action_id = self._new_id()
+        started = _now()
+        account.actions[action_id] = {
+            'id': action_id,
+            'command': command,
+            'status': 'running',
+            'progress': 0,
+            'started': started,
+            'finished': None,
+            'resources': [{'id': server_id, 'type': 'server'}],
+            'error': None,
+            '_final_status': final_status
+        }
+        return self._action_json(account, action_id)
+
+    def _action_json(self, account, action_id):
+        """Advance an action by elapsed time and render it"""
+        action = account.actions[action_id]
+        if action['status'] == 'running':
+            duration = self.config['action_duration']
+            elapsed = (_now() - action['started']).total_seconds()
+            if elapsed >= duration:
+                action.update(status='success', progress=100, finished=_now())
+                server = account.servers.get(action['resources'][0]['id'])
+                if server is not None and action['_final_status']:
+                    server['status'] = action['_final_status']
+            else:
+                action['progress'] = int(100 * elapsed / duration) if duration else 100
+        return {key: (_iso(value) if isinstance(value, datetime) else value)
+                for key, value in action.items() if not key.startswith('_')}
+
+    # Fault injection and rate limiting
+
+    def _take_token(self, token):
+        """Token bucket per API token; returns (allowed, remaining, reset)"""
+        limit = self.config['rate_limit']
+        refill_rate = limit / 3600
+        now = time.time()
+        with self.lock:
+            tokens, updated = self.buckets.get(token, (float(limit), now))
+            tokens = min(limit, tokens + (now - updated) * refill_rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[token] = (tokens, now)
+        reset = int(now + (limit - tokens) / refill_rate)
+        return allowed, int(tokens), reset
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _before_request(self):
+        if request.path.startswith('/_fake'):
+            return None
+
+        endpoint = f'{request.method} {request.url_rule.rule if request.url_rule else request.path}'
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['by_endpoint'][endpoint] = self.stats['by_endpoint'].get(endpoint, 0) + 1
+
+        delay = self.config['latency'] + random.uniform(0, self.config['jitter'])
+        if delay:
+            time.sleep(delay)
+
+        auth = request.headers.get('Authorization', '')
+        if not auth.startswith('Bearer '):
+            return _error(401, 'unauthorized', 'unable to authenticate')
+        request.environ['fake.token'] = auth[len('Bearer '):]
+
+        allowed, remaining, reset = self._take_token(request.environ['fake.token'])
+        request.environ['fake.rate_limit'] = (remaining, reset)
+        if not allowed or random.random() < self.config['rate_limit_error_rate']:
+            self._count('rate_limited')
+            return _error(429, 'rate_limit_exceeded', 'limit of requests per hour reached')
+        if random.random() < self.config['error_rate']:
+            self._count('errors')
+            return _error(503, 'unavailable', 'service temporarily unavailable')
+        return None
+
+    def _after_request(self, response):
+        if 'fake.rate_limit' in request.environ:
+            remaining, reset = request.environ['fake.rate_limit']
+            response.headers['RateLimit-Limit'] = str(self.config['rate_limit'])
+            response.headers['RateLimit-Remaining'] = str(remaining)
+            response.headers['RateLimit-Reset'] = str(reset)
+        return response
+
+    # Routes
+
+    def _build_app(self):
+        app = Flask(__name__)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+        def current_account():
+            return self.account(request.environ['fake.token'])
+
+        def paginate(key, items):
+            page = max(int(request.args.get('page', 1)), 1)
+            per_page = min(max(int(request.args.get('per_page', 25)), 1), MAX_PER_PAGE)
+            last_page = max(math.ceil(len(items) / per_page), 1)
+            return jsonify({
+                key: items[(page - 1) * per_page:page * per_page],
+                'meta': {'pagination': {
+                    'page': page,
+                    'per_page': per_page,
+                    'previous_page': page - 1 if page > 1 else None,
+                    'next_page': page + 1 if page < last_page else None,
+                    'last_page': last_page,
+                    'total_entries': len(items)
+                }}
+            })
+
+        def matches_labels(labels, selector):
+            for term in filter(None, (selector or '').split(',')):
+                key, _, value = term.partition('=')
+                if key not in labels or (value and labels[key] != value):
+                    return False
+            return True
+
+        @app.route('/v1/servers', methods=['GET'])
+        def list_servers():
+            account = current_account()
+            name = request.args.get('name')
+            statuses = request.args.getlist('status')
+            selector = request.args.get('label_selector')
+            servers = [server for server_id, server in sorted(account.servers.items())
+                       if (not name or server['name'] == name)
+                       and (not statuses or server['status'] in statuses)
+                       and matches_labels(server['labels'], selector)]
+            return paginate('servers', servers)
+
+        @app.route('/v1/servers', methods=['POST'])
+        def create_server():
+            account = current_account()
+            data = request.get_json(force=True)
+            server_type = next((st for st in SERVER_TYPES if st['name'] == data.get('server_type')), None)
+            image = next((img for img in IMAGES if img['name'] == data.get('image')), None)
+            if server_type is None or image is None:
+                return _error(422, 'invalid_input', 'unknown server_type or image')
+            if any(server['name'] == data.get('name') for server in account.servers.values()):
+                return _error(409, 'uniqueness_error', 'server name is already used')
+
+            server_id = self._new_id()
+            server = self._make_server(server_id, data['name'], server_type, image,
+                                       data.get('labels') or {}, 'initializing', _now())
+            account.servers[server_id] = server
+            action = self._new_action(account, 'create_server', server_id, final_status='running')
+            return jsonify({'server': server, 'action': action, 'next_actions': [], 'root_password': None}), 201
+
+        @app.route('/v1/servers/<int:server_id>', methods=['GET'])
+        def get_server(server_id):
+            server = current_account().servers.get(server_id)
+            if server is None:
+                return _error(404, 'not_found', f"server with ID '{server_id}' not found")
+            return jsonify({'server': server})
+
+        @app.route('/v1/servers/<int:server_id>', methods=['DELETE'])
+        def delete_server(server_id):
+            account = current_account()
+            if account.servers.pop(server_id, None) is None:
+                return _error(404, 'not_found', f"server with ID '{server_id}' not found")
+            return jsonify({'action': self._new_action(account, 'delete_server', server_id)})
+
+        @app.route('/v1/servers/<int:server_id>/actions/<command>', methods=['POST'])
+        def server_action(server_id, command):
+            account = current_account()
+            if server_id not in account.servers:
+                return _error(404, 'not_found', f"server with ID '{server_id}' not found")
+            if command not in SERVER_ACTIONS:
+                return _error(404, 'not_found', f'unknown action {command}')
+            action_command, final_status = SERVER_ACTIONS[command]
+            return jsonify({'action': self._new_action(account, action_command, server_id, final_status)}), 201
+
+        @app.route('/v1/servers/<int:server_id>/metrics', methods=['GET'])
+        def server_metrics(server_id):
+            if server_id not in current_account().servers:
+                return _error(404, 'not_found', f"server with ID '{server_id}' not found")
+            start = datetime.fromisoformat(request.args['start'].replace('Z', '+00:00'))
+            end = datetime.fromisoformat(request.args['end'].replace('Z', '+00:00'))
+            step = int(float(request.args.get('step') or 60))
+            timestamps = range(int(start.timestamp()) // step * step, int(end.timestamp()), step)
+
+            series = {}
+            for metric_type in request.args.get('type', 'cpu').split(','):
+                if metric_type == 'cpu':
+                    names = ['cpu']
+                elif metric_type == 'disk':
+                    names = ['disk.0.iops.read', 'disk.0.iops.write', 'disk.0.bandwidth.read', 'disk.0.bandwidth.write']
+                else:
+                    names = ['network.0.pps.in', 'network.0.pps.out', 'network.0.bandwidth.in', 'network.0.bandwidth.out']
+                for name in names:
+                    series[name] = {'values': [[ts, f'{50 + 40 * math.sin((ts + server_id) / 3600):.3f}'] for ts in timestamps]}
+
+            return jsonify({'metrics': {'start': _iso(start), 'end': _iso(end), 'step': step, 'time_series': series}})
+
+        @app.route('/v1/actions', methods=['GET'])
+        def list_actions():
+            account = current_account()
+            ids = [int(action_id) for action_id in request.args.getlist('id')]
+            actions = [self._action_json(account, action_id) for action_id in (ids or sorted(account.actions))
+                       if action_id in account.actions]
+            return paginate('actions', actions)
+
+        @app.route('/v1/actions/<int:action_id>', methods=['GET'])
+        def get_action(action_id):
+            account = current_account()
+            if action_id not in account.actions:
+                return _error(404, 'not_found', f"action with ID '{action_id}' not found")
+            return jsonify({'action': self._action_json(account, action_id)})
+
+        @app.route('/v1/images', methods=['GET'])
+        def list_images():
+            return paginate('images', IMAGES)
+
+        @app.route('/v1/server_types', methods=['GET'])
+        def list_server_types():
+            return paginate('server_types', SERVER_TYPES)
+
+        @app.route('/v1/locations', methods=['GET'])
+        def list_locations():
+            return paginate('locations', [LOCATION])
+
+        @app.route('/_fake/seed', methods=['POST'])
+        def fake_seed():
+            data = request.get_json(force=True)
+            total = self.seed(data['token'], int(data.get('servers', 0)), data.get('labels'))
+            return jsonify({'token': data['token'], 'servers': total})
+
+        @app.route('/_fake/mutate', methods=['POST'])
+        def fake_mutate():
+            data = request.get_json(force=True)
+            return jsonify({'changed': self.mutate(data['token'], float(data.get('fraction', 0.01)))})
+
+        @app.route('/_fake/config', methods=['POST'])
+        def fake_config():
+            data = request.get_json(force=True)
+            unknown = set(data) - set(self.config)
+            if unknown:
+                return _error(400, 'invalid_input', f'unknown settings: {", ".join(sorted(unknown))}')
+            self.config.update(data)
+            return jsonify(self.config)
+
+        @app.route('/_fake/stats', methods=['GET'])
+        def fake_stats():
+            with self.lock:
+                return jsonify(dict(self.stats, by_endpoint=dict(self.stats['by_endpoint']),
+                                    accounts={token[:8]: len(account.servers) for token, account in self.accounts.items()}))
+
+        @app.route('/_fake/reset', methods=['POST'])
+        def fake_reset():
+            with self.lock:
+                self.accounts.clear()
+                self.buckets.clear()
+                self.stats = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'by_endpoint': {}}
+            return jsonify({'success': True})
+
+        return app
+
+    def serve(self, host='127.0.0.1', port=8765):
+        """Start a threaded HTTP server in the background; returns (server, api_endpoint)"""
+        server = make_server(host, port, self.app, threaded=True)
+        threading.Thread(target=server.serve_forever, name='fake-hetzner-api', daemon=True).start()
+        return server, f'http://{host}:{server.server_port}/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Hetzner Cloud API for load tests')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--token', default='bench', help='Token whose account is seeded')
+    parser.add_argument('--servers', type=int, default=0, help='Synthetic servers to seed')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random latency in seconds')
+    parser.add_argument('--rate-limit', type=int, default=3600, help='Requests per hour per token')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of a 503')
+    parser.add_argument('--rate-limit-error-rate', type=float, default=0.0, help='Probability of a spurious 429')
+    parser.add_argument('--action-duration', type=float, default=0.5, help='Seconds until actions succeed')
+
+    args = parser.parse_args()
+
+    api = FakeHetznerAPI(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                         error_rate=args.error_rate, rate_limit_error_rate=args.rate_limit_error_rate,
+                         action_duration=args.action_duration)
+    if args.servers:
+        api.seed(args.token, args.servers)
+
+    print(f"Fake Hetzner API on http://{args.host}:{args.port}/v1 ({args.servers} servers for token '{args.token}')")
+    make_server(args.host, args.port, api.app, threaded=True).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
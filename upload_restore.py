@@ -0,0 +1,150 @@
+"""
+Uploaded Backup Restores
+Copies a backup file uploaded from the browser to a server as nova_hr.bak
+and runs the restore script there. Used by /upload-restore-backup, which
+streams the request body through it, and by the restore jobs of chunked
+uploads (chunked_upload.py), which stream the assembled staging file.
+"""
+
+import logging
+from datetime import datetime
+from pathlib import Path
+
+from werkzeug.utils import secure_filename
+
+from app import db
+from models import DatabaseBackup
+from ssh_service import SSHService
+from sftp_transfer import upload_stream
+from upload_stream import UploadRejected
+
+logger = logging.getLogger(__name__)
+
+UPLOADED_BACKUP_DIR = 'uploads/backups'  # kept copies of uploaded backups, outside the web-accessible area
+RESTORE_BACKUP_PATH = '/home/dynamic/nova-hr-docker/mssql/backup/nova_hr.bak'  # file the restore script reads
+
+
+def uploaded_backup_path(original_filename):
+    """Path in uploads/backups for the local copy of an uploaded backup"""
+    uploads_dir = Path(UPLOADED_BACKUP_DIR)
+    uploads_dir.mkdir(parents=True, exist_ok=True)
+
+    # Unique filename with timestamp and sanitized original filename
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return uploads_dir / f"uploaded_{timestamp}_{secure_filename(original_filename)}"
+
+
+def restore_uploaded_backup(target_server, blocks, tee_path=None):
+    """Copy an uploaded backup to target_server as nova_hr.bak and run the restore script there
+
+    blocks yields the file's data as it becomes available; with tee_path it is
+    also saved locally on the way. UploadRejected raised by blocks is passed on.
+    Returns success and message, plus output, size and checksum on success.
+    """
+    ssh_service = SSHService()
+
+    # Step 1: Upload backup file to server and replace nova_hr.bak
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    temp_backup_path = f"/tmp/uploaded_restore_{timestamp}.bak"
+
+    # Stream the file to the server via SFTP, hashing it and teeing it to local storage on the way
+    try:
+        with ssh_service._get_ssh_client(target_server) as client:
+            if not client:
+                return {'success': False, 'message': 'Failed to establish SSH connection'}
+
+            file_size, checksum = upload_stream(blocks, client, temp_backup_path, tee_path=tee_path)
+            logger.info(f"Uploaded {file_size:,} bytes to {target_server.name} (SHA-256 {checksum})"
+                        + (f", copy saved to {tee_path}" if tee_path else ""))
+
+            # Move to correct location with proper permissions
+            setup_commands = [
+                'sudo mkdir -p /home/dynamic/nova-hr-docker/mssql/backup',
+                f'sudo cp {temp_backup_path} {RESTORE_BACKUP_PATH}',
+                f'sudo chown 10001:10001 {RESTORE_BACKUP_PATH}',
+                f'sudo chmod 644 {RESTORE_BACKUP_PATH}',
+                f'rm -f {temp_backup_path}'
+            ]
+
+            setup = ssh_service.run_steps(target_server, setup_commands, timeout=300)
+            if not setup['success']:
+                return {'success': False, 'message': f"Failed to setup backup file: {setup['error']}"}
+
+    except UploadRejected:
+        raise
+    except Exception as e:
+        return {'success': False, 'message': f'Failed to upload backup: {str(e)}'}
+
+    # Step 2: Check containers and execute restore
+    try:
+        with ssh_service._get_ssh_client(target_server) as client:
+            if not client:
+                return {'success': False, 'message': 'Failed to establish SSH connection'}
+
+            # Check if containers are running
+            stdin, stdout, stderr = client.exec_command("cd /home/dynamic/nova-hr-docker && docker compose ps --services --filter status=running", timeout=60)
+            stdout.channel.settimeout(30)  # 30 second timeout for container check
+
+            try:
+                exit_code = stdout.channel.recv_exit_status()
+                output = stdout.read().decode('utf-8')
+            except Exception as e:
+                return {'success': False, 'message': f'Failed to check container status: {str(e)}'}
+
+            if exit_code != 0 or 'mssql' not in output:
+                return {'success': False, 'message': 'MSSQL container is not running. Please ensure the application is started.'}
+
+            # Execute restore command with timeout handling
+            restore_command = "cd /home/dynamic/nova-hr-docker && docker compose exec -T mssql /usr/src/app/restore-db.sh"
+            stdin, stdout, stderr = client.exec_command(restore_command, timeout=300)
+
+            # Wait for command completion with timeout
+            channel = stdout.channel
+            channel.settimeout(120)  # 2 minute timeout for restore operation
+
+            try:
+                exit_code = channel.recv_exit_status()
+                output = stdout.read().decode('utf-8')
+                error_output = stderr.read().decode('utf-8')
+            except Exception as e:
+                return {'success': False, 'message': f'Restore operation timed out or failed: {str(e)}'}
+
+            if exit_code != 0:
+                return {'success': False, 'message': f'Restore failed: {error_output or "Unknown error"}'}
+
+            return {
+                'success': True,
+                'message': f'Backup uploaded and successfully restored to {target_server.name}',
+                'output': output,
+                'size': file_size,
+                'checksum': checksum
+            }
+
+    except Exception as e:
+        return {'success': False, 'message': f'Failed to execute restore: {str(e)}'}
+
+
+def record_uploaded_backup(target_server, original_filename, local_backup_path, result, user_id):
+    """Create the DatabaseBackup record of a restored upload; local_backup_path is its kept copy, if any
+
+    Returns the record, or None if it could not be created; the restore itself has succeeded either way.
+    """
+    try:
+        uploaded_backup = DatabaseBackup()
+        uploaded_backup.database_name = f"uploaded_{original_filename}"
+        uploaded_backup.backup_path = str(local_backup_path) if local_backup_path else None
+        uploaded_backup.backup_size = result['size']  # Size in bytes
+        uploaded_backup.checksum = result['checksum']
+        uploaded_backup.backup_type = "full"
+        uploaded_backup.started_at = datetime.utcnow()
+        uploaded_backup.completed_at = datetime.utcnow()
+        uploaded_backup.status = 'completed'
+        uploaded_backup.initiated_by = user_id
+        uploaded_backup.server_id = target_server.id
+        db.session.add(uploaded_backup)
+        db.session.commit()
+        return uploaded_backup
+    except Exception as e:
+        logger.error(f"Failed to create backup record: {str(e)}")
+        db.session.rollback()
+        return None
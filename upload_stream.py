@@ -0,0 +1,91 @@
+"""
+Streaming Uploads
+Reads a multipart/form-data request body as it arrives instead of letting
+Werkzeug spool file parts to a temporary file, so a large upload can be
+written straight to its destination (an SFTP file on the target server)
+block by block. Form fields are collected as they are passed; fields the
+handler needs before the file must be sent ahead of it.
+"""
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+UPLOAD_READ_SIZE = 1024 * 1024  # bytes read from the request body at a time
+BACKUP_UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024  # largest backup file accepted for upload-restore
+MAX_FIELD_SIZE = 64 * 1024  # bytes of a plain form field value
+
+
+class UploadRejected(Exception):
+    """The upload is malformed or exceeds a limit; the message is shown to the user"""
+
+
+class MultipartUpload:
+    """A multipart/form-data request body read one part at a time
+
+    next_file() collects form fields into fields up to the next file part,
+    then iter_file() yields that file's data in blocks as it arrives.
+    """
+
+    def __init__(self, stream, content_type, read_size=UPLOAD_READ_SIZE):
+        mimetype, options = parse_options_header(content_type or '')
+        if mimetype != 'multipart/form-data' or not options.get('boundary'):
+            raise UploadRejected('Expected a multipart/form-data upload')
+
+        self.stream = stream
+        self.read_size = read_size
+        self.decoder = MultipartDecoder(options['boundary'].encode('latin-1'))
+        self.events = self._events()
+        self.fields = {}
+
+    def _events(self):
+        while True:
+            try:
+                event = self.decoder.next_event()
+            except ValueError as e:
+                if self.decoder.complete:
+                    raise UploadRejected('The upload ended unexpectedly')
+                raise UploadRejected(f'Malformed upload: {str(e)}')
+
+            if isinstance(event, NeedData):
+                if self.decoder.complete:
+                    raise UploadRejected('The upload ended unexpectedly')
+                self.decoder.receive_data(self.stream.read(self.read_size) or None)
+                continue
+            yield event
+            if isinstance(event, Epilogue):
+                return
+
+    def next_file(self):
+        """Read form fields up to the next file part; returns its field name and filename, or None at the end"""
+        name, value = None, bytearray()
+        for event in self.events:
+            if isinstance(event, File):
+                return event.name, event.filename
+            if isinstance(event, Field):
+                name, value = event.name, bytearray()
+            elif isinstance(event, Data) and name is not None:
+                value += event.data
+                if len(value) > MAX_FIELD_SIZE:
+                    raise UploadRejected(f'Form field {name} is too large')
+                if not event.more_data:
+                    self.fields[name] = value.decode('utf-8', 'replace')
+                    name = None
+        return None
+
+    def iter_file(self, max_size):
+        """Yield the data of the file part next_file() stopped at
+
+        Raises UploadRejected as soon as the file grows beyond max_size bytes.
+        """
+        size = 0
+        for event in self.events:
+            if not isinstance(event, Data):
+                break
+            size += len(event.data)
+            if size > max_size:
+                raise UploadRejected(f'File size exceeds the {max_size // (1024 * 1024 * 1024)}GB limit')
+            if event.data:
+                yield event.data
+            if not event.more_data:
+                return
+        raise UploadRejected('The upload ended before the file was complete')